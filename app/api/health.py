@@ -1,5 +1,6 @@
 # app/api/health.py
 from fastapi import APIRouter
+from app.services.cache_service import response_cache
 
 router = APIRouter()
 
@@ -7,3 +8,9 @@ router = APIRouter()
 @router.get("/")
 async def health_check():
     return {"status": "Healthy!"}
+
+
+@router.get("/cache")
+async def cache_stats():
+    """Hit, miss and eviction statistics of the in-process response cache."""
+    return response_cache.stats()
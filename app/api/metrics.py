@@ -0,0 +1,29 @@
+# app/api/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.metrics import registry
+from app.services.cache_service import response_cache
+
+router = APIRouter()
+
+response_cache_events = registry.gauge(
+    "response_cache_events",
+    "Response cache hits, misses, evictions, expirations and invalidations since start.",
+    ("event",),
+)
+response_cache_entries = registry.gauge(
+    "response_cache_entries", "Entries currently held in the response cache."
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Expose the process metrics in the Prometheus text format."""
+    stats = response_cache.stats()
+    for event in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        response_cache_events.set(stats[event], event=event)
+    response_cache_entries.set(stats["size"])
+
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,47 +1,151 @@
 # app/api/user_v1.py
+import hashlib
 import logging
-import random
+import time
 from app.services.activityChart_service import (
-    get_top_activities,
+    ImageTooLarge,
+    UnsupportedImageType,
+    upload_image_stream_to_image_bb,
     upload_image_to_image_bb,
 )
-from fastapi import APIRouter, HTTPException, Query, Request
-from fastapi.responses import JSONResponse
-from app.services.auth_service import get_jwt_token
-from app.services.history_services import get_history_count
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from app.services.auth_service import get_jwt_token, get_token_claims
+from app.services.history_services import (
+    decode_history_cursor,
+    list_history,
+    stream_history,
+)
+from app.services.chain_service import build_mint_payload
+from app.services.ingestion_service import (
+    IngestionBatchTooLarge,
+    IngestionQueueFull,
+    get_ingestion_queue,
+)
+from app.services.leaderboard_service import get_top_users as get_leaderboard
+from app.services.leaderboard_service import get_user_rank as get_leaderboard_rank
+from app.services.leaderboard_service import get_user_ranks as get_leaderboard_ranks
 from app.services.user_service import (
-    calculate_rank,
     fetch_users_referrals,
     find_by_address,
-    get_activity_json,
-    get_top_users_by_kleo_points,
+    find_by_address_complex,
+    get_activity_counts,
+    get_activity_summary,
+    is_mint_eligible,
+    stream_users,
 )
-from app.models.user_model import CreateUserRequest, User
-from app.models.history_model import SaveHistoryRequest
-from app.constants import ABI, POLYGON_RPC
+from app.models.user_model import (
+    USER_FIELDS,
+    CreateUserRequest,
+    GetUsersRequest,
+    LeaderboardEntry,
+    RanksRequest,
+    User,
+    UserGraph,
+    UserRank,
+    UserRanks,
+    generate_slug,
+)
+from app.models.history_model import History, SaveHistoryRequest
+from app.responses import FastJSONResponse, dumps
+from app.settings import settings
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Serializers compiled once from the response shapes
+leaderboard_adapter = TypeAdapter(List[LeaderboardEntry])
+user_rank_adapter = TypeAdapter(UserRank)
+user_ranks_adapter = TypeAdapter(UserRanks)
+user_graph_adapter = TypeAdapter(UserGraph)
+
+
+def etag_response(
+    request: Request,
+    content,
+    adapter: TypeAdapter = None,
+    etag_content=None,
+    headers: dict = None,
+) -> Response:
+    """
+    Render `content` as JSON with a strong ETag, or answer 304 Not Modified
+    when the client already holds this exact representation.
+
+    With an `adapter` the content is serialized by pydantic-core against that
+    response shape; otherwise it goes through orjson. `etag_content`, when
+    given, is hashed for the ETag instead of the body, for bodies with fields
+    that change on every request (e.g. an age) while the data does not.
+    """
+    body = adapter.dump_json(content) if adapter is not None else dumps(content)
+    tagged = body if etag_content is None else dumps(etag_content)
+    etag = f'"{hashlib.blake2b(tagged, digest_size=16).hexdigest()}"'
+    headers = {**(headers or {}), "ETag": etag}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def snapshot_age(snapshot_at: float) -> float:
+    """Seconds since `snapshot_at`, for the snapshot_age of leaderboard answers."""
+    return round(max(0.0, time.time() - snapshot_at), 1)
+
+
+def rank_response(rank_data: dict) -> dict:
+    """A rank entry as answered: its snapshot timestamp turned into snapshot_age."""
+    content = {key: value for key, value in rank_data.items() if key != "snapshot_at"}
+    content["snapshot_age"] = snapshot_age(rank_data["snapshot_at"])
+    return content
+
+
+def parse_fields(fields: str):
+    """
+    Parse a comma-separated `fields` query parameter into a sorted tuple of
+    user document fields. Returns None for the default profile and ("*",)
+    for the full document.
+    """
+    if fields is None or not fields.strip():
+        return None
+    if fields.strip() == "*":
+        return ("*",)
+
+    selected = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = selected.difference(USER_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+    return tuple(sorted(selected))
+
 
 @router.get("/get-user/{userAddress}")
-async def get_user(userAddress: str):
+async def get_user(
+    userAddress: str,
+    request: Request,
+    fields: str = Query(
+        None,
+        description="Comma-separated fields to return, or * for the full document. "
+        "By default referrals and activity_json are left out; see /referrals and /activity.",
+    ),
+):
     """
     Fetch user data from MongoDB based on the user's address.
     """
-    user_data = await find_by_address(userAddress)
+    user_data = await find_by_address(userAddress, parse_fields(fields))
 
     # If user data is not found, raise a 404 error
     if user_data is None:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Return the user data directly as JSON
-    return user_data
+    return etag_response(request, user_data)
 
 
-@router.get("/top-users")
+@router.get("/top-users", response_model=List[LeaderboardEntry])
 async def get_top_users(
-    limit: int = Query(20, description="Limit the number of top users"),
+    request: Request,
+    limit: int = Query(20, ge=1, le=1000, description="Limit the number of top users"),
     address: str = Query(None, description="User address to fetch rank"),
 ):
     """
@@ -49,118 +153,312 @@ async def get_top_users(
     """
     try:
         # Fetch the top users by Kleo points, limiting the result by the 'limit' parameter
-        leaderboard = await get_top_users_by_kleo_points(limit)
+        page = await get_leaderboard(limit)
+        leaderboard = page["leaderboard"]
 
         # If user_address is provided, calculate the rank and add it at the first position
         if address:
-            user_rank_data = await calculate_rank(address)
+            user_rank_data = await get_leaderboard_rank(address)
 
             if user_rank_data:
                 user_rank_entry = {
                     "address": user_rank_data["address"],
                     "kleo_points": user_rank_data["kleo_points"],
                     "rank": user_rank_data["rank"],
+                    "dense_rank": user_rank_data["dense_rank"],
+                    "percentile": user_rank_data["percentile"],
                 }
-                # Insert the user's rank at the first position in the leaderboard
-                leaderboard.insert(0, user_rank_entry)
-            else:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Error fetching user's rank for address: {address}",
-                )
-
-        return JSONResponse(content=leaderboard, status_code=200)
+                # Put the user's rank at the first position, without mutating the cached page
+                leaderboard = [user_rank_entry] + leaderboard
+
+        # The page is a list, so its age travels in a header
+        return etag_response(
+            request,
+            leaderboard,
+            leaderboard_adapter,
+            headers={"X-Snapshot-Age": str(snapshot_age(page["snapshot_at"]))},
+        )
 
     except Exception as e:
+        logger.error(f"An error occurred while fetching top users: {e}")
         # Return a 500 error if anything goes wrong
         raise HTTPException(
             status_code=500, detail="An error occurred while fetching top users"
         )
 
 
-@router.get("/rank/{userAddress}")
-async def get_user_rank(userAddress: str):
+@router.get("/rank/{userAddress}", response_model=UserRank)
+async def get_user_rank(userAddress: str, request: Request):
     """
     Fetch the user's rank according to kleo_points.
     """
     try:
-        rank_data = await calculate_rank(userAddress)
+        rank_data = await get_leaderboard_rank(userAddress)
+    except Exception as e:
+        logger.error(f"An error occurred while fetching rank for {userAddress}: {e}")
+        raise HTTPException(
+            status_code=500, detail="An error occurred while fetching user's rank"
+        )
 
-        # Handle error if the user is not found or if there's an issue with calculation
-        if "error" in rank_data:
-            raise HTTPException(status_code=404, detail=rank_data["error"])
+    if rank_data is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return etag_response(
+        request, rank_response(rank_data), user_rank_adapter, etag_content=rank_data
+    )
+
+
+@router.post("/ranks", response_model=UserRanks)
+async def get_user_ranks(ranks_request: RanksRequest):
+    """
+    Fetch the ranks of many users in one request, resolved together rather
+    than one lookup per address. Unknown addresses are listed in `not_found`.
+    """
+    if not ranks_request.addresses:
+        raise HTTPException(status_code=400, detail="No addresses given")
+    if len(ranks_request.addresses) > settings.RANKS_MAX_ADDRESSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.RANKS_MAX_ADDRESSES} addresses per request",
+        )
 
-        return rank_data
+    try:
+        result = await get_leaderboard_ranks(ranks_request.addresses)
     except Exception as e:
+        logger.error(f"An error occurred while fetching ranks: {e}")
         raise HTTPException(
-            status_code=500, detail="An error occurred while fetching user's rank"
+            status_code=500, detail="An error occurred while fetching user ranks"
         )
 
+    result["ranks"] = [rank_response(rank_data) for rank_data in result["ranks"]]
+    return Response(content=user_ranks_adapter.dump_json(result), media_type="application/json")
+
+
+@router.post("/get-users")
+async def get_users(get_users_request: GetUsersRequest):
+    """
+    Fetch many user profiles in one request, streamed as application/x-ndjson.
+    `fields` selects the returned fields as for /get-user; `address` and
+    `address_key` are always included. Users are looked up
+    GET_USERS_CHUNK_SIZE addresses at a time and sent in cursor order, not in
+    request order; each chunk is followed by a
+    {"address": ..., "error": "not_found"} line for its unknown addresses.
+    """
+    if not get_users_request.addresses:
+        raise HTTPException(status_code=400, detail="No addresses given")
+    if len(get_users_request.addresses) > settings.GET_USERS_MAX_ADDRESSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.GET_USERS_MAX_ADDRESSES} addresses per request",
+        )
+
+    fields = parse_fields(get_users_request.fields)
+    return StreamingResponse(
+        ndjson_lines(stream_users(get_users_request.addresses, fields)),
+        media_type="application/x-ndjson",
+    )
+
 
 @router.get("/referrals/{userAddress}")
-async def get_user_referrals(userAddress: str):
+async def get_user_referrals(
+    userAddress: str,
+    response: Response,
+    limit: int = Query(None, ge=1, le=1000, description="Page size"),
+    cursor: int = Query(0, ge=0, description="Cursor returned in X-Next-Cursor"),
+    sort_by_points: bool = Query(False, description="Sort referrals by kleo_points"),
+):
     """
     Fetch the user's referrals based on the user's address.
+    When `limit` is given, the cursor of the next page is returned in the
+    X-Next-Cursor header.
     """
     try:
-        referrals = await fetch_users_referrals(userAddress)
+        result = await fetch_users_referrals(
+            userAddress, limit=limit, cursor=cursor, sort_by_points=sort_by_points
+        )
+    except Exception as e:
+        logger.error(f"An error occurred while fetching referrals: {e}")
+        raise HTTPException(
+            status_code=500, detail="An error occurred while fetching user's referrals"
+        )
 
-        # If an error occurs or no referrals are found
-        if "error" in referrals:
-            raise HTTPException(status_code=404, detail=referrals["error"])
+    if result is None:
+        raise HTTPException(status_code=404, detail="User not found")
 
-        return referrals
+    if result["next_cursor"] is not None:
+        response.headers["X-Next-Cursor"] = str(result["next_cursor"])
+
+    return result["referrals"]
+
+
+async def ndjson_lines(documents):
+    """Render an async iterable of documents as newline-delimited JSON."""
+    async for document in documents:
+        yield dumps(document) + b"\n"
+
+
+@router.get("/history/{userAddress}")
+async def get_user_history(
+    userAddress: str,
+    limit: int = Query(
+        None, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE, description="Page size"
+    ),
+    cursor: str = Query(None, description="Cursor returned in X-Next-Cursor"),
+    category: str = Query(None, description="Only this activity category"),
+    domain: str = Query(None, description="Only this domain"),
+    since: float = Query(None, description="Earliest visitTime (ms), inclusive"),
+    until: float = Query(None, description="Latest visitTime (ms), inclusive"),
+    stream: bool = Query(False, description="Stream every matching row as NDJSON"),
+    batch_size: int = Query(
+        None, ge=1, le=10000, description="Rows fetched per round trip when streaming"
+    ),
+    claims: dict = Depends(get_token_claims),
+):
+    """
+    Fetch the user's browsing history, newest first.
+    Pages are keyset-paginated: pass the X-Next-Cursor header of a page as
+    `cursor` to get the next one. With `stream=true` all matching rows (or
+    the first `limit`) are sent as application/x-ndjson instead.
+    """
+    if claims is not None:
+        token_address = claims.get("payload", {}).get("publicAddress", "")
+        if token_address.lower() != userAddress.lower():
+            raise HTTPException(status_code=403, detail="Token does not match address")
+
+    filters = {"category": category, "domain": domain, "since": since, "until": until}
+    try:
+        if cursor:
+            decode_history_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if stream:
+        return StreamingResponse(
+            ndjson_lines(
+                stream_history(
+                    userAddress, limit=limit, cursor=cursor, batch_size=batch_size, **filters
+                )
+            ),
+            media_type="application/x-ndjson",
+        )
+
+    try:
+        result = await list_history(userAddress, limit=limit, cursor=cursor, **filters)
     except Exception as e:
+        logger.error(f"An error occurred while fetching history: {e}")
         raise HTTPException(
-            status_code=500, detail="An error occurred while fetching user's referrals"
+            status_code=500, detail="An error occurred while fetching user's history"
         )
 
+    headers = {}
+    if result["next_cursor"] is not None:
+        headers["X-Next-Cursor"] = result["next_cursor"]
+
+    # Returned directly so the ObjectIds go through orjson, not jsonable_encoder
+    return FastJSONResponse(result["history"], headers=headers)
+
+
+# Size of the chunks read from multipart file parts.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+async def _read_upload_file(upload):
+    """Yield the content of a multipart file part in chunks."""
+    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
 
-@router.post("/upload_activity_chart")
+@router.post("/upload_activity_chart", dependencies=[Depends(get_token_claims)])
 async def upload_activity_chart(request: Request):
     """
     Upload an activity chart (image) and return the URL after uploading it to Imgbb.
+
+    Accepts either JSON with a base64 `image` field, the raw image bytes as the
+    request body (`Content-Type: image/*` or `application/octet-stream`), or
+    multipart/form-data with an `image` file part. Raw and multipart uploads
+    are streamed to Imgbb.
     """
+    content_type = request.headers.get("content-type", "")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        # Base64 in JSON is about 4/3 of the image size
+        limit = settings.MAX_UPLOAD_BYTES
+        if not content_type.startswith(("image/", "application/octet-stream")):
+            limit = limit * 4 // 3 + 1024
+        if int(content_length) > limit:
+            raise HTTPException(status_code=413, detail="Image is too large")
+
     try:
-        # Retrieve the JSON data from the request
-        data = await request.json()
-        image_data = data.get("image")
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("image")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="No image data provided")
+            image_url = await upload_image_stream_to_image_bb(_read_upload_file(upload))
+        elif content_type.startswith(("image/", "application/octet-stream")):
+            image_url = await upload_image_stream_to_image_bb(request.stream())
+        else:
+            # Retrieve the JSON data from the request
+            data = await request.json()
+            image_data = data.get("image")
 
-        if not image_data:
-            raise HTTPException(status_code=400, detail="No image data provided")
+            if not image_data:
+                raise HTTPException(status_code=400, detail="No image data provided")
 
-        # Call the function to upload the image to Imgbb
-        image_url = await upload_image_to_image_bb(image_data)
+            # Call the function to upload the image to Imgbb
+            image_url = await upload_image_to_image_bb(image_data)
 
         if image_url:
-            return JSONResponse(content={"url": image_url}, status_code=200)
+            return {"url": image_url}
         else:
             raise HTTPException(status_code=500, detail="Image upload failed")
 
+    except HTTPException:
+        raise
+    except UnsupportedImageType as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"An error occurred while uploading the image: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/activity/{userAddress}")
+async def get_user_activity(userAddress: str, request: Request):
+    """Fetch the user's activity counts per category."""
+    try:
+        activity_counts = await get_activity_counts(userAddress)
+    except Exception as e:
+        logger.error(f"An error occurred while fetching user activity: {e}")
+        raise HTTPException(
+            status_code=500, detail="An error occurred while fetching user activity."
+        )
+
+    if activity_counts is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return etag_response(request, activity_counts)
+
+
 @router.get("/get-user-graph/{userAddress}")
-async def get_user_graph(userAddress: str):
+async def get_user_graph(userAddress: str, request: Request):
     """Fetch user graph data based on the user's activity."""
     try:
         if not userAddress:
             raise HTTPException(status_code=400, detail="Address is required")
 
-        # Directly get the activity json
-        activity_json = await get_activity_json(userAddress)
-        if not activity_json:
+        # The top activities are materialized on the user at ingestion time
+        top_activities = await get_activity_summary(userAddress)
+        if not top_activities:
             return {"processing": {"error": True}}
 
-        # Get top activities from the activity_json
-        top_activities = await get_top_activities(activity_json)
-
-        return {"data": top_activities}
+        return etag_response(request, {"data": top_activities}, user_graph_adapter)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
+        logger.error(f"An error occurred while fetching user graph: {e}")
         raise HTTPException(
             status_code=500, detail="An error occurred while fetching user graph data."
         )
@@ -184,9 +482,7 @@ async def create_user(request: CreateUserRequest):
         user_data = {"password": user["slug"], "token": token}
         return user_data
 
-    random_code = str(random.randint(100, 9999999))
-
-    user = User(address=wallet_address, slug=random_code)
+    user = User(address=wallet_address, slug=generate_slug())
     response = await user.save(signup=True)  # Call async save method
 
     try:
@@ -203,65 +499,101 @@ async def create_user(request: CreateUserRequest):
 
 
 @router.post("/save-history")
-async def save_history(request: SaveHistoryRequest):
+async def save_history(
+    request: SaveHistoryRequest,
+    mode: str = Query(
+        None,
+        pattern="^(sync|async)$",
+        description="sync writes before answering; async queues the batch and "
+        "answers 202 with a job id. Defaults to HISTORY_INGEST_MODE.",
+    ),
+    include_abi: bool = Query(
+        False, description="Also return the contract ABI and call parameters"
+    ),
+    claims: dict = Depends(get_token_claims),
+):
+    """
+    Ingest a batch of browsing history items for a user and return the
+    minting payload once the user is eligible.
+    """
+    if not request.address:
+        raise HTTPException(status_code=400, detail="Address is required")
+
+    if claims is not None:
+        token_address = claims.get("payload", {}).get("publicAddress", "")
+        if token_address.lower() != request.address.lower():
+            raise HTTPException(status_code=403, detail="Token does not match address")
+
+    if (mode or settings.HISTORY_INGEST_MODE) == "async":
+        return await enqueue_history(request)
+
     try:
-        if not request.address or request.signup or request.history:
-            raise HTTPException(status_code=400, detail="Address is required")
-        
         user_address = request.address.lower()
-        print(user_address)
-        signup = request.signup
-        print(signup)
-        history_items = request.history
-        print(history_items)
-
-        user = find_by_address_complex(user_address)
-        print(user)
-        
-        for item in history_items:
-            try:
-                history = History(
-                    address=user_address,
-                    title=item.get('title', ''),
-                    category=item.get('category', ''),
-                    subcategory=item.get('subcategory', ''),
-                    url=item.get('url', ''),
-                    domain=item.get('domain', ''),
-                    summary=item.get('content', ''),
-                    visitTime=float(item.get('lastVisitTime', 0))
-                )
-                print(history)
-                result = await history.save()
-                print(result)
-            except (AssertionError, ValueError) as e:
-                logger.error(f"Error saving history item: {str(e)}")
-                pass
-        
+
+        ingestion = await History.save_many(user_address, request.history)
+        if ingestion["invalid"] or ingestion["failed"]:
+            logger.warning(
+                f"History ingestion for {user_address} had "
+                f"{ingestion['invalid']} invalid and {ingestion['failed']} failed items"
+            )
+
+        user = await find_by_address_complex(user_address) or {}
+
         chain_data_list = []
-        print(get_history_count(address))
-        if get_history_count(address) > 10:
-            chain_data_list = [
-                        {
-                            "name": "polygon",
-                            "rpc": POLYGON_RPC,
-                            "contractData": {
-                                "address": "0xD133A1aE09EAA45c51Daa898031c0037485347B0",
-                                "abi": ABI,
-                                "functionName": "safeMint",
-                                "functionParams": [
-                                    user_address,
-                                    user.get("previous_hash", "default_hash"),
-                                ],
-                            },
-                        }
-                    ]
-            print(chain_data_list)
+        if is_mint_eligible(user):
+            try:
+                chain_data_list = [
+                    build_mint_payload(
+                        user_address,
+                        user.get("previous_hash", "default_hash"),
+                        include_abi=include_abi,
+                    )
+                ]
+            except ValueError as e:
+                # e.g. an address that is not a valid EVM address cannot mint
+                logger.warning(f"Cannot build mint payload for {user_address}: {e}")
 
         response = {
-                    "chains": chain_data_list,
-                    "password": user.get("slug")
-                }
-        return jsonify({"data": response}), 200
-        # Placeholder response, no further processing at this moment
+            "chains": chain_data_list,
+            "password": user.get("slug"),
+            "ingestion": ingestion,
+        }
+        return {"data": response}
     except Exception as e:
+        logger.error(f"An error occurred while saving history: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def enqueue_history(request: SaveHistoryRequest):
+    """Validate the batch, hand it to the write-behind queue and answer 202."""
+    user_address = request.address.lower()
+    documents, invalid = History.build_documents(user_address, request.history)
+    try:
+        job = await get_ingestion_queue().submit(
+            user_address, documents, received=len(request.history), invalid=invalid
+        )
+    except IngestionBatchTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except IngestionQueueFull as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, round(settings.INGEST_BATCH_MAX_WAIT_SECONDS)))},
+        )
+    except Exception as e:
+        logger.error(f"An error occurred while queueing history: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return FastJSONResponse(
+        {"data": {"job": job, "status_url": f"/api/v1/user/save-history/jobs/{job['job_id']}"}},
+        status_code=202,
+    )
+
+
+@router.get("/save-history/jobs/{job_id}")
+async def get_history_job(job_id: str):
+    """Fetch the status of a queued /save-history batch, whichever worker accepted it."""
+    job = await get_ingestion_queue().get_status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -1,15 +1,70 @@
 # app/main.py
-from app.mongodb import close_db_connection
+import asyncio
+from contextlib import asynccontextmanager
+from app.mongodb import close_db_connection, connect_to_mongo, ensure_indexes_in_background
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.api.health import router as health_router
+from app.api.metrics import router as metrics_router
 from app.api.user_v1 import router as user_router
+from app.services.activityChart_service import close_http_client, start_http_client
+from app.services.history_services import run_history_reconciler
+from app.services.ingestion_service import start_ingestion_queue, stop_ingestion_queue
+from app.services.invalidation_service import start_invalidation_bus, stop_invalidation_bus
+from app.services.leaderboard_service import (
+    run_leaderboard_materializer,
+    run_leaderboard_refresher,
+)
+from app.services.user_service import backfill_activity_summaries
 from app.settings import settings
 from app.logging_config import setup_logging, logger
+from app.middleware import MetricsMiddleware
+from app.responses import FastJSONResponse
 
 # Set up logging
 setup_logging()
 
-app = FastAPI(title=settings.PROJECT_NAME)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared clients and background tasks for the lifetime of the app."""
+    logger.info("Starting up the FastAPI application.")
+    if settings.FAST_STARTUP:
+        # The HTTP client is created by the first upload that needs it
+        await connect_to_mongo(fast=True)
+        app.state.index_task = asyncio.create_task(ensure_indexes_in_background())
+    else:
+        await connect_to_mongo()
+        await start_http_client()
+        app.state.index_task = None
+    await start_invalidation_bus()
+    await start_ingestion_queue()
+    app.state.leaderboard_task = asyncio.create_task(run_leaderboard_refresher())
+    app.state.leaderboard_snapshot_task = asyncio.create_task(run_leaderboard_materializer())
+    app.state.activity_backfill_task = asyncio.create_task(backfill_activity_summaries())
+    app.state.history_reconcile_task = asyncio.create_task(run_history_reconciler())
+
+    yield
+
+    logger.info("Shutting down the FastAPI application.")
+    app.state.leaderboard_task.cancel()
+    app.state.leaderboard_snapshot_task.cancel()
+    app.state.activity_backfill_task.cancel()
+    app.state.history_reconcile_task.cancel()
+    if app.state.index_task is not None:
+        app.state.index_task.cancel()
+    await stop_ingestion_queue()
+    await stop_invalidation_bus()
+    await close_http_client()
+    await close_db_connection()
+
+
+app = FastAPI(
+    title=settings.PROJECT_NAME,
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+)
 
 
 # Add CORS middleware
@@ -26,22 +81,15 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Added last so it is the outermost middleware and times the whole request
+app.add_middleware(MetricsMiddleware)
+
 # Include the API routers
 app.include_router(user_router, prefix="/api/v1/user")
+app.include_router(health_router, prefix="/health")
+app.include_router(metrics_router)
 
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the FastAPI application!"}
-
-
-# Optional: Log startup events
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Starting up the FastAPI application.")
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("Shutting down the FastAPI application.")
-    await close_db_connection()
@@ -0,0 +1,241 @@
+# app/metrics.py
+import threading
+from bisect import bisect_left
+
+# Default latency buckets in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key: tuple, value) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, key: tuple, state) -> list:
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(
+                f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            )
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Holds the process metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# HTTP server
+http_requests_total = registry.counter(
+    "http_requests_total",
+    "HTTP requests handled, by route template and status code.",
+    ("method", "route", "status"),
+)
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency, by route template.",
+    ("method", "route"),
+)
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being handled.",
+    ("method",),
+)
+
+# MongoDB commands
+mongodb_command_duration_seconds = registry.histogram(
+    "mongodb_command_duration_seconds",
+    "MongoDB command latency, by collection and command.",
+    ("collection", "command"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+mongodb_command_failures_total = registry.counter(
+    "mongodb_command_failures_total",
+    "Failed MongoDB commands, by collection and command.",
+    ("collection", "command"),
+)
+
+# Outbound HTTP (Imgbb)
+http_client_request_duration_seconds = registry.histogram(
+    "http_client_request_duration_seconds",
+    "Outbound HTTP request latency, by host and status code.",
+    ("host", "method", "status"),
+)
+http_client_errors_total = registry.counter(
+    "http_client_errors_total",
+    "Outbound HTTP requests that failed before a response, by host.",
+    ("host", "method"),
+)
+
+# History ingestion queue
+ingest_queue_items = registry.gauge(
+    "history_ingest_queue_items",
+    "History items accepted but not yet written to MongoDB.",
+)
+ingest_rejected_total = registry.counter(
+    "history_ingest_rejected_total",
+    "History jobs rejected because the ingestion queue was full.",
+)
+ingest_batch_items = registry.histogram(
+    "history_ingest_batch_items",
+    "History items written per ingestion batch.",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+ingest_flush_failures_total = registry.counter(
+    "history_ingest_flush_failures_total",
+    "Ingestion batches that failed to reach MongoDB and were retried.",
+)
+history_ingest_skipped_total = registry.counter(
+    "history_ingest_skipped_total",
+    "History rows not written because they were already stored, by how it was known "
+    "(batch: repeated in the request, bloom: per-address filter, existing: unique key).",
+    ("reason",),
+)
+history_bloom_bytes = registry.gauge(
+    "history_bloom_bytes",
+    "Memory held by the per-address history Bloom filters.",
+)
+
+# Cache invalidation bus
+cache_invalidation_events_total = registry.counter(
+    "cache_invalidation_events_total",
+    "Invalidation events applied to the in-process caches, by collection and operation.",
+    ("collection", "operation"),
+)
+cache_invalidation_stream_restarts_total = registry.counter(
+    "cache_invalidation_stream_restarts_total",
+    "Restarts of the invalidation change stream (error: resumed from the last token, "
+    "history_lost: token unusable, caches cleared).",
+    ("reason",),
+)
@@ -0,0 +1,66 @@
+# app/middleware.py
+import time
+from app.metrics import (
+    http_request_duration_seconds,
+    http_requests_in_flight,
+    http_requests_total,
+)
+
+
+def route_template(scope) -> str:
+    """
+    Full route template of a handled request, e.g. /api/v1/user/rank/{userAddress}.
+    Routes of included routers only know their own path, so the router prefix
+    is recovered from the concrete request path.
+    """
+    route = scope.get("route")
+    template = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if not template:
+        return "unmatched"
+
+    path = scope.get("path", "")
+    try:
+        concrete = template.format(**scope.get("path_params", {}))
+    except (KeyError, IndexError, ValueError):
+        return template
+    if concrete and path.endswith(concrete):
+        return path[: len(path) - len(concrete)] + template
+    return template
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency, in-flight requests and status
+    codes. Requests are labelled with the matched route template (e.g.
+    /api/v1/user/rank/{userAddress}) rather than the raw path, so label
+    cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc(method=method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec(method=method)
+            route_path = route_template(scope)
+            http_request_duration_seconds.observe(
+                time.perf_counter() - started, method=method, route=route_path
+            )
+            http_requests_total.inc(method=method, route=route_path, status=status_code)
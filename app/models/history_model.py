@@ -1,9 +1,30 @@
 # user.models.py
+from collections import Counter
 from pydantic import BaseModel
-from app.services.user_service import find_by_address_complex
-from app.mongodb import history_collection
+from app.constants import ACTIVITIES
+from app.services.user_service import (
+    find_by_address_complex,
+    increment_history_counters_or_retry,
+    normalize_address,
+)
+from app.services.invalidation_service import publish_invalidation
+from app.services.history_services import history_data_quantity, upsert_history_documents
 from datetime import datetime
-from app.models.user_model import User
+from app.models.user_model import User, generate_slug
+
+ACTIVITY_CATEGORIES = frozenset(ACTIVITIES)
+
+
+def count_activities(documents: list) -> dict:
+    """Count history documents per known activity category."""
+    return dict(
+        Counter(
+            document["category"]
+            for document in documents
+            if document["category"] in ACTIVITY_CATEGORIES
+        )
+    )
+
 
 class SaveHistoryRequest(BaseModel):
     address: str
@@ -21,8 +42,11 @@ class History:
         subcategory="",
         domain="",
         summary="",
-        create_timestamp=int(datetime.now().timestamp()),
+        create_timestamp=None,
     ):
+        if create_timestamp is None:
+            create_timestamp = int(datetime.now().timestamp())
+
         assert isinstance(address, str)
         assert isinstance(create_timestamp, int)
         assert isinstance(title, str)
@@ -35,6 +59,7 @@ class History:
 
         self.document = {
             "address": address,
+            "address_key": normalize_address(address),
             "create_timestamp": create_timestamp,
             "title": title,
             "category": category,
@@ -45,10 +70,94 @@ class History:
             "visitTime": visitTime,
         }
 
+    @classmethod
+    def from_extension_item(cls, address: str, item: dict, create_timestamp=None):
+        """
+        Build a History entry from a raw item sent by the browser extension.
+        """
+        return cls(
+            address=address,
+            title=item.get("title", ""),
+            category=item.get("category", ""),
+            subcategory=item.get("subcategory", ""),
+            url=item.get("url", ""),
+            domain=item.get("domain", ""),
+            summary=item.get("content", ""),
+            visitTime=float(item.get("lastVisitTime", 0)),
+            create_timestamp=create_timestamp,
+        )
+
+    @classmethod
+    def build_documents(cls, address: str, items: list) -> tuple:
+        """
+        Validate a batch of extension items.
+        Returns (documents, invalid) where invalid is the number of rejected items.
+        """
+        create_timestamp = int(datetime.now().timestamp())
+        documents = []
+        invalid = 0
+        for item in items:
+            try:
+                documents.append(
+                    cls.from_extension_item(address, item, create_timestamp).document
+                )
+            except (AssertionError, ValueError, TypeError, AttributeError):
+                invalid += 1
+        return documents, invalid
+
+    @classmethod
+    async def save_many(cls, address: str, items: list) -> dict:
+        """
+        Validate a whole batch of extension items, make sure the user exists
+        once, then write the valid items with chunked unordered upserts.
+
+        Returns a summary with per-item counts: received, inserted, invalid
+        (failed validation), duplicates (already stored) and failed (rejected by Mongo).
+        """
+        documents, invalid = cls.build_documents(address, items)
+
+        result = {
+            "received": len(items),
+            "inserted": 0,
+            "invalid": invalid,
+            "duplicates": 0,
+            "failed": 0,
+        }
+        if not documents:
+            return result
+
+        existing_user = await find_by_address_complex(address)
+        if not existing_user:
+            await User(address=address, slug=generate_slug()).save()
+
+        write_result = await upsert_history_documents(documents)
+        if write_result["inserted"]:
+            written = [documents[index] for index in write_result["inserted_indexes"]]
+            await increment_history_counters_or_retry(
+                address,
+                count_activities(written),
+                history_count=len(written),
+                data_quantity=history_data_quantity(written),
+            )
+            publish_invalidation("history", "insert", normalize_address(address))
+        result["inserted"] = write_result["inserted"]
+        result["duplicates"] = write_result["duplicates"]
+        result["failed"] = write_result["failed"]
+        return result
+
     async def save(self):
         existing_user = await find_by_address_complex(self.document["address"])
         if not existing_user:
-            new_user = User(address=self.document["address"])
+            new_user = User(address=self.document["address"], slug=generate_slug())
             await new_user.save()
-        # Save the history
-        return await history_collection.insert_one(self.document)
+        # Save the history; a row the user already has is left as is
+        result = await upsert_history_documents([self.document])
+        if result["inserted"]:
+            await increment_history_counters_or_retry(
+                self.document["address"],
+                count_activities([self.document]),
+                history_count=1,
+                data_quantity=history_data_quantity([self.document]),
+            )
+            publish_invalidation("history", "insert", self.document["address_key"])
+        return result
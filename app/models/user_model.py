@@ -1,13 +1,101 @@
 # user.models.py
+import random
+from typing import List, Optional, Union
 from pydantic import BaseModel
-from app.services.user_service import find_by_address_complex
-from app.mongodb import user_collection
+from pymongo.errors import DuplicateKeyError
+from typing_extensions import TypedDict
+from app.services.user_service import find_by_address_complex, normalize_address
+from app.mongodb import get_db
+from app.services.invalidation_service import publish_invalidation
+
+
+# Top-level fields of a user document, selectable with /get-user?fields=
+USER_FIELDS = (
+    "_id",
+    "address",
+    "address_key",
+    "slug",
+    "name",
+    "stage",
+    "verified",
+    "last_cards_marked",
+    "about",
+    "pfp",
+    "content_tags",
+    "last_attested",
+    "identity_tags",
+    "badges",
+    "kleo_points",
+    "settings",
+    "first_time_user",
+    "total_data_quantity",
+    "history_count",
+    "activity_json",
+    "activity_summary",
+    "milestones",
+    "referrals",
+    "referee",
+    "pii_removed_count",
+)
 
 
 class CreateUserRequest(BaseModel):
     address: str
 
 
+class RanksRequest(BaseModel):
+    addresses: List[str]
+
+
+class GetUsersRequest(BaseModel):
+    addresses: List[str]
+    # Comma-separated, as the `fields` query parameter of /get-user
+    fields: Optional[str] = None
+
+
+# Response shapes of the read endpoints. They are TypedDicts so the service
+# dicts serialize straight through pydantic-core without building models.
+# `rank` is the competition rank (ties share a rank, 1, 2, 2, 4), `dense_rank`
+# leaves no gaps (1, 2, 2, 3) and `percentile` is the share of users ranked
+# at or below the user.
+class LeaderboardEntry(TypedDict):
+    rank: int
+    dense_rank: int
+    percentile: float
+    address: str
+    kleo_points: Union[int, float]
+
+
+class UserRank(TypedDict):
+    address: str
+    kleo_points: Union[int, float]
+    rank: int
+    dense_rank: int
+    percentile: float
+    total_users: int
+    # Seconds since the ranking this answer comes from was computed
+    snapshot_age: float
+
+
+class UserRanks(TypedDict):
+    ranks: List[UserRank]
+    not_found: List[str]
+
+
+class ActivityShare(TypedDict):
+    label: str
+    percentage: int
+
+
+class UserGraph(TypedDict):
+    data: List[ActivityShare]
+
+
+def generate_slug() -> str:
+    """Generate the random numeric slug handed back to new users as their password."""
+    return str(random.randint(100, 9999999))
+
+
 class User:
     def __init__(
         self,
@@ -28,7 +116,9 @@ class User:
         settings: dict = None,
         first_time_user: bool = True,
         total_data_quantity: int = 0,
+        history_count: int = 0,
         activity_json: dict = None,
+        activity_summary: list = None,
         milestones: dict = None,
         referrals: list = None,
         referee: str = None,
@@ -44,6 +134,8 @@ class User:
             settings = {}
         if activity_json is None:
             activity_json = {}
+        if activity_summary is None:
+            activity_summary = []
         if milestones is None:
             milestones = {
                 "tweet_activity_graph": False,
@@ -71,6 +163,9 @@ class User:
         assert isinstance(settings, dict)
         assert isinstance(first_time_user, bool)
         assert isinstance(total_data_quantity, int)
+        assert isinstance(history_count, int)
+        assert isinstance(activity_json, dict)
+        assert isinstance(activity_summary, list)
         assert isinstance(milestones, dict)
         assert isinstance(referrals, list)
         assert referee is None or isinstance(referee, str)
@@ -78,6 +173,7 @@ class User:
 
         self.document = {
             "address": address,
+            "address_key": normalize_address(address),
             "slug": slug,
             "name": name,
             "stage": stage,
@@ -93,6 +189,9 @@ class User:
             "settings": settings,
             "first_time_user": first_time_user,
             "total_data_quantity": total_data_quantity,
+            "history_count": history_count,
+            "activity_json": activity_json,
+            "activity_summary": activity_summary,
             "milestones": milestones,
             "referrals": referrals,
             "referee": referee,
@@ -106,7 +205,18 @@ class User:
         if existing_user_address:
             return existing_user_address
         else:
-            await user_collection.insert_one(
-                self.document
-            )  # Make sure this is an async call
+            try:
+                await get_db().users.insert_one(
+                    self.document
+                )  # Make sure this is an async call
+            except DuplicateKeyError:
+                # Created concurrently (e.g. a first sync racing /create-user)
+                return await find_by_address_complex(self.document["address"])
+            publish_invalidation(
+                "users",
+                "insert",
+                self.document["address_key"],
+                address=self.document["address"],
+                kleo_points=self.document["kleo_points"],
+            )
         return self.document
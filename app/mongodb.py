@@ -1,20 +1,274 @@
 # app/mongodb.py
-import motor.motor_asyncio  # type: ignore
+import asyncio
+import importlib.util
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel, monitoring
+from pymongo.errors import OperationFailure
+from app.metrics import mongodb_command_duration_seconds, mongodb_command_failures_total
 from app.settings import settings
 
-# Create a MongoDB client
-client = motor.motor_asyncio.AsyncIOMotorClient(settings.DB_URL)
-db = client[settings.DB_NAME]  # Access the database using the name from settings
+logger = logging.getLogger(__name__)
+
+# The MongoDB client and database, created by connect_to_mongo() in the app lifespan
+client = None
+db = None
+
+# Python packages pymongo needs for each wire compressor; zlib is built in.
+COMPRESSOR_PACKAGES = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Indexes required by the service lookups, keyed by collection name.
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("address_key", ASCENDING)], unique=True, name="address_key_unique"),
+        IndexModel([("kleo_points", DESCENDING)], name="kleo_points_desc"),
+    ],
+    "history": [
+        # Serves history counts and the keyset-paginated /history listing
+        IndexModel(
+            [("address_key", ASCENDING), ("visitTime", DESCENDING), ("_id", DESCENDING)],
+            name="address_key_visitTime_id",
+        ),
+        # Natural key of a history row; makes re-sent extension items idempotent
+        IndexModel(
+            [("address_key", ASCENDING), ("url", ASCENDING), ("visitTime", ASCENDING)],
+            unique=True,
+            name="address_key_url_visitTime_unique",
+        ),
+    ],
+    # Statuses of async /save-history jobs, readable by every worker
+    "ingest_jobs": [
+        IndexModel(
+            [("updated_at", ASCENDING)],
+            expireAfterSeconds=settings.INGEST_JOB_STATUS_TTL_SECONDS,
+            name="updated_at_ttl",
+        ),
+    ],
+    # Kept by the $out that rebuilds the collection
+    "leaderboard_snapshots": [
+        IndexModel([("address_key", ASCENDING)], unique=True, name="address_key_unique"),
+        IndexModel([("rank", ASCENDING), ("address_key", ASCENDING)], name="rank_address_key"),
+    ],
+}
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Times every MongoDB command by collection and command name."""
+
+    def __init__(self):
+        self._collections = {}  # (connection_id, request_id) -> collection
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = ""
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        mongodb_command_duration_seconds.observe(
+            event.duration_micros / 1e6, collection=collection, command=event.command_name
+        )
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        mongodb_command_duration_seconds.observe(
+            event.duration_micros / 1e6, collection=collection, command=event.command_name
+        )
+        mongodb_command_failures_total.inc(collection=collection, command=event.command_name)
+
+
+def get_db():
+    """
+    Return the application database.
+    Raises RuntimeError if connect_to_mongo() has not run yet.
+    """
+    if db is None:
+        raise RuntimeError("MongoDB is not connected. Call connect_to_mongo() first.")
+    return db
+
+
+def available_compressors(requested: list) -> list:
+    """Keep the requested wire compressors whose Python package is installed."""
+    compressors = []
+    for name in requested:
+        if name not in COMPRESSOR_PACKAGES:
+            logger.warning(f"Unknown MongoDB compressor {name!r} ignored")
+            continue
+        package = COMPRESSOR_PACKAGES[name]
+        if package and importlib.util.find_spec(package) is None:
+            logger.warning(f"MongoDB compressor {name!r} needs {package}, skipping it")
+            continue
+        compressors.append(name)
+    return compressors
+
+
+def create_client():
+    """Build the Motor client with the pool, timeout and compression settings."""
+    import motor.motor_asyncio  # type: ignore  # imported on first use to keep app startup light
+
+    options = {
+        "maxPoolSize": settings.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": settings.MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": settings.MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "appname": settings.PROJECT_NAME,
+        "event_listeners": [CommandMetricsListener()],
+    }
+    compressors = available_compressors(settings.MONGO_COMPRESSORS)
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return motor.motor_asyncio.AsyncIOMotorClient(settings.DB_URL, **options)
+
+
+async def warm_up_pool(connections: int):
+    """
+    Open `connections` pooled connections up front by running that many
+    concurrent pings, so the first requests after a deploy do not pay for
+    connection setup and the TLS handshake.
+    """
+    if connections <= 0:
+        return
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(connections)))
+
+
+async def connect_to_mongo(fast: bool = False):
+    """
+    Create the MongoDB client, check the server is reachable, warm up the
+    connection pool and ensure the required indexes.
+    With `fast`, only the client is created; it connects on the first command
+    and the caller is left to run ensure_indexes().
+    """
+    global client, db
+    if client is not None:
+        return
+
+    client = create_client()
+    db = client[settings.DB_NAME]  # Access the database using the name from settings
+    if fast:
+        return
+
+    await client.admin.command("ping")
+    await warm_up_pool(settings.MONGO_WARMUP_CONNECTIONS)
+    await ensure_indexes()
+    logger.info("Connected to MongoDB.")
+
+
+async def backfill_address_keys():
+    """
+    Store the canonical lowercase `address_key` on documents written before it existed.
+    Only documents missing the key are touched, so this is cheap once backfilled.
+    """
+    for name in ("users", "history"):
+        result = await get_db()[name].update_many(
+            {"address_key": {"$exists": False}},
+            [{"$set": {"address_key": {"$toLower": "$address"}}}],
+        )
+        if result.modified_count:
+            logger.info(f"Backfilled address_key on {result.modified_count} {name} documents")
+
+
+async def remove_duplicate_history() -> int:
+    """
+    Delete all but the first history row of every (address_key, url, visitTime)
+    key, so the unique history index can be built over data written before it.
+    """
+    pipeline = [
+        {
+            "$group": {
+                "_id": {"address_key": "$address_key", "url": "$url", "visitTime": "$visitTime"},
+                "ids": {"$push": "$_id"},
+                "count": {"$sum": 1},
+            }
+        },
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    removed = 0
+    async for group in get_db().history.aggregate(pipeline, allowDiskUse=True):
+        result = await get_db().history.delete_many({"_id": {"$in": group["ids"][1:]}})
+        removed += result.deleted_count
+    if removed:
+        logger.info(f"Removed {removed} duplicate history documents")
+    return removed
+
+
+async def find_duplicate_users(limit: int = 20) -> list:
+    """
+    Up to `limit` address_keys held by more than one user. The exact-case
+    address lookup used before address_key existed could create users whose
+    addresses differ only by case; they block the unique address_key index.
+    """
+    pipeline = [
+        {"$group": {"_id": "$address_key", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": limit},
+    ]
+    return [group["_id"] async for group in get_db().users.aggregate(pipeline, allowDiskUse=True)]
+
+
+async def ensure_index(name: str, index: IndexModel):
+    """Create one index, dropping repeated history rows first if they block it."""
+    try:
+        await get_db()[name].create_indexes([index])
+    except OperationFailure as e:
+        if name != "history" or e.code != DUPLICATE_KEY_ERROR:
+            raise
+        # Rows ingested before deduplication; drop the repeats and retry once
+        await remove_duplicate_history()
+        await get_db()[name].create_indexes([index])
+
+
+async def ensure_indexes():
+    """
+    Idempotently create the indexes the service relies on.
+    Safe to run on every startup; existing indexes are left untouched.
+
+    Indexes are created one at a time, so one that cannot be built does not
+    hold back the others. Users sharing an address_key are not merged
+    automatically: they are reported and RuntimeError is raised, since
+    lookups by address are ambiguous until they are resolved.
+    """
+    await backfill_address_keys()
+    duplicate_users = []
+    for name, indexes in REQUIRED_INDEXES.items():
+        for index in indexes:
+            try:
+                await ensure_index(name, index)
+            except OperationFailure as e:
+                if name == "users" and e.code == DUPLICATE_KEY_ERROR:
+                    duplicate_users = await find_duplicate_users()
+                logger.error(f"Failed to ensure index {index.document['name']} on {name}: {e}")
+
+    if duplicate_users:
+        raise RuntimeError(
+            "Users differing only by address case block the unique address_key index; "
+            f"merge or remove them before starting: {', '.join(map(str, duplicate_users))}"
+        )
+
+
+async def ensure_indexes_in_background():
+    """ensure_indexes() for FAST_STARTUP, run as a task once the app is serving."""
+    try:
+        await ensure_indexes()
+        logger.info("Ensured MongoDB indexes.")
+    except Exception as e:
+        logger.error(f"Failed to ensure indexes in the background: {e}")
 
-# Define the user collection
-user_collection = db["users"]
-history_collection = db["history"]
 
 async def close_db_connection():
     """
     Close the MongoDB client connection.
     """
+    global client, db
     if client is not None:
-        await client.close()
+        client.close()
+        client = None
+        db = None
     else:
-        print("MongoDB client is not initialized.")
+        logger.warning("MongoDB client is not initialized.")
@@ -1,17 +1,208 @@
-import httpx  # async HTTP client to replace `requests`
+import asyncio
+import base64
+import binascii
+import hashlib
+import time
+import uuid
 import logging
+from collections import OrderedDict
+from datetime import datetime
+from app.metrics import http_client_errors_total, http_client_request_duration_seconds
+from app.mongodb import get_db
 from app.settings import settings
 import json
 
 API_KEY = settings.IMGBB_API_KEY
 IMGBB_UPLOAD_IMG_ENDPOINT = f"https://api.imgbb.com/1/upload?key={API_KEY}"
+IMGBB_HOST = "api.imgbb.com"
+
+# Upstream statuses worth retrying; everything else fails immediately.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Leading bytes of the image formats Imgbb accepts.
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+    b"GIF87a": "image/gif",
+    b"GIF89a": "image/gif",
+    b"BM": "image/bmp",
+}
+# Bytes needed to recognise every signature above (WEBP is RIFF....WEBP).
+SNIFF_BYTES = 12
 
 logger = logging.getLogger(__name__)
 
 
+class UnsupportedImageType(ValueError):
+    """The uploaded bytes are not an image format we accept."""
+
+
+class ImageTooLarge(ValueError):
+    """The uploaded image exceeds settings.MAX_UPLOAD_BYTES."""
+
+
+# App-scoped pooled client, opened and closed with the application.
+http_client = None
+
+# content digest -> uploaded image URL, most recently used last
+_upload_url_cache = OrderedDict()
+
+
+async def _start_request_timer(request):
+    request.extensions["started_at"] = time.perf_counter()
+
+
+async def _observe_response(response):
+    request = response.request
+    started_at = request.extensions.get("started_at")
+    if started_at is not None:
+        http_client_request_duration_seconds.observe(
+            time.perf_counter() - started_at,
+            host=request.url.host,
+            method=request.method,
+            status=response.status_code,
+        )
+
+
+def create_http_client(transport=None):
+    """
+    Build the pooled outbound HTTP client with keep-alive limits and explicit timeouts.
+    A custom transport (e.g. httpx.MockTransport) can be passed for tests.
+    Request latency is recorded through event hooks.
+    """
+    import httpx  # imported on first use to keep app startup light
+
+    return httpx.AsyncClient(
+        transport=transport,
+        event_hooks={"request": [_start_request_timer], "response": [_observe_response]},
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(
+            settings.HTTP_TIMEOUT_SECONDS, connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS
+        ),
+    )
+
+
+async def start_http_client(transport=None):
+    """Open the app-scoped HTTP client."""
+    global http_client
+    if http_client is None:
+        http_client = create_http_client(transport)
+
+
+async def close_http_client():
+    """Close the app-scoped HTTP client and its pooled connections."""
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+def get_http_client():
+    """Return the app-scoped client, creating it on first use outside the app lifecycle."""
+    global http_client
+    if http_client is None:
+        http_client = create_http_client()
+    return http_client
+
+
+def image_digest(image_data) -> str:
+    """
+    SHA-256 of the image content. Base64 strings are hashed on their decoded
+    bytes so the same chart gets the same digest however it was sent.
+    """
+    if isinstance(image_data, str):
+        try:
+            image_data = base64.b64decode(image_data, validate=True)
+        except (binascii.Error, ValueError):
+            image_data = image_data.encode()
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def _remember_upload(digest: str, url: str):
+    _upload_url_cache[digest] = url
+    _upload_url_cache.move_to_end(digest)
+    while len(_upload_url_cache) > settings.IMGBB_CACHE_SIZE:
+        _upload_url_cache.popitem(last=False)
+
+
+async def get_cached_upload(digest: str):
+    """Look up a previously uploaded image, first in memory then in Mongo."""
+    url = _upload_url_cache.get(digest)
+    if url is not None:
+        _upload_url_cache.move_to_end(digest)
+        return url
+
+    try:
+        cached = await get_db().image_uploads.find_one({"_id": digest}, {"url": 1})
+    except Exception as e:
+        logger.error(f"An error occurred while reading the image upload cache: {e}")
+        return None
+
+    if cached:
+        _remember_upload(digest, cached["url"])
+        return cached["url"]
+    return None
+
+
+async def store_cached_upload(digest: str, url: str):
+    """Remember an uploaded image in memory and in Mongo."""
+    _remember_upload(digest, url)
+    try:
+        await get_db().image_uploads.update_one(
+            {"_id": digest},
+            {"$set": {"url": url, "created_at": datetime.now()}},
+            upsert=True,
+        )
+    except Exception as e:
+        logger.error(f"An error occurred while writing the image upload cache: {e}")
+
+
+async def post_to_imgbb(max_retries: int = None, **request_kwargs) -> str:
+    """
+    POST an upload to Imgbb with bounded retries and exponential backoff,
+    returning the viewer URL of the uploaded image.
+    Streamed bodies can only be sent once and must pass max_retries=0.
+    """
+    import httpx
+
+    client = get_http_client()
+    if max_retries is None:
+        max_retries = settings.IMGBB_MAX_RETRIES
+    attempts = max_retries + 1
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        try:
+            response = await client.post(IMGBB_UPLOAD_IMG_ENDPOINT, **request_kwargs)
+        except httpx.TransportError as e:
+            http_client_errors_total.inc(host=IMGBB_HOST, method="POST")
+            if last_attempt:
+                raise Exception(f"Image upload failed: {e}")
+            logger.warning(f"Imgbb request failed ({e}), retrying")
+        else:
+            if response.status_code == 200:
+                response_data = response.json()
+
+                if response_data.get("success"):
+                    return response_data["data"]["url_viewer"]
+                logger.error("Image upload unsuccessful: %s", response_data)
+                raise Exception("Image upload unsuccessful.")
+
+            logger.error("Failed to upload image. Status code: %d", response.status_code)
+            if last_attempt or response.status_code not in RETRYABLE_STATUS_CODES:
+                raise Exception(
+                    f"Image upload failed with status code {response.status_code}"
+                )
+
+        await asyncio.sleep(settings.IMGBB_RETRY_BACKOFF_SECONDS * 2**attempt)
+
+
 async def upload_image_to_image_bb(image_data: str) -> str:
     """
     Uploads a base64 image to Imgbb and returns the image URL.
+    Identical images are served from the upload cache without calling Imgbb.
 
     Args:
         image_data (str): Base64 encoded image data.
@@ -20,63 +211,131 @@ async def upload_image_to_image_bb(image_data: str) -> str:
         str: The URL of the uploaded image.
     """
     try:
+        digest = image_digest(image_data)
+        cached_url = await get_cached_upload(digest)
+        if cached_url:
+            return cached_url
+
         # Prepare the payload with the base64 image and the Imgbb API key
         payload = {"image": image_data, "key": API_KEY}
+        url = await post_to_imgbb(data=payload)
 
-        # Make an async POST request to upload the image
-        async with httpx.AsyncClient() as client:
-            response = await client.post(IMGBB_UPLOAD_IMG_ENDPOINT, data=payload)
-
-        # If the upload is successful, return the image URL
-        if response.status_code == 200:
-            response_data = response.json()
-
-            if response_data.get("success"):
-                return response_data["data"]["url_viewer"]
-            else:
-                logger.error("Image upload unsuccessful: %s", response_data)
-                raise Exception("Image upload unsuccessful.")
-        else:
-            logger.error(
-                "Failed to upload image. Status code: %d", response.status_code
-            )
-            raise Exception(
-                f"Image upload failed with status code {response.status_code}"
-            )
+        await store_cached_upload(digest, url)
+        return url
 
     except Exception as e:
         logger.error(f"An error occurred while uploading the image: {e}")
         raise Exception("An error occurred while uploading the image.")
 
 
-async def get_top_activities(activity_counts):
-    """Calculate top activities from the activity counts."""
-    try:
-        if isinstance(activity_counts, str):
-            data = json.loads(activity_counts)
+def sniff_image_type(head: bytes):
+    """Return the MIME type matching the first bytes of an image, or None."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return mime_type
+    return None
 
-        activity_counts = {
-            activity: int(count) for activity, count in activity_counts.items()
-        }
 
-        total_activities = sum(activity_counts.values())
+async def _multipart_image_body(boundary: str, chunks):
+    """Wrap streamed image bytes in a multipart/form-data body with an `image` field."""
+    yield (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="image"; filename="chart"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    async for chunk in chunks:
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
 
-        if total_activities == 0:
-            raise ValueError(
-                "Total activities count is zero, cannot compute percentages."
-            )
 
-        activity_percentages = [
-            {"label": activity, "percentage": round((count / total_activities) * 100)}
-            for activity, count in activity_counts.items()
-        ]
+async def upload_image_stream_to_image_bb(chunks, max_bytes: int = None) -> str:
+    """
+    Stream raw image bytes to Imgbb without buffering the whole image.
 
-        top_activities = sorted(
-            activity_percentages, key=lambda x: x["percentage"], reverse=True
-        )[:8]
+    The first bytes are sniffed before anything is sent upstream, and the
+    upload is aborted as soon as more than `max_bytes` have been read.
 
-        return top_activities
+    Args:
+        chunks: Async iterable of the raw image bytes.
+        max_bytes (int): Size limit, defaults to settings.MAX_UPLOAD_BYTES.
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        raise
+    Returns:
+        str: The URL of the uploaded image.
+
+    Raises:
+        UnsupportedImageType, ImageTooLarge
+    """
+    if max_bytes is None:
+        max_bytes = settings.MAX_UPLOAD_BYTES
+
+    iterator = chunks.__aiter__()
+    head = b""
+    while len(head) < SNIFF_BYTES:
+        try:
+            head += await iterator.__anext__()
+        except StopAsyncIteration:
+            break
+
+    if sniff_image_type(head) is None:
+        raise UnsupportedImageType("Unsupported image type.")
+
+    digest = hashlib.sha256()
+    size = 0
+
+    async def counted_chunks():
+        nonlocal size
+        pending = head
+        while True:
+            if pending:
+                size += len(pending)
+                if size > max_bytes:
+                    raise ImageTooLarge(f"Image exceeds {max_bytes} bytes.")
+                digest.update(pending)
+                yield pending
+            try:
+                pending = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+
+    boundary = uuid.uuid4().hex
+    url = await post_to_imgbb(
+        max_retries=0,
+        content=_multipart_image_body(boundary, counted_chunks()),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+
+    # Later base64 uploads of the same image are served from the cache
+    await store_cached_upload(digest.hexdigest(), url)
+    return url
+
+
+# Number of activities kept in the materialized activity summary.
+TOP_ACTIVITIES_LIMIT = 8
+
+
+def summarize_activities(activity_counts, limit: int = TOP_ACTIVITIES_LIMIT) -> list:
+    """
+    Calculate the top activities, with their share in percent, from the activity counts.
+    Accepts the counts as a dict or, for legacy users, as a JSON string.
+    """
+    if isinstance(activity_counts, str):
+        activity_counts = json.loads(activity_counts) if activity_counts else {}
+
+    activity_counts = {
+        activity: int(count) for activity, count in (activity_counts or {}).items()
+    }
+
+    total_activities = sum(activity_counts.values())
+    if total_activities == 0:
+        return []
+
+    top_activities = sorted(
+        activity_counts.items(), key=lambda item: item[1], reverse=True
+    )[:limit]
+
+    return [
+        {"label": activity, "percentage": round((count / total_activities) * 100)}
+        for activity, count in top_activities
+    ]
@@ -1,18 +1,124 @@
 # auth_service.py
-import os
-import jwt
+import functools
+import hashlib
+import logging
+import time
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from app.services.cache_service import TTLCache
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Claims of tokens that passed verification, keyed by the token's digest and
+# kept until the token expires, so a repeat request skips the signature check.
+verified_tokens = TTLCache(
+    maxsize=settings.JWT_CACHE_SIZE, default_ttl=settings.JWT_TTL_SECONDS
+)
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+@functools.lru_cache(maxsize=None)
+def signing_keys() -> tuple:
+    """
+    (signing key, verification key) for JWT_ALGORITHM, loaded once.
+    HMAC algorithms use JWT_SECRET for both; asymmetric ones read the PEM
+    files at JWT_PRIVATE_KEY_FILE and JWT_PUBLIC_KEY_FILE.
+    """
+    if settings.JWT_ALGORITHM.startswith("HS"):
+        return settings.JWT_SECRET, settings.JWT_SECRET
+
+    with open(settings.JWT_PRIVATE_KEY_FILE) as private_key_file:
+        private_key = private_key_file.read()
+    with open(settings.JWT_PUBLIC_KEY_FILE) as public_key_file:
+        public_key = public_key_file.read()
+    return private_key, public_key
 
 
 def get_jwt_token(wallet: str, slug: str) -> str:
     """Generate a JWT token for the user using their wallet address and slug."""
-    try:
-        SECRET = os.environ.get("SECRET", "default_secret")
-        ALGORITHM = os.environ.get("ALGORITHM", "HS256")
+    import jwt  # imported on first use to keep app startup light
 
-        payload = {"payload": {"slug": slug, "publicAddress": wallet}}
+    try:
+        issued_at = int(time.time())
+        payload = {
+            "payload": {"slug": slug, "publicAddress": wallet},
+            "iat": issued_at,
+            "exp": issued_at + settings.JWT_TTL_SECONDS,
+        }
 
-        access_token = jwt.encode(payload, SECRET, algorithm=ALGORITHM)
+        access_token = jwt.encode(
+            payload, signing_keys()[0], algorithm=settings.JWT_ALGORITHM
+        )
         return access_token
     except Exception as e:
-        print(f"An error occurred while generating JWT: {e}")
+        logger.error(f"An error occurred while generating JWT: {e}")
         return None
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+def verify_jwt_token(token: str) -> dict:
+    """
+    Verify a token's signature, exp and iat and return its claims.
+    Raises jwt.InvalidTokenError when the token is not acceptable.
+
+    Tokens issued before exp and iat were added carry neither. While
+    AUTH_REQUIRED is off they are still accepted on their signature alone,
+    so clients holding one keep working until they sign in again; exp is
+    checked whenever a token has it.
+    """
+    digest = token_digest(token)
+    claims = verified_tokens.get("jwt", digest)
+    if claims is not None:
+        return claims
+
+    import jwt
+
+    claims = jwt.decode(
+        token,
+        signing_keys()[1],
+        algorithms=[settings.JWT_ALGORITHM],
+        options={"require": ["exp", "iat"] if settings.AUTH_REQUIRED else []},
+        leeway=settings.JWT_LEEWAY_SECONDS,
+    )
+    if "exp" not in claims:
+        # Legacy token; cached like a freshly issued one
+        verified_tokens.set("jwt", digest, claims)
+        return claims
+    remaining = claims["exp"] + settings.JWT_LEEWAY_SECONDS - time.time()
+    if remaining > 0:
+        verified_tokens.set("jwt", digest, claims, ttl=remaining)
+    return claims
+
+
+async def get_token_claims(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> dict:
+    """
+    FastAPI dependency returning the claims of the request's bearer token.
+    Answers 401 when the token is missing or invalid, unless AUTH_REQUIRED is
+    off, in which case requests without a token get None.
+    """
+    if credentials is None:
+        if not settings.AUTH_REQUIRED:
+            return None
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    import jwt
+
+    try:
+        return verify_jwt_token(credentials.credentials)
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(
+            status_code=401,
+            detail=f"Invalid token: {e}",
+            headers={"WWW-Authenticate": 'Bearer error="invalid_token"'},
+        )
@@ -0,0 +1,108 @@
+# app/services/bloom_service.py
+import hashlib
+import math
+from collections import OrderedDict
+from app import metrics
+from app.settings import settings
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter sized for `capacity` items at `fp_rate`.
+
+    Positions come from double hashing one blake2b digest, so adding or
+    checking an item costs a single hash regardless of the number of probes.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float):
+        assert capacity > 0
+        assert 0 < fp_rate < 1
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.size = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+    def _positions(self, item: bytes):
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, item: bytes) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def add(self, item: bytes):
+        bits = self.bits
+        for p in self._positions(item):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+class SeenFilters:
+    """
+    One BloomFilter per recently active address, evicted least recently used
+    first so the filters never take more than `max_bytes` together.
+
+    A filter that reaches its capacity is cleared rather than allowed to drift
+    above its false-positive rate; forgetting is safe because the unique
+    history key still rejects rows that are already stored.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float, max_bytes: int):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.max_bytes = max_bytes
+        self.filter_bytes = BloomFilter(capacity, fp_rate).nbytes
+        self.max_filters = max(1, max_bytes // self.filter_bytes)
+        self._filters = OrderedDict()  # address_key -> BloomFilter
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._filters) * self.filter_bytes
+
+    def might_contain(self, address_key: str, item: bytes) -> bool:
+        bloom = self._filters.get(address_key)
+        if bloom is None:
+            return False
+        self._filters.move_to_end(address_key)
+        return item in bloom
+
+    def add(self, address_key: str, items):
+        bloom = self._filters.get(address_key)
+        if bloom is None:
+            bloom = self._filters[address_key] = BloomFilter(self.capacity, self.fp_rate)
+            while len(self._filters) > self.max_filters:
+                self._filters.popitem(last=False)
+        self._filters.move_to_end(address_key)
+        for item in items:
+            if bloom.count >= self.capacity:
+                bloom.clear()
+            bloom.add(item)
+        metrics.history_bloom_bytes.set(self.nbytes)
+
+    def clear(self):
+        self._filters.clear()
+        metrics.history_bloom_bytes.set(0)
+
+
+def history_item_key(document: dict) -> bytes:
+    """Bloom filter item for a history row: its url and visitTime."""
+    return f"{document['url']}\x00{document['visitTime']!r}".encode()
+
+
+seen_history = SeenFilters(
+    capacity=settings.HISTORY_BLOOM_CAPACITY,
+    fp_rate=settings.HISTORY_BLOOM_FP_RATE,
+    max_bytes=settings.HISTORY_BLOOM_MAX_BYTES,
+)
@@ -0,0 +1,156 @@
+# app/services/cache_service.py
+import functools
+import logging
+import time
+from collections import OrderedDict
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded in-process cache with a TTL per key and LRU eviction.
+
+    Keys are (namespace, key) tuples so a whole namespace (e.g. every cached
+    leaderboard page) can be invalidated without scanning the cache.
+    """
+
+    def __init__(self, maxsize: int, default_ttl: float):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # (namespace, key) -> (expires_at, value)
+        self._namespaces = {}  # namespace -> set of keys
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, namespace: str, key, default=None):
+        entry = self._entries.get((namespace, key))
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._remove((namespace, key))
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end((namespace, key))
+        self.hits += 1
+        return value
+
+    def set(self, namespace: str, key, value, ttl: float = None):
+        if ttl is None:
+            ttl = self.default_ttl
+        self._entries[(namespace, key)] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end((namespace, key))
+        self._namespaces.setdefault(namespace, set()).add(key)
+
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, namespace: str, key):
+        if (namespace, key) in self._entries:
+            self._remove((namespace, key))
+            self.invalidations += 1
+
+    def invalidate_namespace(self, namespace: str):
+        for key in list(self._namespaces.get(namespace, ())):
+            self.invalidate(namespace, key)
+
+    def clear(self):
+        self._entries.clear()
+        self._namespaces.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, entry_key):
+        del self._entries[entry_key]
+        namespace, key = entry_key
+        keys = self._namespaces.get(namespace)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._namespaces[namespace]
+
+
+response_cache = TTLCache(
+    maxsize=settings.CACHE_MAX_ENTRIES, default_ttl=settings.CACHE_TTL_SECONDS
+)
+
+
+def cached(namespace, ttl: float = None, key=None):
+    """
+    Cache the result of an async read function in `response_cache`.
+
+    `namespace` is a string or a function of the call arguments returning one,
+    e.g. to group every cached variant of one user under one namespace.
+    `key` builds the cache key from the call arguments; by default the
+    positional and keyword arguments are used as is. None results are not
+    cached, so a user created after a miss is visible immediately.
+    The undecorated function stays available as `.uncached`.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if key is not None:
+                cache_key = key(*args, **kwargs)
+            else:
+                cache_key = (args, tuple(sorted(kwargs.items())))
+
+            cache_namespace = namespace(*args, **kwargs) if callable(namespace) else namespace
+
+            value = response_cache.get(cache_namespace, cache_key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            value = await func(*args, **kwargs)
+            if value is not None:
+                response_cache.set(cache_namespace, cache_key, value, ttl)
+            return value
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
+
+
+def user_namespace(address_key: str) -> str:
+    """Namespace holding every cached profile projection of one user."""
+    return f"user:{address_key}"
+
+
+def invalidate_user(address_key: str):
+    """Drop the cached profile projections and activity graph of a user after a write."""
+    response_cache.invalidate_namespace(user_namespace(address_key))
+    response_cache.invalidate("graph", address_key)
+
+
+def invalidate_leaderboard():
+    """Drop every cached rank and top-users page after kleo_points or users change."""
+    response_cache.invalidate_namespace("rank")
+    response_cache.invalidate_namespace("top")
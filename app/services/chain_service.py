@@ -0,0 +1,237 @@
+# app/services/chain_service.py
+import functools
+import logging
+import re
+from app.constants import KLEO_CONTRACT_ADDRESS, POLYGON_RPC, load_abi
+
+logger = logging.getLogger(__name__)
+
+# --- Keccak-256 --------------------------------------------------------------
+# Ethereum's keccak256 is the original Keccak submission, which pads differently
+# from the SHA3-256 in hashlib, so it is implemented here.
+
+_MASK_64 = (1 << 64) - 1
+_RATE_BYTES = 136  # 1600-bit state minus 2 * 256-bit capacity
+
+# Rotation offsets r[x][y] of the rho step
+_ROTATIONS = (
+    (0, 36, 3, 41, 18),
+    (1, 44, 10, 45, 2),
+    (62, 6, 43, 15, 61),
+    (28, 55, 25, 21, 56),
+    (27, 20, 39, 8, 14),
+)
+
+
+def _round_constants() -> tuple:
+    """Iota round constants, generated by the Keccak LFSR."""
+    constants = []
+    state = 1
+    for _ in range(24):
+        constant = 0
+        for j in range(7):
+            state = ((state << 1) ^ ((state >> 7) * 0x71)) & 0xFF
+            if state & 2:
+                constant ^= 1 << ((1 << j) - 1)
+        constants.append(constant)
+    return tuple(constants)
+
+
+_ROUND_CONSTANTS = _round_constants()
+
+
+def _rotl(value: int, shift: int) -> int:
+    return ((value << shift) | (value >> (64 - shift))) & _MASK_64 if shift else value
+
+
+def _keccak_f(lanes: list) -> list:
+    """Keccak-f[1600] permutation over 25 64-bit lanes indexed x + 5 * y."""
+    for round_constant in _ROUND_CONSTANTS:
+        # theta
+        c = [lanes[x] ^ lanes[x + 5] ^ lanes[x + 10] ^ lanes[x + 15] ^ lanes[x + 20] for x in range(5)]
+        d = [c[(x - 1) % 5] ^ _rotl(c[(x + 1) % 5], 1) for x in range(5)]
+        lanes = [lane ^ d[i % 5] for i, lane in enumerate(lanes)]
+        # rho and pi
+        b = [0] * 25
+        for x in range(5):
+            for y in range(5):
+                b[y + 5 * ((2 * x + 3 * y) % 5)] = _rotl(lanes[x + 5 * y], _ROTATIONS[x][y])
+        # chi
+        lanes = [
+            b[i] ^ (~b[(i + 1) % 5 + i - i % 5] & b[(i + 2) % 5 + i - i % 5] & _MASK_64)
+            for i in range(25)
+        ]
+        # iota
+        lanes[0] ^= round_constant
+    return lanes
+
+
+def keccak256(data: bytes) -> bytes:
+    """Keccak-256 digest of `data`, as used by Ethereum."""
+    padded = bytearray(data)
+    padded.append(0x01)
+    padded.extend(b"\x00" * (-len(padded) % _RATE_BYTES))
+    padded[-1] |= 0x80
+
+    lanes = [0] * 25
+    for start in range(0, len(padded), _RATE_BYTES):
+        block = padded[start : start + _RATE_BYTES]
+        for i in range(_RATE_BYTES // 8):
+            lanes[i] ^= int.from_bytes(block[8 * i : 8 * i + 8], "little")
+        lanes = _keccak_f(lanes)
+
+    return b"".join(lane.to_bytes(8, "little") for lane in lanes[:4])
+
+
+# --- ABI encoding ------------------------------------------------------------
+
+_INTEGER_TYPE = re.compile(r"^(u?)int(\d*)$")
+_FIXED_BYTES_TYPE = re.compile(r"^bytes(\d+)$")
+_ADDRESS = re.compile(r"^0x[0-9a-fA-F]{40}$")
+
+
+def _is_dynamic(abi_type: str) -> bool:
+    return abi_type in ("string", "bytes")
+
+
+def _encode_static(abi_type: str, value) -> bytes:
+    if abi_type == "address":
+        if not isinstance(value, str) or not _ADDRESS.match(value):
+            raise ValueError(f"Invalid address: {value!r}")
+        return bytes.fromhex(value[2:]).rjust(32, b"\x00")
+
+    if abi_type == "bool":
+        if not isinstance(value, bool):
+            raise ValueError(f"Invalid bool: {value!r}")
+        return int(value).to_bytes(32, "big")
+
+    match = _INTEGER_TYPE.match(abi_type)
+    if match:
+        unsigned, bits = match.group(1) == "u", int(match.group(2) or 256)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f"Invalid {abi_type}: {value!r}")
+        low, high = (0, 1 << bits) if unsigned else (-(1 << (bits - 1)), 1 << (bits - 1))
+        if not low <= value < high:
+            raise ValueError(f"{abi_type} out of range: {value}")
+        return (value % (1 << 256)).to_bytes(32, "big")
+
+    match = _FIXED_BYTES_TYPE.match(abi_type)
+    if match:
+        size = int(match.group(1))
+        if not isinstance(value, (bytes, bytearray)) or len(value) != size:
+            raise ValueError(f"Invalid {abi_type}: {value!r}")
+        return bytes(value).ljust(32, b"\x00")
+
+    raise ValueError(f"Unsupported ABI type: {abi_type}")
+
+
+def _encode_dynamic(abi_type: str, value) -> bytes:
+    if abi_type == "string":
+        if not isinstance(value, str):
+            raise ValueError(f"Invalid string: {value!r}")
+        value = value.encode("utf-8")
+    elif not isinstance(value, (bytes, bytearray)):
+        raise ValueError(f"Invalid bytes: {value!r}")
+    padding = -len(value) % 32
+    return len(value).to_bytes(32, "big") + bytes(value) + b"\x00" * padding
+
+
+def encode_arguments(types: tuple, values: list) -> bytes:
+    """ABI-encode `values` as a tuple of `types` (head/tail layout)."""
+    if len(types) != len(values):
+        raise ValueError(f"Expected {len(types)} arguments, got {len(values)}")
+
+    heads = []
+    tails = []
+    for abi_type, value in zip(types, values):
+        if _is_dynamic(abi_type):
+            heads.append(None)
+            tails.append(_encode_dynamic(abi_type, value))
+        else:
+            heads.append(_encode_static(abi_type, value))
+            tails.append(b"")
+
+    offset = 32 * len(types)
+    encoded_heads = []
+    for head, tail in zip(heads, tails):
+        if head is None:
+            head = offset.to_bytes(32, "big")
+            offset += len(tail)
+        encoded_heads.append(head)
+    return b"".join(encoded_heads) + b"".join(tails)
+
+
+class ContractABI:
+    """
+    Functions of a contract ABI, parsed once with their 4-byte selectors.
+    Overloaded functions are addressed by full signature, e.g.
+    "safeTransferFrom(address,address,uint256,bytes)", or by name and arity.
+    """
+
+    def __init__(self, abi: list):
+        self.functions = {}  # signature -> (selector, input types)
+        self._signatures = {}  # name -> [signatures]
+        for entry in abi:
+            if entry.get("type") != "function":
+                continue
+            types = tuple(argument["type"] for argument in entry.get("inputs", []))
+            signature = f"{entry['name']}({','.join(types)})"
+            self.functions[signature] = (keccak256(signature.encode())[:4], types)
+            self._signatures.setdefault(entry["name"], []).append(signature)
+
+    def resolve(self, function: str, arity: int = None) -> str:
+        if function in self.functions:
+            return function
+        candidates = [
+            signature
+            for signature in self._signatures.get(function, [])
+            if arity is None or len(self.functions[signature][1]) == arity
+        ]
+        if len(candidates) != 1:
+            raise ValueError(f"Cannot resolve contract function {function!r}")
+        return candidates[0]
+
+    def selector(self, function: str) -> str:
+        return "0x" + self.functions[self.resolve(function)][0].hex()
+
+    def encode_call(self, function: str, args: list) -> str:
+        """Calldata for calling `function` with `args`, as a 0x-prefixed hex string."""
+        selector, types = self.functions[self.resolve(function, len(args))]
+        return "0x" + (selector + encode_arguments(types, args)).hex()
+
+
+@functools.lru_cache(maxsize=None)
+def kleo_contract() -> ContractABI:
+    """The Kleo NFT contract ABI, parsed on first use."""
+    return ContractABI(load_abi())
+
+
+# --- Chain payloads ----------------------------------------------------------
+
+
+def build_mint_payload(address: str, previous_hash: str, include_abi: bool = False) -> dict:
+    """
+    Chain payload letting the client mint for `address`.
+
+    By default only the ready-to-send transaction is returned: the contract
+    address as `to` and the encoded safeMint calldata as `data`. With
+    `include_abi`, the legacy `contractData` form with the full ABI is added
+    for clients that encode the call themselves.
+    """
+    function_params = [address, previous_hash]
+    payload = {
+        "name": "polygon",
+        "rpc": POLYGON_RPC,
+        "transaction": {
+            "to": KLEO_CONTRACT_ADDRESS,
+            "data": kleo_contract().encode_call("safeMint", function_params),
+        },
+    }
+    if include_abi:
+        payload["contractData"] = {
+            "address": KLEO_CONTRACT_ADDRESS,
+            "abi": load_abi(),
+            "functionName": "safeMint",
+            "functionParams": function_params,
+        }
+    return payload
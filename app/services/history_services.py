@@ -1,13 +1,389 @@
-# app/services/user_service.py
+# app/services/history_services.py
+import asyncio
 import logging
-from app.mongodb import history_collection  # Import the db object from mongodb.py
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app import metrics
+from app.mongodb import DUPLICATE_KEY_ERROR, get_db
+from app.services.bloom_service import history_item_key, seen_history
+from app.services.user_service import normalize_address
+from app.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# Number of history documents sent to Mongo per bulk_write call.
+HISTORY_INSERT_CHUNK_SIZE = 500
+
+# Newest first; matches the address_key_visitTime_id index so pages never sort in memory
+HISTORY_SORT = [("visitTime", DESCENDING), ("_id", DESCENDING)]
+HISTORY_PROJECTION = {"address_key": 0}
+
+# Text fields whose UTF-8 size makes up a user's total_data_quantity
+HISTORY_DATA_FIELDS = ("title", "category", "subcategory", "url", "domain", "summary")
+
+# background_jobs documents recording when a reconcile last started
+HISTORY_BACKFILL_JOB = "history_counter_backfill"
+HISTORY_RECONCILE_JOB = "history_counter_reconcile"
+# Workers starting within this window of each other share one startup backfill
+HISTORY_BACKFILL_CLAIM_SECONDS = 600
+
+
+def history_data_quantity(documents: list) -> int:
+    """Bytes of history text in `documents`, as counted in total_data_quantity."""
+    return sum(
+        len(document.get(field, "").encode("utf-8"))
+        for document in documents
+        for field in HISTORY_DATA_FIELDS
+    )
+
 
 async def get_history_count(address: str) -> int:
     assert isinstance(address, str)
-    
-    address_pattern = re.compile(f"^{address}$", re.IGNORECASE)
-    count = await history_collection.count_documents({"address": address_pattern})
-    return count
\ No newline at end of file
+
+    count = await get_db().history.count_documents(
+        {"address_key": normalize_address(address)}
+    )
+    return count
+
+
+def history_key(document: dict) -> dict:
+    """Natural key of a history row; the extension resends rows with the same key."""
+    return {
+        "address_key": document["address_key"],
+        "url": document["url"],
+        "visitTime": document["visitTime"],
+    }
+
+
+async def upsert_history_documents(
+    documents: list,
+    chunk_size: int = HISTORY_INSERT_CHUNK_SIZE,
+    raise_errors: bool = False,
+    inserted_indexes: list = None,
+) -> dict:
+    """
+    Idempotently write history documents keyed on (address_key, url, visitTime).
+
+    Rows repeated within `documents` or already recorded in the per-address
+    Bloom filters are skipped without a round trip; the rest are sent in
+    chunks of unordered upserts that only insert rows whose key is new.
+    A failing row does not stop the rest of its chunk from being written;
+    failures are counted instead of raised. With `raise_errors`, errors other
+    than per-row write errors (e.g. the server being unreachable) are raised
+    so the caller can retry. Positions inserted are appended to
+    `inserted_indexes` as each chunk completes, so a caller passing its own
+    list still knows the rows written before such an error.
+
+    Returns {"inserted", "duplicates", "failed", "inserted_indexes",
+    "failed_indexes"}, the index lists being positions in `documents`.
+    """
+    candidates = []
+    seen_keys = set()
+    skipped_batch = 0
+    skipped_bloom = 0
+    for position, document in enumerate(documents):
+        key = (document["address_key"], document["url"], document["visitTime"])
+        if key in seen_keys:
+            skipped_batch += 1
+        elif settings.HISTORY_BLOOM_ENABLED and seen_history.might_contain(
+            document["address_key"], history_item_key(document)
+        ):
+            skipped_bloom += 1
+        else:
+            candidates.append(position)
+        seen_keys.add(key)
+
+    if inserted_indexes is None:
+        inserted_indexes = []
+    failed_indexes = []
+    existing = 0
+    for start in range(0, len(candidates), chunk_size):
+        chunk = candidates[start : start + chunk_size]
+        requests = [
+            UpdateOne(
+                history_key(documents[position]),
+                {"$setOnInsert": documents[position]},
+                upsert=True,
+            )
+            for position in chunk
+        ]
+        try:
+            result = await get_db().history.bulk_write(requests, ordered=False)
+            upserted = result.upserted_ids
+            errors = []
+        except BulkWriteError as e:
+            details = e.details or {}
+            upserted = {item["index"]: item["_id"] for item in details.get("upserted", [])}
+            errors = details.get("writeErrors", [])
+        except Exception as e:
+            if raise_errors:
+                raise
+            failed_indexes.extend(chunk)
+            logger.error(f"An error occurred while writing history chunk: {e}")
+            continue
+
+        failed = set()
+        for error in errors:
+            # A duplicate key here is a concurrent upsert of the same row
+            if error.get("code") != DUPLICATE_KEY_ERROR:
+                failed.add(error.get("index", 0))
+        if failed:
+            logger.error(f"Bulk write of history chunk partially failed: {len(failed)} rows")
+
+        stored = {}
+        for index, position in enumerate(chunk):
+            if index in failed:
+                failed_indexes.append(position)
+                continue
+            if index in upserted:
+                inserted_indexes.append(position)
+            else:
+                existing += 1
+            document = documents[position]
+            stored.setdefault(document["address_key"], []).append(history_item_key(document))
+
+        if settings.HISTORY_BLOOM_ENABLED:
+            for address_key, items in stored.items():
+                seen_history.add(address_key, items)
+
+    metrics.history_ingest_skipped_total.inc(skipped_batch, reason="batch")
+    metrics.history_ingest_skipped_total.inc(skipped_bloom, reason="bloom")
+    metrics.history_ingest_skipped_total.inc(existing, reason="existing")
+
+    return {
+        "inserted": len(inserted_indexes),
+        "duplicates": skipped_batch + skipped_bloom + existing,
+        "failed": len(failed_indexes),
+        "inserted_indexes": inserted_indexes,
+        "failed_indexes": failed_indexes,
+    }
+
+
+def encode_history_cursor(document: dict) -> str:
+    """Opaque keyset cursor pointing just after `document`."""
+    return f"{document['visitTime']!r}_{document['_id']}"
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    """Return (visitTime, _id) from a cursor; raises ValueError when malformed."""
+    try:
+        visit_time, _, object_id = cursor.rpartition("_")
+        return float(visit_time), ObjectId(object_id)
+    except (InvalidId, TypeError, ValueError):
+        raise ValueError(f"Invalid history cursor: {cursor!r}")
+
+
+def build_history_query(
+    address: str,
+    category: str = None,
+    domain: str = None,
+    since: float = None,
+    until: float = None,
+    cursor: str = None,
+) -> dict:
+    """
+    Filter for one user's history. `since`/`until` bound visitTime (inclusive,
+    in the extension's millisecond timestamps) and `cursor` resumes after the
+    last row of the previous page.
+    """
+    query = {"address_key": normalize_address(address)}
+    if category:
+        query["category"] = category
+    if domain:
+        query["domain"] = domain
+
+    visit_time = {}
+    if since is not None:
+        visit_time["$gte"] = since
+    if until is not None:
+        visit_time["$lte"] = until
+    if visit_time:
+        query["visitTime"] = visit_time
+
+    if cursor:
+        last_visit_time, last_id = decode_history_cursor(cursor)
+        keyset = {
+            "$or": [
+                {"visitTime": {"$lt": last_visit_time}},
+                {"visitTime": last_visit_time, "_id": {"$lt": last_id}},
+            ]
+        }
+        if visit_time:
+            query = {"$and": [query, keyset]}
+        else:
+            query.update(keyset)
+
+    return query
+
+
+async def list_history(address: str, limit: int = None, cursor: str = None, **filters) -> dict:
+    """
+    Fetch one page of a user's history, newest first.
+
+    Returns {"history": [...], "next_cursor": str or None}; the next cursor is
+    None on the last page.
+    """
+    if limit is None:
+        limit = settings.HISTORY_PAGE_SIZE
+
+    # Fetch one extra row to know whether another page exists
+    documents = (
+        await get_db()
+        .history.find(build_history_query(address, cursor=cursor, **filters), HISTORY_PROJECTION)
+        .sort(HISTORY_SORT)
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_history_cursor(documents[-1])
+
+    return {"history": documents, "next_cursor": next_cursor}
+
+
+async def stream_history(
+    address: str, limit: int = None, cursor: str = None, batch_size: int = None, **filters
+):
+    """
+    Yield a user's history documents newest first, straight off the cursor.
+    Only `batch_size` documents are held in memory at a time.
+    """
+    if batch_size is None:
+        batch_size = settings.HISTORY_STREAM_BATCH_SIZE
+
+    documents = (
+        get_db()
+        .history.find(build_history_query(address, cursor=cursor, **filters), HISTORY_PROJECTION)
+        .sort(HISTORY_SORT)
+        .batch_size(batch_size)
+    )
+    if limit:
+        documents = documents.limit(limit)
+
+    async for document in documents:
+        yield document
+
+
+async def reconcile_history_counters(
+    only_missing: bool = False, batch_size: int = None, address_key: str = None
+) -> int:
+    """
+    Recompute history_count and total_data_quantity on users from the history
+    collection. Users are processed in batches; each batch is one aggregation
+    whose $match on address_key is served by the history index, followed by
+    one bulk_write. With `only_missing`, only users without a history_count
+    (created before it was maintained) are reconciled; with `address_key`,
+    only that user.
+
+    An ingestion landing between a batch's aggregation and its write can be
+    overwritten; the next reconcile picks it up again.
+
+    Returns the number of users whose counters changed.
+    """
+    if batch_size is None:
+        batch_size = settings.HISTORY_RECONCILE_BATCH_SIZE
+
+    query = {"history_count": {"$exists": False}} if only_missing else {}
+    if address_key is not None:
+        query["address_key"] = address_key
+    users = get_db().users.find(
+        query, {"_id": 0, "address_key": 1, "history_count": 1, "total_data_quantity": 1}
+    ).batch_size(batch_size)
+
+    data_quantity = {
+        "$add": [
+            {"$strLenBytes": {"$ifNull": [f"${field}", ""]}} for field in HISTORY_DATA_FIELDS
+        ]
+    }
+    changed = 0
+    batch = []
+
+    async def reconcile_batch(batch: list) -> int:
+        totals = {
+            group["_id"]: group
+            async for group in get_db().history.aggregate(
+                [
+                    {"$match": {"address_key": {"$in": [user["address_key"] for user in batch]}}},
+                    {
+                        "$group": {
+                            "_id": "$address_key",
+                            "history_count": {"$sum": 1},
+                            "total_data_quantity": {"$sum": data_quantity},
+                        }
+                    },
+                ]
+            )
+        }
+        updates = []
+        for user in batch:
+            total = totals.get(user["address_key"], {})
+            counters = {
+                "history_count": total.get("history_count", 0),
+                "total_data_quantity": total.get("total_data_quantity", 0),
+            }
+            if any(user.get(field) != value for field, value in counters.items()):
+                updates.append(UpdateOne({"address_key": user["address_key"]}, {"$set": counters}))
+        if updates:
+            await get_db().users.bulk_write(updates, ordered=False)
+        return len(updates)
+
+    async for user in users:
+        if user.get("address_key"):
+            batch.append(user)
+        if len(batch) >= batch_size:
+            changed += await reconcile_batch(batch)
+            batch = []
+    if batch:
+        changed += await reconcile_batch(batch)
+
+    if changed:
+        logger.info(f"Reconciled history counters of {changed} users")
+    return changed
+
+
+async def claim_background_run(job: str, interval: float) -> bool:
+    """
+    Record in background_jobs that `job` starts now, unless some worker
+    already started it less than `interval` seconds ago. The filter only
+    matches a stale document; a fresh one makes the upsert collide on _id,
+    so a single worker wins each interval.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await get_db().background_jobs.update_one(
+            {"_id": job, "last_run": {"$lte": now - timedelta(seconds=interval)}},
+            {"$set": {"last_run": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def run_history_reconciler():
+    """
+    Background task: fill in the counters of users that predate them, then
+    periodically correct any drift with a full reconcile. Every worker runs
+    it, but each run is claimed in background_jobs first, so one worker
+    does the work per interval.
+    """
+    try:
+        if await claim_background_run(HISTORY_BACKFILL_JOB, HISTORY_BACKFILL_CLAIM_SECONDS):
+            await reconcile_history_counters(only_missing=True)
+    except Exception as e:
+        logger.error(f"An error occurred while backfilling history counters: {e}")
+
+    while settings.HISTORY_RECONCILE_INTERVAL_SECONDS > 0:
+        await asyncio.sleep(settings.HISTORY_RECONCILE_INTERVAL_SECONDS)
+        try:
+            if await claim_background_run(
+                HISTORY_RECONCILE_JOB, settings.HISTORY_RECONCILE_INTERVAL_SECONDS
+            ):
+                await reconcile_history_counters()
+        except Exception as e:
+            logger.error(f"An error occurred while reconciling history counters: {e}")
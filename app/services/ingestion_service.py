@@ -0,0 +1,552 @@
+# app/services/ingestion_service.py
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from app import metrics
+from app.models.history_model import count_activities
+from app.models.user_model import User, generate_slug
+from app.mongodb import get_db
+from app.responses import dumps
+from app.services.history_services import history_data_quantity, upsert_history_documents
+from app.services.invalidation_service import publish_invalidation
+from app.services.user_service import increment_history_counters, normalize_address
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Longest pause between retries of a batch while MongoDB is unreachable
+MAX_RETRY_BACKOFF_SECONDS = 30
+
+
+class IngestionQueueFull(Exception):
+    """Raised when accepting a job would exceed INGEST_QUEUE_MAX_ITEMS."""
+
+
+class IngestionBatchTooLarge(Exception):
+    """Raised for a single job with more items than INGEST_QUEUE_MAX_ITEMS, which can never fit."""
+
+
+# Most spool slots scanned for a free one; one slot is held per worker process
+MAX_SPOOL_SLOTS = 1024
+
+
+def spool_slot_path(base_path: str, slot: int) -> str:
+    """Spool file of `slot`, e.g. spool/history_ingest.3.jsonl for spool/history_ingest.jsonl."""
+    root, extension = os.path.splitext(base_path)
+    return f"{root}.{slot}{extension}"
+
+
+def lock_spool(path: str):
+    """
+    Take the lock of the spool at `path` without waiting.
+    Returns the open lock file, held until closed, or None if another process has it.
+    """
+    lock_file = open(f"{path}.lock", "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def read_spool(spool_file) -> tuple:
+    """
+    Read a spool file line by line.
+    Returns (open job records by job_id, completed job records, end of the last whole record).
+    """
+    pending = OrderedDict()
+    completed = []
+    spool_file.seek(0)
+    end = 0
+    for line in spool_file:
+        if not line.endswith(b"\n"):
+            break
+        end += len(line)
+        try:
+            record = json.loads(line)
+        except ValueError:
+            logger.error("Skipping unreadable spool record")
+            continue
+        if record.get("op") == "job":
+            pending[record["job_id"]] = record
+        elif record.get("op") == "done":
+            if pending.pop(record["job_id"], None) is not None:
+                completed.append(record)
+    return pending, completed, end
+
+
+class HistorySpool:
+    """
+    Append-only JSON-lines file holding every accepted ingestion job until it
+    has been written to MongoDB.
+
+    Each job is appended as {"op": "job", ...} before it is acknowledged and
+    followed by {"op": "done", ...} once flushed. Jobs without a "done" record
+    are replayed on startup. The file is truncated whenever no job is open,
+    and rewritten with only the open jobs once it grows past `compact_bytes`.
+    Appends made while an fsync is running share the next one (group commit).
+
+    Every worker process spools to its own slot file next to `base_path`,
+    claimed with a lock held until close. On open, the worker also adopts the
+    open jobs of slots no process holds (left by a worker that crashed or is
+    no longer started) and of a spool file at `base_path` itself.
+    """
+
+    def __init__(self, base_path: str, fsync: bool = True, compact_bytes: int = None):
+        self.base_path = base_path
+        self.path = None
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0  # records written to the file
+        self._synced = 0  # records known to be on disk
+        self._file = None
+        self._slot_lock = None
+        self._pending = OrderedDict()  # job_id -> open job record
+
+    @property
+    def open_jobs(self) -> int:
+        return len(self._pending)
+
+    def open(self) -> tuple:
+        """
+        Claim a slot, open its spool and read it back, adopting orphaned spools.
+        Returns (open job records in order, completed job records).
+        """
+        directory = os.path.dirname(self.base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            for slot in range(MAX_SPOOL_SLOTS):
+                self._slot_lock = lock_spool(spool_slot_path(self.base_path, slot))
+                if self._slot_lock is not None:
+                    self.path = spool_slot_path(self.base_path, slot)
+                    break
+            else:
+                raise RuntimeError(f"No free ingestion spool slot next to {self.base_path}")
+
+            self._file = open(self.path, "a+b")
+            pending, completed, end = read_spool(self._file)
+            # A crash mid-append leaves a torn last line; drop it so the next
+            # record starts on a fresh line.
+            size = self._file.seek(0, os.SEEK_END)
+            if end != size:
+                logger.warning(f"Dropping {size - end} bytes of torn spool record")
+                self._file.truncate(end)
+
+            for orphan_path in self._orphan_paths():
+                adopted, adopted_completed = self._adopt(orphan_path)
+                pending.update(adopted)
+                completed.extend(adopted_completed)
+
+            self._pending = pending
+            if not pending:
+                self._file.truncate(0)
+        self._sync(self._written)
+        return list(pending.values()), completed
+
+    def _orphan_paths(self) -> list:
+        root, extension = os.path.splitext(self.base_path)
+        paths = [self.base_path] if os.path.exists(self.base_path) else []
+        for path in sorted(glob.glob(f"{glob.escape(root)}.*{extension}")):
+            slot = path[len(root) + 1 : len(path) - len(extension)]
+            if slot.isdigit() and path != self.path:
+                paths.append(path)
+        return paths
+
+    def _adopt(self, path: str) -> tuple:
+        """Copy the open jobs of another, unlocked spool into this one and remove it."""
+        lock_file = lock_spool(path)
+        if lock_file is None:
+            return {}, []
+        try:
+            if not os.path.exists(path):
+                return {}, []
+            with open(path, "rb") as orphan:
+                pending, completed, _ = read_spool(orphan)
+            for record in pending.values():
+                self._write(record)
+            if pending:
+                logger.info(f"Adopting {len(pending)} unflushed ingestion jobs from {path}")
+            self._sync_file()
+            os.remove(path)
+            return pending, completed
+        finally:
+            lock_file.close()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._slot_lock is not None:
+                self._slot_lock.close()
+                self._slot_lock = None
+
+    def append_job(self, record: dict):
+        """Append a job record and return once it is durable."""
+        with self._lock:
+            self._write(record)
+            self._pending[record["job_id"]] = record
+            sequence = self._written
+        self._sync(sequence)
+
+    def append_done(self, records: list):
+        with self._lock:
+            for record in records:
+                self._write(record)
+                self._pending.pop(record["job_id"], None)
+            if not self._pending:
+                # Nothing left to replay; start the file over
+                self._file.truncate(0)
+            sequence = self._written
+            oversized = (
+                self._pending
+                and self.compact_bytes
+                and os.fstat(self._file.fileno()).st_size > self.compact_bytes
+            )
+        if oversized:
+            self._compact()
+        else:
+            self._sync(sequence)
+
+    def _compact(self):
+        """Rewrite the spool with only the open job records, replacing it atomically."""
+        with self._sync_lock, self._lock:
+            compacted = f"{self.path}.compact"
+            with open(compacted, "wb") as compacted_file:
+                for record in self._pending.values():
+                    compacted_file.write(dumps(record) + b"\n")
+                compacted_file.flush()
+                if self.fsync:
+                    os.fsync(compacted_file.fileno())
+            os.replace(compacted, self.path)
+            if self.fsync:
+                directory = os.open(os.path.dirname(self.path) or ".", os.O_RDONLY)
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+            self._file.close()
+            self._file = open(self.path, "a+b")
+            self._synced = self._written
+
+    def _write(self, record: dict):
+        self._file.write(dumps(record) + b"\n")
+        self._file.flush()
+        self._written += 1
+
+    def _sync_file(self):
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._synced = self._written
+
+    def _sync(self, sequence: int):
+        if not self.fsync:
+            return
+        with self._sync_lock:
+            if self._synced >= sequence:
+                # Covered by an fsync that ran while we waited
+                return
+            with self._lock:
+                target = self._written
+                fileno = self._file.fileno()
+            os.fsync(fileno)
+            self._synced = target
+
+
+class HistoryIngestionQueue:
+    """
+    Write-behind queue for /save-history.
+
+    Jobs are validated by the caller, spooled to disk, acknowledged, then
+    written to MongoDB by a background worker in batches bounded by
+    INGEST_BATCH_MAX_ITEMS items and INGEST_BATCH_MAX_WAIT_SECONDS.
+    At most INGEST_QUEUE_MAX_ITEMS items are held at once; beyond that new
+    jobs are refused with IngestionQueueFull.
+
+    Job statuses are kept in memory and stored in the ingest_jobs collection
+    when a job is queued and when it completes, so any worker can report them.
+    """
+
+    def __init__(self, spool: HistorySpool):
+        self.spool = spool
+        self.max_items = settings.INGEST_QUEUE_MAX_ITEMS
+        self.batch_max_items = settings.INGEST_BATCH_MAX_ITEMS
+        self.batch_max_wait = settings.INGEST_BATCH_MAX_WAIT_SECONDS
+        self.pending_items = 0
+        self._queue = asyncio.Queue()
+        self._jobs = OrderedDict()  # job_id -> status, bounded by INGEST_JOB_STATUS_SIZE
+        self._worker = None
+        self._closing = False
+        self._status_writes = set()
+
+    async def start(self):
+        pending, completed = await asyncio.to_thread(self.spool.open)
+        for record in completed:
+            self._set_status(record["job_id"], record["status"])
+        for record in pending:
+            documents = record["documents"]
+            self.pending_items += len(documents)
+            self._enqueue(record["job_id"], record["address"], documents, record["status"])
+        if pending:
+            logger.info(f"Replaying {len(pending)} unflushed ingestion jobs from the spool")
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = None):
+        """Stop accepting jobs and give the worker `timeout` seconds to drain."""
+        self._closing = True
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"{self.pending_items} history items left in the spool for the next start"
+                )
+            self._worker.cancel()
+            self._worker = None
+        await asyncio.to_thread(self.spool.close)
+
+    async def submit(self, address: str, documents: list, received: int, invalid: int) -> dict:
+        """Spool a validated job and queue it. Returns the job status."""
+        if len(documents) > self.max_items:
+            raise IngestionBatchTooLarge(
+                f"A history batch holds at most {self.max_items} items, got {len(documents)}"
+            )
+        if self._closing or self.pending_items + len(documents) > self.max_items:
+            metrics.ingest_rejected_total.inc()
+            raise IngestionQueueFull("History ingestion queue is full")
+
+        job_id = uuid.uuid4().hex
+        status = {
+            "job_id": job_id,
+            "status": "queued",
+            "address": address,
+            "received": received,
+            "invalid": invalid,
+            "queued": len(documents),
+            "inserted": 0,
+            "duplicates": 0,
+            "failed": 0,
+            "enqueued_at": time.time(),
+            "completed_at": None,
+        }
+        record = {
+            "op": "job",
+            "job_id": job_id,
+            "address": address,
+            "documents": documents,
+            "status": status,
+        }
+        # Reserve the capacity before yielding so concurrent submits cannot overshoot
+        self.pending_items += len(documents)
+        try:
+            await asyncio.to_thread(self.spool.append_job, record)
+        except Exception:
+            self.pending_items -= len(documents)
+            raise
+        self._enqueue(job_id, address, documents, status)
+        task = asyncio.create_task(self._store_queued_status(dict(status)))
+        self._status_writes.add(task)
+        task.add_done_callback(self._status_writes.discard)
+        return status
+
+    async def get_status(self, job_id: str):
+        """
+        Status of a job accepted by this worker, or else by any worker, from
+        the shared ingest_jobs collection. None if it is unknown.
+        """
+        status = self._jobs.get(job_id)
+        if status is None:
+            status = await get_db().ingest_jobs.find_one(
+                {"_id": job_id}, {"_id": 0, "updated_at": 0}
+            )
+        return status
+
+    async def _store_queued_status(self, status: dict):
+        """Best effort: the job is spooled, so an unreachable Mongo must not fail it."""
+        try:
+            await get_db().ingest_jobs.update_one(
+                {"_id": status["job_id"]},
+                # Never overwrites a completed status stored first
+                {"$setOnInsert": {**status, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning(f"Could not store the status of job {status['job_id']}: {e}")
+
+    def _enqueue(self, job_id: str, address: str, documents: list, status: dict):
+        self._set_status(job_id, status)
+        metrics.ingest_queue_items.set(self.pending_items)
+        self._queue.put_nowait((job_id, address, documents))
+
+    def _set_status(self, job_id: str, status: dict):
+        self._jobs[job_id] = status
+        self._jobs.move_to_end(job_id)
+        while len(self._jobs) > settings.INGEST_JOB_STATUS_SIZE:
+            self._jobs.popitem(last=False)
+
+    async def _next_batch(self) -> list:
+        """Wait for a job, then gather more until the batch is full or its time is up."""
+        batch = [await self._queue.get()]
+        items = len(batch[0][2])
+        deadline = time.monotonic() + self.batch_max_wait
+        while items < self.batch_max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            batch.append(job)
+            items += len(job[2])
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            # Kept across retries: rows an attempt inserted are skipped as
+            # existing by the next one but still need counting, once
+            progress = {"inserted": set(), "counted": set()}
+            backoff = settings.INGEST_RETRY_BACKOFF_SECONDS
+            while True:
+                try:
+                    await self._flush(batch, progress)
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Left in the spool; the retry skips rows that already made it
+                    metrics.ingest_flush_failures_total.inc()
+                    logger.error(f"Failed to flush ingestion batch, retrying in {backoff}s: {e}")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_RETRY_BACKOFF_SECONDS)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch: list, progress: dict):
+        for job_id, _, _ in batch:
+            self._jobs.get(job_id, {})["status"] = "processing"
+
+        documents = [document for _, _, job_documents in batch for document in job_documents]
+        await ensure_users([address for _, address, _ in batch])
+        # Upserts on the history key make a replayed or retried batch idempotent
+        inserted = []
+        try:
+            result = await upsert_history_documents(
+                documents, raise_errors=True, inserted_indexes=inserted
+            )
+        finally:
+            progress["inserted"].update(inserted)
+        metrics.ingest_batch_items.observe(len(documents))
+
+        inserted_indexes = progress["inserted"]
+        failed_indexes = set(result["failed_indexes"])
+        written_by_address = defaultdict(list)
+        done_records = []
+        position = 0
+        for job_id, address, job_documents in batch:
+            written = []
+            failed = 0
+            for index, document in enumerate(job_documents, start=position):
+                if index in inserted_indexes:
+                    written.append(document)
+                elif index in failed_indexes:
+                    failed += 1
+            position += len(job_documents)
+            written_by_address[address].extend(written)
+
+            status = self._jobs.get(job_id) or {"job_id": job_id, "address": address}
+            status.update(
+                status="completed",
+                inserted=len(written),
+                duplicates=len(job_documents) - len(written) - failed,
+                failed=failed,
+                completed_at=time.time(),
+            )
+            done_records.append({"op": "done", "job_id": job_id, "status": status})
+
+        for address, written in written_by_address.items():
+            if written and address not in progress["counted"]:
+                await increment_history_counters(
+                    address,
+                    count_activities(written),
+                    history_count=len(written),
+                    data_quantity=history_data_quantity(written),
+                )
+                progress["counted"].add(address)
+                publish_invalidation("history", "insert", normalize_address(address))
+
+        stored_at = datetime.now(timezone.utc)
+        await get_db().ingest_jobs.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": record["job_id"]},
+                    {"$set": {**record["status"], "updated_at": stored_at}},
+                    upsert=True,
+                )
+                for record in done_records
+            ],
+            ordered=False,
+        )
+        await asyncio.to_thread(self.spool.append_done, done_records)
+        self.pending_items -= len(documents)
+        metrics.ingest_queue_items.set(self.pending_items)
+
+
+async def ensure_users(addresses: list):
+    """Create the users among `addresses` that do not exist yet, with one lookup."""
+    keys = sorted(set(addresses))
+    existing = {
+        user["address_key"]
+        async for user in get_db().users.find(
+            {"address_key": {"$in": keys}}, {"_id": 0, "address_key": 1}
+        )
+    }
+    for address in keys:
+        if address not in existing:
+            await User(address=address, slug=generate_slug()).save()
+
+
+ingestion_queue = None
+
+
+def get_ingestion_queue() -> HistoryIngestionQueue:
+    if ingestion_queue is None:
+        raise RuntimeError("History ingestion queue is not started.")
+    return ingestion_queue
+
+
+async def start_ingestion_queue():
+    """Open the spool, replay unflushed jobs and start the worker."""
+    global ingestion_queue
+    if ingestion_queue is None:
+        queue = HistoryIngestionQueue(
+            HistorySpool(
+                settings.INGEST_SPOOL_PATH,
+                fsync=settings.INGEST_SPOOL_FSYNC,
+                compact_bytes=settings.INGEST_SPOOL_COMPACT_BYTES,
+            )
+        )
+        await queue.start()
+        ingestion_queue = queue
+
+
+async def stop_ingestion_queue():
+    global ingestion_queue
+    if ingestion_queue is not None:
+        await ingestion_queue.stop(settings.INGEST_SHUTDOWN_TIMEOUT_SECONDS)
+        ingestion_queue = None
@@ -0,0 +1,267 @@
+# app/services/invalidation_service.py
+import asyncio
+import logging
+from pymongo.errors import OperationFailure
+from app import metrics
+from app.mongodb import get_db
+from app.services.cache_service import invalidate_leaderboard, invalidate_user, response_cache
+from app.services.leaderboard_service import record_points_change
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# User fields that appear in leaderboard entries
+LEADERBOARD_FIELDS = {"address", "kleo_points"}
+
+# Change stream errors after which the resume token can no longer be used:
+# InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost
+RESUME_TOKEN_LOST_ERRORS = {260, 280, 286}
+
+
+def apply_invalidation(event: dict):
+    """
+    Drop or patch the cached entries an invalidation event affects.
+
+    An event names the collection and operation, the `address_key` of the
+    user it concerns and, for updates, the top-level `fields` that changed.
+    A new `kleo_points` value, when the event carries one, is applied to the
+    in-process leaderboard directly. An event without an address (e.g. a
+    deleted user) clears the response cache, since its entries cannot be
+    told apart.
+    """
+    collection = event["collection"]
+    operation = event["operation"]
+    metrics.cache_invalidation_events_total.inc(collection=collection, operation=operation)
+
+    address_key = event.get("address_key")
+    if address_key is None:
+        response_cache.clear()
+        return
+
+    invalidate_user(address_key)
+    if collection != "users":
+        return
+
+    fields = event.get("fields")
+    if fields is not None and not LEADERBOARD_FIELDS.intersection(fields):
+        return
+    if event.get("kleo_points") is not None and event.get("address"):
+        record_points_change(event["address"], event["kleo_points"])
+    else:
+        invalidate_leaderboard()
+
+
+class MemoryInvalidationBus:
+    """
+    Delivers invalidation events to the handlers subscribed in this process.
+
+    Enough for a single worker: this worker's writes reach it through
+    publish_invalidation(). With several workers use
+    ChangeStreamInvalidationBus so writes made elsewhere reach every cache.
+    """
+
+    def __init__(self):
+        self._handlers = []
+
+    def subscribe(self, handler):
+        self._handlers.append(handler)
+
+    def publish(self, event: dict):
+        for handler in self._handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                logger.error(f"Invalidation handler failed for {event}: {e}")
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class ChangeStreamInvalidationBus(MemoryInvalidationBus):
+    """
+    Publishes an event for every write to the watched collections, read from
+    a MongoDB change stream, so each worker drops only the keys a write
+    touched, whoever made it.
+
+    The stream only carries the fields invalidation needs: the operation, the
+    user's address, the names of the updated fields and a new kleo_points
+    value. After an error the stream is reopened from the last resume token,
+    so no write is missed. If the token is no longer usable (the oplog moved
+    past it) the caches are cleared and the stream restarts from now.
+    The token is kept in memory only: the caches it protects do not survive
+    a restart either.
+    """
+
+    def __init__(self, collections: tuple = ("users", "history")):
+        super().__init__()
+        self.collections = collections
+        self.resume_token = None
+        self._task = None
+
+    def pipeline(self) -> list:
+        return [
+            {
+                "$match": {
+                    "ns.coll": {"$in": list(self.collections)},
+                    "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+                }
+            },
+            {
+                "$project": {
+                    "operationType": 1,
+                    "ns.coll": 1,
+                    "fullDocument.address_key": 1,
+                    "fullDocument.address": 1,
+                    "fullDocument.kleo_points": 1,
+                    "changedFields": {
+                        "$concatArrays": [
+                            {
+                                "$map": {
+                                    "input": {
+                                        "$objectToArray": {
+                                            "$ifNull": ["$updateDescription.updatedFields", {}]
+                                        }
+                                    },
+                                    "in": "$$this.k",
+                                }
+                            },
+                            {"$ifNull": ["$updateDescription.removedFields", []]},
+                        ]
+                    },
+                    "updatedKleoPoints": "$updateDescription.updatedFields.kleo_points",
+                }
+            },
+        ]
+
+    @staticmethod
+    def to_event(change: dict):
+        """Invalidation event for a change stream document, or None to ignore it."""
+        operation = change["operationType"]
+        collection = change["ns"]["coll"]
+        document = change.get("fullDocument") or {}
+        if operation == "update" and not document:
+            # Deleted since; its delete event follows
+            return None
+        if collection == "history" and operation == "delete":
+            # Removing repeated history rows changes nothing cached
+            return None
+
+        event = {
+            "collection": collection,
+            "operation": operation,
+            "address_key": document.get("address_key"),
+            "address": document.get("address"),
+        }
+        if operation == "update":
+            event["fields"] = sorted({field.split(".")[0] for field in change.get("changedFields", [])})
+            event["kleo_points"] = change.get("updatedKleoPoints")
+        else:
+            event["kleo_points"] = document.get("kleo_points")
+        return event
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in RESUME_TOKEN_LOST_ERRORS:
+                    logger.warning(f"Invalidation stream cannot resume, clearing caches: {e}")
+                    metrics.cache_invalidation_stream_restarts_total.inc(reason="history_lost")
+                    self.resume_token = None
+                    response_cache.clear()
+                    continue
+                self._log_failure(e)
+            except Exception as e:
+                self._log_failure(e)
+            await asyncio.sleep(settings.CACHE_INVALIDATION_RETRY_SECONDS)
+
+    def _log_failure(self, error: Exception):
+        metrics.cache_invalidation_stream_restarts_total.inc(reason="error")
+        logger.error(
+            f"Invalidation stream failed, reopening in "
+            f"{settings.CACHE_INVALIDATION_RETRY_SECONDS}s: {error}"
+        )
+
+    async def _watch(self):
+        async with get_db().watch(
+            self.pipeline(),
+            full_document="updateLookup",
+            resume_after=self.resume_token,
+        ) as stream:
+            while True:
+                change = await stream.try_next()
+                if change is not None:
+                    event = self.to_event(change)
+                    if event is not None:
+                        self.publish(event)
+                # Advances on idle batches too, keeping the token inside the oplog window
+                self.resume_token = stream.resume_token
+
+
+INVALIDATION_BACKENDS = {
+    "memory": MemoryInvalidationBus,
+    "change_stream": ChangeStreamInvalidationBus,
+}
+
+invalidation_bus = None
+
+
+def get_invalidation_bus():
+    if invalidation_bus is None:
+        raise RuntimeError("Cache invalidation bus is not started.")
+    return invalidation_bus
+
+
+def publish_invalidation(collection: str, operation: str, address_key: str = None, **details):
+    """
+    Publish the invalidation event of a write made by this worker, e.g.
+    publish_invalidation("users", "insert", key, address=..., kleo_points=...).
+    The event is applied at once, also with the change stream backend, whose
+    own copy of it arrives later. Before the bus is started (scripts,
+    benchmarks) it is applied directly.
+    """
+    event = {"collection": collection, "operation": operation, "address_key": address_key, **details}
+    if invalidation_bus is None:
+        apply_invalidation(event)
+    else:
+        invalidation_bus.publish(event)
+
+
+async def start_invalidation_bus():
+    """Create the bus selected by CACHE_INVALIDATION_BACKEND and apply its events to the caches."""
+    global invalidation_bus
+    if invalidation_bus is None:
+        backend = INVALIDATION_BACKENDS.get(settings.CACHE_INVALIDATION_BACKEND)
+        if backend is None:
+            raise ValueError(
+                f"Unknown CACHE_INVALIDATION_BACKEND {settings.CACHE_INVALIDATION_BACKEND!r}"
+            )
+        bus = backend()
+        bus.subscribe(apply_invalidation)
+        await bus.start()
+        invalidation_bus = bus
+
+
+async def stop_invalidation_bus():
+    global invalidation_bus
+    if invalidation_bus is not None:
+        await invalidation_bus.stop()
+        invalidation_bus = None
@@ -0,0 +1,462 @@
+# app/services/leaderboard_service.py
+import asyncio
+import logging
+import time
+from bisect import bisect_left, insort
+from datetime import timezone
+from app.mongodb import get_db
+from app.services.cache_service import cached, invalidate_leaderboard
+from app.services.shared_leaderboard_service import (
+    SharedLeaderboardPublisher,
+    SharedLeaderboardReader,
+)
+from app.services.user_service import (
+    calculate_rank,
+    calculate_ranks,
+    get_top_users_by_kleo_points,
+    normalize_address,
+    rank_percentile,
+)
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    """
+    In-process leaderboard over (kleo_points, address).
+
+    Entries are kept in a sorted array of (-kleo_points, address_key), so the
+    competition rank of a score is one plus the number of entries strictly in
+    front of it, found with a single bisect. Ties share a rank (1, 2, 2, 4).
+    The distinct scores are kept sorted alongside for the dense rank (1, 2, 2, 3).
+    """
+
+    def __init__(self):
+        self._entries = []  # sorted (-kleo_points, address_key)
+        self._points = {}  # address_key -> kleo_points
+        self._addresses = {}  # address_key -> address as stored on the user
+        self._scores = []  # sorted distinct -kleo_points
+        self._score_counts = {}  # -kleo_points -> number of users with that score
+        self._pending = None  # updates received while a reload is running
+        self.ready = False
+        self.loaded_at = None  # time.time() of the last full reload
+        self.version = 0  # bumped on every change, to tell when to republish
+
+    @property
+    def total_users(self) -> int:
+        return len(self._entries)
+
+    def begin_reload(self):
+        self._pending = {}
+
+    def abort_reload(self):
+        self._pending = None
+
+    def finish_reload(self, users: list):
+        """Swap in a full snapshot, then replay the updates that raced with it."""
+        entries = []
+        points = {}
+        addresses = {}
+        score_counts = {}
+        for user in users:
+            key = normalize_address(user["address"])
+            # Missing or stored as null
+            kleo_points = user.get("kleo_points") or 0
+            entries.append((-kleo_points, key))
+            points[key] = kleo_points
+            addresses[key] = user["address"]
+            score_counts[-kleo_points] = score_counts.get(-kleo_points, 0) + 1
+        entries.sort()
+
+        pending, self._pending = self._pending or {}, None
+        self._entries, self._points, self._addresses = entries, points, addresses
+        self._scores, self._score_counts = sorted(score_counts), score_counts
+        for address, kleo_points in pending.items():
+            self.update(address, kleo_points)
+        self.ready = True
+        self.loaded_at = time.time()
+        self.version += 1
+
+    def update(self, address: str, kleo_points: int):
+        """Insert a user or move them to their new score in O(log n) search + O(n) shift."""
+        key = normalize_address(address)
+        kleo_points = kleo_points or 0
+        if self._pending is not None:
+            self._pending[address] = kleo_points
+
+        previous = self._points.get(key)
+        if previous is not None:
+            if previous == kleo_points:
+                return
+            index = bisect_left(self._entries, (-previous, key))
+            del self._entries[index]
+            self._score_counts[-previous] -= 1
+            if not self._score_counts[-previous]:
+                del self._score_counts[-previous]
+                del self._scores[bisect_left(self._scores, -previous)]
+        insort(self._entries, (-kleo_points, key))
+        if -kleo_points not in self._score_counts:
+            self._score_counts[-kleo_points] = 0
+            insort(self._scores, -kleo_points)
+        self._score_counts[-kleo_points] += 1
+        self._points[key] = kleo_points
+        self._addresses.setdefault(key, address)
+        self.version += 1
+
+    def export(self) -> tuple:
+        """Copies of the sorted entries and display addresses, for publishing a snapshot."""
+        return list(self._entries), dict(self._addresses)
+
+    def rank(self, address: str):
+        """Return the rank entry of a user, or None if they are not on the board."""
+        key = normalize_address(address)
+        kleo_points = self._points.get(key)
+        if kleo_points is None:
+            return None
+        rank = bisect_left(self._entries, (-kleo_points,)) + 1
+        return {
+            "address": self._addresses[key],
+            "kleo_points": kleo_points,
+            "rank": rank,
+            "dense_rank": bisect_left(self._scores, -kleo_points) + 1,
+            "percentile": rank_percentile(rank, self.total_users),
+            "total_users": self.total_users,
+        }
+
+    def top(self, limit: int) -> list:
+        """Return the first `limit` users in O(limit)."""
+        leaderboard = []
+        rank = dense_rank = 0
+        previous = None
+        for index, (negative_points, key) in enumerate(self._entries[: max(limit, 0)]):
+            if negative_points != previous:
+                rank = index + 1
+                dense_rank += 1
+                previous = negative_points
+            leaderboard.append(
+                {
+                    "rank": rank,
+                    "dense_rank": dense_rank,
+                    "percentile": rank_percentile(rank, self.total_users),
+                    "address": self._addresses[key],
+                    "kleo_points": -negative_points,
+                }
+            )
+        return leaderboard
+
+
+leaderboard = Leaderboard()
+
+
+async def refresh_leaderboard():
+    """Reload the whole leaderboard from the users collection."""
+    leaderboard.begin_reload()
+    try:
+        cursor = get_db().users.find({}, {"_id": 0, "address": 1, "kleo_points": 1})
+        users = await cursor.to_list(length=None)
+    except Exception:
+        leaderboard.abort_reload()
+        raise
+    leaderboard.finish_reload(users)
+    logger.info(f"Leaderboard refreshed with {leaderboard.total_users} users")
+
+
+# With LEADERBOARD_SHARED_MEMORY, one worker per host keeps the leaderboard and
+# publishes it as a shared memory snapshot that every worker reads.
+snapshot_publisher = SharedLeaderboardPublisher(settings.LEADERBOARD_SHM_NAME)
+snapshot_reader = SharedLeaderboardReader(settings.LEADERBOARD_SHM_NAME)
+
+
+def shared_snapshot():
+    """The current shared leaderboard snapshot, or None when not enabled or not published yet."""
+    if not settings.LEADERBOARD_SHARED_MEMORY:
+        return None
+    return snapshot_reader.current()
+
+
+async def run_shared_leaderboard():
+    """
+    Background task for LEADERBOARD_SHARED_MEMORY. The worker that wins the
+    publisher lock reloads the leaderboard from Mongo every
+    LEADERBOARD_REFRESH_SECONDS and republishes it at most every
+    LEADERBOARD_SNAPSHOT_SECONDS when it changed; the other workers only read
+    the snapshot and retry the lock in case the publisher goes away.
+    """
+    reloaded_at = None
+    published_version = None
+    try:
+        while True:
+            try:
+                if snapshot_publisher.try_acquire():
+                    now = asyncio.get_running_loop().time()
+                    if reloaded_at is None or now - reloaded_at >= settings.LEADERBOARD_REFRESH_SECONDS:
+                        await refresh_leaderboard()
+                        reloaded_at = now
+                    if leaderboard.version != published_version:
+                        version = leaderboard.version
+                        entries, addresses = leaderboard.export()
+                        await asyncio.to_thread(snapshot_publisher.publish, entries, addresses)
+                        published_version = version
+                        invalidate_leaderboard()
+            except Exception as e:
+                logger.error(f"An error occurred while publishing the shared leaderboard: {e}")
+            await asyncio.sleep(settings.LEADERBOARD_SNAPSHOT_SECONDS)
+    finally:
+        snapshot_publisher.close()
+        snapshot_reader.close()
+
+
+async def run_leaderboard_refresher():
+    """Background task: warm the leaderboard, then reconcile it with Mongo periodically."""
+    if settings.LEADERBOARD_SHARED_MEMORY:
+        await run_shared_leaderboard()
+        return
+    while True:
+        try:
+            await refresh_leaderboard()
+        except Exception as e:
+            logger.error(f"An error occurred while refreshing the leaderboard: {e}")
+        await asyncio.sleep(settings.LEADERBOARD_REFRESH_SECONDS)
+
+
+def record_points_change(address: str, kleo_points: int):
+    """Apply a kleo_points change to the in-process leaderboard."""
+    if not settings.LEADERBOARD_SHARED_MEMORY or snapshot_publisher.owner:
+        # Only the publishing worker keeps a leaderboard in shared memory mode
+        leaderboard.update(address, kleo_points)
+    invalidate_leaderboard()
+
+
+# Materialized leaderboard, rebuilt from users every LEADERBOARD_MATERIALIZE_SECONDS
+# with precomputed ranks, so rank lookups and top-N pages are single indexed reads.
+LEADERBOARD_SNAPSHOT_COLLECTION = "leaderboard_snapshots"
+SNAPSHOT_RANK_PROJECTION = {"_id": 0, "address_key": 0}
+SNAPSHOT_TOP_PROJECTION = {
+    "_id": 0,
+    "rank": 1,
+    "dense_rank": 1,
+    "percentile": 1,
+    "address": 1,
+    "kleo_points": 1,
+    "generated_at": 1,
+}
+
+
+def leaderboard_snapshot_pipeline() -> list:
+    """Ranks every user in one pass and replaces the snapshot collection with the result."""
+    return [
+        {
+            "$project": {
+                "_id": 0,
+                "address": 1,
+                "address_key": 1,
+                "kleo_points": {"$ifNull": ["$kleo_points", 0]},
+            }
+        },
+        {
+            "$setWindowFields": {
+                "sortBy": {"kleo_points": -1},
+                "output": {
+                    "rank": {"$rank": {}},
+                    "dense_rank": {"$denseRank": {}},
+                    "total_users": {
+                        "$count": {},
+                        "window": {"documents": ["unbounded", "unbounded"]},
+                    },
+                },
+            }
+        },
+        {
+            "$set": {
+                # Same as rank_percentile()
+                "percentile": {
+                    "$round": [
+                        {
+                            "$divide": [
+                                {"$multiply": [100, {"$add": [{"$subtract": ["$total_users", "$rank"]}, 1]}]},
+                                "$total_users",
+                            ]
+                        },
+                        2,
+                    ]
+                },
+                "generated_at": "$$NOW",
+            }
+        },
+        # $out swaps the new collection in atomically and keeps its indexes
+        {"$out": LEADERBOARD_SNAPSHOT_COLLECTION},
+    ]
+
+
+def snapshot_timestamp(document: dict) -> float:
+    """generated_at of a snapshot document as a Unix timestamp."""
+    return document.pop("generated_at").replace(tzinfo=timezone.utc).timestamp()
+
+
+async def materialize_leaderboard_snapshot():
+    """Rebuild the leaderboard_snapshots collection from users."""
+    await get_db().users.aggregate(leaderboard_snapshot_pipeline(), allowDiskUse=True).to_list(
+        length=None
+    )
+    logger.info("Leaderboard snapshot materialized")
+
+
+async def leaderboard_snapshot_age():
+    """Seconds since the snapshot collection was built, or None if it is empty."""
+    document = await get_db()[LEADERBOARD_SNAPSHOT_COLLECTION].find_one(
+        {}, {"_id": 0, "generated_at": 1}, sort=[("rank", 1)]
+    )
+    if document is None:
+        return None
+    return time.time() - snapshot_timestamp(document)
+
+
+async def run_leaderboard_materializer():
+    """
+    Background task: rebuild the snapshot collection every
+    LEADERBOARD_MATERIALIZE_SECONDS. Every worker runs it, but a worker skips
+    the rebuild while the snapshot is younger than the interval, so in steady
+    state one rebuild happens per interval.
+    """
+    while True:
+        try:
+            age = await leaderboard_snapshot_age()
+            if age is None or age >= settings.LEADERBOARD_MATERIALIZE_SECONDS:
+                await materialize_leaderboard_snapshot()
+                age = 0
+            delay = settings.LEADERBOARD_MATERIALIZE_SECONDS - age
+        except Exception as e:
+            logger.error(f"An error occurred while materializing the leaderboard: {e}")
+            delay = settings.LEADERBOARD_MATERIALIZE_SECONDS
+        await asyncio.sleep(delay)
+
+
+async def find_snapshot_rank(address: str):
+    """Rank entry of a user from the snapshot collection, or None if they are not in it."""
+    document = await get_db()[LEADERBOARD_SNAPSHOT_COLLECTION].find_one(
+        {"address_key": normalize_address(address)}, SNAPSHOT_RANK_PROJECTION
+    )
+    if document is not None:
+        document["snapshot_at"] = snapshot_timestamp(document)
+    return document
+
+
+async def find_snapshot_top(limit: int):
+    """Top `limit` entries of the snapshot collection, or None if it is empty."""
+    cursor = (
+        get_db()[LEADERBOARD_SNAPSHOT_COLLECTION]
+        .find({}, SNAPSHOT_TOP_PROJECTION)
+        .sort([("rank", 1), ("address_key", 1)])
+        .limit(limit)
+    )
+    entries = await cursor.to_list(length=limit)
+    if not entries:
+        return None
+    snapshot_at = min(snapshot_timestamp(entry) for entry in entries)
+    return {"leaderboard": entries, "snapshot_at": snapshot_at}
+
+
+async def find_snapshot_ranks(address_keys: list) -> dict:
+    """Rank entries of many users from the snapshot collection in one `$in` read."""
+    ranks = {}
+    async for document in get_db()[LEADERBOARD_SNAPSHOT_COLLECTION].find(
+        {"address_key": {"$in": address_keys}}, {"_id": 0}
+    ):
+        document["snapshot_at"] = snapshot_timestamp(document)
+        ranks[document.pop("address_key")] = document
+    return ranks
+
+
+@cached("top", ttl=settings.CACHE_LEADERBOARD_TTL_SECONDS)
+async def get_top_users(limit: int = 10) -> dict:
+    """
+    Top users by kleo_points, as {"leaderboard": [...], "snapshot_at": timestamp}.
+    Served from memory once the leaderboard is warm, otherwise from the
+    snapshot collection, and from a live query only if that is empty.
+    """
+    snapshot = shared_snapshot()
+    if snapshot is not None:
+        return {"leaderboard": snapshot.top(limit), "snapshot_at": snapshot.built_at}
+    if leaderboard.ready:
+        return {"leaderboard": leaderboard.top(limit), "snapshot_at": leaderboard.loaded_at}
+    page = await find_snapshot_top(limit)
+    if page is not None:
+        return page
+    return {"leaderboard": await get_top_users_by_kleo_points(limit), "snapshot_at": time.time()}
+
+
+@cached(
+    "rank",
+    ttl=settings.CACHE_LEADERBOARD_TTL_SECONDS,
+    key=lambda address: normalize_address(address),
+)
+async def get_user_rank(address: str):
+    """
+    Rank of a user, with the `snapshot_at` timestamp of the ranking it comes
+    from. Served from memory once the leaderboard is warm, otherwise from the
+    snapshot collection. Users in neither yet (e.g. just created) are ranked
+    with a live query and added to the in-memory board.
+    Returns None when the user does not exist.
+    """
+    snapshot = shared_snapshot()
+    if snapshot is not None:
+        rank_data = snapshot.rank(address)
+        if rank_data is not None:
+            return {**rank_data, "snapshot_at": snapshot.built_at}
+    elif leaderboard.ready:
+        rank_data = leaderboard.rank(address)
+        if rank_data is not None:
+            return {**rank_data, "snapshot_at": leaderboard.loaded_at}
+    else:
+        rank_data = await find_snapshot_rank(address)
+        if rank_data is not None:
+            return rank_data
+
+    rank_data = await calculate_rank(address)
+    if isinstance(rank_data, tuple):
+        error, status_code = rank_data
+        if status_code == 404:
+            return None
+        raise Exception(error["error"])
+
+    if leaderboard.ready:
+        leaderboard.update(rank_data["address"], rank_data["kleo_points"])
+    return rank_data
+
+
+async def get_user_ranks(addresses: list) -> dict:
+    """
+    Ranks of many users at once, from the same sources as get_user_rank():
+    memory or the snapshot collection first, then one batched live query
+    for the users found in neither. Returns {"ranks": [...], "not_found": [...]}
+    in request order, with repeated addresses answered once.
+    """
+    keys = list(dict.fromkeys(normalize_address(address) for address in addresses))
+    found = {}
+    snapshot = shared_snapshot()
+    if snapshot is not None:
+        for key in keys:
+            rank_data = snapshot.rank(key)
+            if rank_data is not None:
+                found[key] = {**rank_data, "snapshot_at": snapshot.built_at}
+    elif leaderboard.ready:
+        for key in keys:
+            rank_data = leaderboard.rank(key)
+            if rank_data is not None:
+                found[key] = {**rank_data, "snapshot_at": leaderboard.loaded_at}
+    else:
+        found.update(await find_snapshot_ranks(keys))
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        live = await calculate_ranks(missing)
+        if leaderboard.ready:
+            for rank_data in live.values():
+                leaderboard.update(rank_data["address"], rank_data["kleo_points"])
+        found.update(live)
+
+    return {
+        "ranks": [found[key] for key in keys if key in found],
+        "not_found": [key for key in keys if key not in found],
+    }
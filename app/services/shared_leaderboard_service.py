@@ -0,0 +1,332 @@
+# app/services/shared_leaderboard_service.py
+import fcntl
+import logging
+import os
+import struct
+import tempfile
+import time
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+from app.services.user_service import normalize_address, rank_percentile
+
+logger = logging.getLogger(__name__)
+
+# Snapshot segment layout, all little-endian:
+#   header   magic, layout version, generation, user count, built_at, address width
+#   points   float64[count]          kleo_points, in rank order
+#   ranks    uint32[count]           competition rank, in rank order
+#   dense    uint32[count]           dense rank, in rank order
+#   index    uint32[count]           rank position of each key in `keys`
+#   addresses char[count][width]     address as stored on the user, in rank order
+#   keys     char[count][width]      address_key, sorted, for binary search
+HEADER = struct.Struct("<4sIQQdI")
+HEADER_SIZE = 64
+MAGIC = b"KLB1"
+LAYOUT_VERSION = 2
+
+# Control block: a sequence counter (odd while being written) and the
+# generation of the published snapshot, readable without a lock.
+CONTROL = struct.Struct("<QQ")
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Open an existing segment without handing it to this process's resource
+    tracker, which would otherwise unlink it when the process exits.
+    """
+    segment = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def _create(name: str, size: int) -> shared_memory.SharedMemory:
+    """Create a segment whose lifetime is managed explicitly, not by the resource tracker."""
+    segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def _unlink(name: str):
+    try:
+        segment = _attach(name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    # unlink() also unregisters the segment from the tracker; pair it with a registration
+    resource_tracker.register(segment._name, "shared_memory")
+    segment.unlink()
+
+
+def segment_name(name: str, generation: int) -> str:
+    return f"{name}_{generation}"
+
+
+def control_name(name: str) -> str:
+    return f"{name}_ctl"
+
+
+class LeaderboardSnapshot:
+    """
+    Read-only (address, kleo_points, rank) table in a shared memory segment.
+
+    Lookups index the shared buffer through typed memoryviews, so attaching
+    costs nothing per user and every worker reads the same pages.
+    """
+
+    def __init__(self, segment: shared_memory.SharedMemory):
+        self._segment = segment
+        buf = segment.buf
+        magic, layout, self.generation, self.count, self.built_at, self.width = HEADER.unpack_from(
+            buf, 0
+        )
+        if magic != MAGIC or layout != LAYOUT_VERSION:
+            raise ValueError(f"Not a leaderboard snapshot: {segment.name}")
+
+        count, width = self.count, self.width
+        offset = HEADER_SIZE
+        self._points = buf[offset : offset + 8 * count].cast("d")
+        offset += 8 * count
+        self._ranks = buf[offset : offset + 4 * count].cast("I")
+        offset += 4 * count
+        self._dense_ranks = buf[offset : offset + 4 * count].cast("I")
+        offset += 4 * count
+        self._index = buf[offset : offset + 4 * count].cast("I")
+        offset += 4 * count
+        self._addresses = buf[offset : offset + width * count]
+        offset += width * count
+        self._keys = buf[offset : offset + width * count]
+
+    @property
+    def total_users(self) -> int:
+        return self.count
+
+    def _address(self, position: int) -> str:
+        width = self.width
+        return bytes(self._addresses[position * width : (position + 1) * width]).rstrip(b"\0").decode()
+
+    def _kleo_points(self, position: int):
+        kleo_points = self._points[position]
+        return int(kleo_points) if kleo_points.is_integer() else kleo_points
+
+    def _find(self, address: str):
+        """Rank position of `address`, by binary search over the sorted keys."""
+        width = self.width
+        target = normalize_address(address).encode()
+        if len(target) > width:
+            return None
+        target = target.ljust(width, b"\0")
+
+        keys = self._keys
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if keys[middle * width : (middle + 1) * width].tobytes() < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and keys[low * width : (low + 1) * width].tobytes() == target:
+            return self._index[low]
+        return None
+
+    def rank(self, address: str):
+        """Return the rank entry of a user, or None if they are not in the snapshot."""
+        position = self._find(address)
+        if position is None:
+            return None
+        rank = self._ranks[position]
+        return {
+            "address": self._address(position),
+            "kleo_points": self._kleo_points(position),
+            "rank": rank,
+            "dense_rank": self._dense_ranks[position],
+            "percentile": rank_percentile(rank, self.count),
+            "total_users": self.count,
+        }
+
+    def top(self, limit: int) -> list:
+        return [
+            {
+                "rank": self._ranks[position],
+                "dense_rank": self._dense_ranks[position],
+                "percentile": rank_percentile(self._ranks[position], self.count),
+                "address": self._address(position),
+                "kleo_points": self._kleo_points(position),
+            }
+            for position in range(min(limit, self.count))
+        ]
+
+    def release(self):
+        """Drop the views and unmap the segment."""
+        for view in (
+            self._points,
+            self._ranks,
+            self._dense_ranks,
+            self._index,
+            self._addresses,
+            self._keys,
+        ):
+            view.release()
+        self._segment.close()
+
+
+def write_snapshot(name: str, generation: int, entries: list, addresses: dict):
+    """
+    Write a snapshot segment for generation `generation` from leaderboard
+    entries sorted as (-kleo_points, address_key). Returns the segment.
+    """
+    count = len(entries)
+    display = [addresses.get(key, key).encode() for _, key in entries]
+    keys = [key.encode() for _, key in entries]
+    width = max([1] + [len(value) for value in display] + [len(value) for value in keys])
+
+    points = array("d")
+    ranks = array("I")
+    dense_ranks = array("I")
+    previous = None
+    rank = dense_rank = 0
+    for position, (negative_points, _) in enumerate(entries):
+        if negative_points != previous:
+            rank = position + 1
+            dense_rank += 1
+            previous = negative_points
+        points.append(-negative_points)
+        ranks.append(rank)
+        dense_ranks.append(dense_rank)
+    order = sorted(range(count), key=keys.__getitem__)
+    index = array("I", order)
+
+    size = HEADER_SIZE + 20 * count + 2 * width * count
+    segment = _create(segment_name(name, generation), max(size, HEADER_SIZE))
+    buf = segment.buf
+    HEADER.pack_into(buf, 0, MAGIC, LAYOUT_VERSION, generation, count, time.time(), width)
+    offset = HEADER_SIZE
+    for block in (
+        points.tobytes(),
+        ranks.tobytes(),
+        dense_ranks.tobytes(),
+        index.tobytes(),
+        b"".join(value.ljust(width, b"\0") for value in display),
+        b"".join(keys[position].ljust(width, b"\0") for position in order),
+    ):
+        buf[offset : offset + len(block)] = block
+        offset += len(block)
+    return segment
+
+
+class SharedLeaderboardPublisher:
+    """
+    Publishes leaderboard snapshots for every worker on the host.
+
+    Only the worker holding the lock file publishes. Each snapshot goes into a
+    new segment; once it is fully written the generation in the control block
+    is bumped, so readers switch to it atomically, and the previous segment is
+    unlinked. Workers that still map it keep reading it until they notice the
+    new generation. If the publishing worker dies the lock is released and
+    another worker takes over.
+    """
+
+    def __init__(self, name: str, lock_path: str = None):
+        self.name = name
+        self.lock_path = lock_path or os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_file = None
+        self._control = None
+
+    @property
+    def owner(self) -> bool:
+        return self._lock_file is not None
+
+    def try_acquire(self) -> bool:
+        """Become the publisher if no other worker is. Returns whether this worker is."""
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        try:
+            self._control = _create(control_name(self.name), CONTROL.size)
+        except FileExistsError:
+            self._control = _attach(control_name(self.name))
+        logger.info(f"This worker publishes the shared leaderboard {self.name}")
+        return True
+
+    def publish(self, entries: list, addresses: dict) -> int:
+        """Write a new snapshot, make it current and return its generation."""
+        if not self.owner:
+            raise RuntimeError("Only the lock holder publishes leaderboard snapshots.")
+        buf = self._control.buf
+        sequence, previous = CONTROL.unpack_from(buf, 0)
+        generation = previous + 1
+        segment = write_snapshot(self.name, generation, entries, addresses)
+        segment.close()
+
+        # Seqlock: readers retry while the sequence is odd or has moved
+        CONTROL.pack_into(buf, 0, sequence + 1, previous)
+        CONTROL.pack_into(buf, 0, sequence + 1, generation)
+        CONTROL.pack_into(buf, 0, sequence + 2, generation)
+
+        if previous:
+            _unlink(segment_name(self.name, previous))
+        return generation
+
+    def close(self):
+        """Give up publishing. The current snapshot stays readable for the next publisher."""
+        if self._control is not None:
+            self._control.close()
+            self._control = None
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class SharedLeaderboardReader:
+    """Follows the published generation and keeps the current snapshot attached."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.snapshot = None
+        self._control = None
+
+    def generation(self) -> int:
+        """Published generation, 0 if none. Reads the control block without locking."""
+        if self._control is None:
+            try:
+                self._control = _attach(control_name(self.name))
+            except FileNotFoundError:
+                return 0
+        buf = self._control.buf
+        while True:
+            sequence, generation = CONTROL.unpack_from(buf, 0)
+            if sequence % 2 == 0 and CONTROL.unpack_from(buf, 0)[0] == sequence:
+                return generation
+
+    def current(self):
+        """The latest published snapshot, or None if nothing has been published yet."""
+        for _ in range(3):
+            generation = self.generation()
+            if generation == 0:
+                return self.snapshot
+            if self.snapshot is not None and self.snapshot.generation == generation:
+                return self.snapshot
+            try:
+                snapshot = LeaderboardSnapshot(_attach(segment_name(self.name, generation)))
+            except FileNotFoundError:
+                # Superseded between reading the control block and attaching; look again
+                continue
+            if self.snapshot is not None:
+                self.snapshot.release()
+            self.snapshot = snapshot
+            return snapshot
+        return self.snapshot
+
+    def close(self):
+        if self.snapshot is not None:
+            self.snapshot.release()
+            self.snapshot = None
+        if self._control is not None:
+            self._control.close()
+            self._control = None
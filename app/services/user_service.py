@@ -1,22 +1,77 @@
 # app/services/user_service.py
+import asyncio
+import json
 import logging
-from app.mongodb import db  # Import the db object from mongodb.py
+import time
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+from app.mongodb import get_db
+from app.services.activityChart_service import summarize_activities
+from app.services.cache_service import cached, user_namespace
+from app.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# Unbounded or heavy fields left out of the default profile; they are served
+# by /referrals and /activity instead.
+PROFILE_EXCLUDED_FIELDS = ("referrals", "activity_json")
+
+# A user can mint once more history rows than this are stored for them.
+MINT_MIN_HISTORY_COUNT = 10
+
+
+def normalize_address(address: str) -> str:
+    """
+    Canonical form of a wallet address, stored as `address_key` on users and history.
+    All lookups go through this key so they can use its index.
+    """
+    return address.strip().lower()
+
+
+def rank_percentile(rank: int, total_users: int) -> float:
+    """Share of users, in percent, ranked at or below `rank`: 100 for the top rank."""
+    if not total_users:
+        return 0.0
+    return round(100 * (total_users - rank + 1) / total_users, 2)
+
+
+def is_mint_eligible(user: dict) -> bool:
+    """Mint eligibility, read from the history_count maintained on the user."""
+    return user.get("history_count", 0) > MINT_MIN_HISTORY_COUNT
+
+
+def profile_projection(fields: tuple = None) -> dict:
+    """
+    Mongo projection for a user profile read.
+
+    None gives the lean default profile (everything but PROFILE_EXCLUDED_FIELDS),
+    ("*",) the full document, and any other tuple exactly those fields.
+    """
+    if fields is None:
+        return {field: 0 for field in PROFILE_EXCLUDED_FIELDS}
+    if fields == ("*",):
+        return None
+    projection = {field: 1 for field in fields}
+    projection.setdefault("_id", 0)
+    return projection
+
 
 # Get the User data based on the user's address.
-async def find_by_address(address: str) -> dict:
+@cached(
+    lambda address, fields=None: user_namespace(normalize_address(address)),
+    key=lambda address, fields=None: fields,
+)
+async def find_by_address(address: str, fields: tuple = None) -> dict:
     """
     Fetch user data from MongoDB based on the user's address.
+    `fields` selects the returned fields, see profile_projection().
     """
     try:
         # Use find_one to fetch the user data based on the address
-        user_data = await db.users.find_one({"address": address})
-
-        if user_data:
-            user_data["_id"] = str(user_data["_id"])
-            return user_data
+        # `_id` stays an ObjectId; the response serializer renders it as a string
+        return await get_db().users.find_one(
+            {"address_key": normalize_address(address)}, profile_projection(fields)
+        )
 
     except Exception as e:
         # Log the exception if needed
@@ -24,26 +79,52 @@ async def find_by_address(address: str) -> dict:
         return None  # Return None on error
 
 
-# Get the User data based on the user's address with complex pipeline.
+async def stream_users(addresses: list, fields: tuple = None, chunk_size: int = None):
+    """
+    Yield the profiles of many users, `fields` selecting the returned fields
+    as in profile_projection(). Every profile also carries its `address` and
+    `address_key`, so callers can tell which wallet each one belongs to.
+    Addresses are looked up `chunk_size` at a time with one `$in` query on
+    address_key each, and documents are yielded in cursor order, so at most
+    one chunk is held in memory. After each chunk, its addresses without a
+    user are yielded as {"address": ..., "error": "not_found"}.
+    """
+    if chunk_size is None:
+        chunk_size = settings.GET_USERS_CHUNK_SIZE
+
+    requested = {}  # address_key -> address as requested, first occurrence wins
+    for address in addresses:
+        requested.setdefault(normalize_address(address), address)
+    keys = list(requested)
+
+    projection = profile_projection(fields)
+    if projection is not None and 1 in projection.values():
+        projection = {**projection, "address": 1, "address_key": 1}
+
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start : start + chunk_size]
+        found = set()
+        async for user in get_db().users.find(
+            {"address_key": {"$in": chunk}}, projection
+        ).batch_size(chunk_size):
+            found.add(user.get("address_key"))
+            yield user
+        for key in chunk:
+            if key not in found:
+                yield {"address": requested[key], "error": "not_found"}
+
+
+# Get the User data based on the user's address, ignoring its case.
 async def find_by_address_complex(address: str) -> dict:
     """
-    Fetch user data from MongoDB based on the user's address using aggregation.
+    Fetch user data from MongoDB based on the user's address, case-insensitively,
+    through the indexed `address_key`.
     """
     try:
-        pipeline = [
-            {"$match": {"$expr": {"$eq": [{"$toLower": "$address"}, address.lower()]}}},
-            {"$project": {"_id": 0}},  # Exclude the _id field
-        ]
-
-        # Use aggregate with motor to fetch the data
-        user_cursor = db.users.aggregate(pipeline)
-
-        # Convert the cursor to a list to fetch the first document
-        user_of_db = await user_cursor.to_list(length=1)
-
-        if user_of_db:
-            return user_of_db[0]  # Return the first user document
-        return None  # No user found
+        return await get_db().users.find_one(
+            {"address_key": normalize_address(address)},
+            {"_id": 0},  # Exclude the _id field
+        )
 
     except Exception as e:
         # Log the exception if needed
@@ -56,7 +137,7 @@ async def get_top_users_by_kleo_points(limit=10):
     try:
         # Fetch users sorted by Kleo points in descending order, limit the result to `limit`
         cursor = (
-            db.users.find(
+            get_db().users.find(
                 {},  # No filter, fetch all users
                 {
                     "_id": 0,  # Exclude `_id`
@@ -70,16 +151,27 @@ async def get_top_users_by_kleo_points(limit=10):
 
         # Convert cursor to a list of users asynchronously
         users = await cursor.to_list(length=limit)
-
-        # Format the result into a leaderboard
-        leaderboard = [
-            {
-                "rank": index,  # Rank starts from 1
-                "address": user["address"],  # Include user's address
-                "kleo_points": user.get("kleo_points", 0),  # Include kleo_points
-            }
-            for index, user in enumerate(users, start=1)
-        ]
+        total_users = await get_db().users.count_documents({})
+
+        # Format the result into a leaderboard; ties share a rank (1, 2, 2, 4)
+        leaderboard = []
+        rank = dense_rank = 0
+        previous = None
+        for index, user in enumerate(users, start=1):
+            kleo_points = user.get("kleo_points") or 0
+            if kleo_points != previous:
+                rank = index
+                dense_rank += 1
+                previous = kleo_points
+            leaderboard.append(
+                {
+                    "rank": rank,
+                    "dense_rank": dense_rank,
+                    "percentile": rank_percentile(rank, total_users),
+                    "address": user["address"],
+                    "kleo_points": kleo_points,
+                }
+            )
 
         return leaderboard
     except Exception as e:
@@ -91,31 +183,45 @@ async def get_top_users_by_kleo_points(limit=10):
 async def calculate_rank(address: str):
     try:
         # First, get the user's Kleo points by address
-        user = await db.users.find_one(
-            {"address": address}, {"kleo_points": 1, "_id": 0}
+        user = await get_db().users.find_one(
+            {"address_key": normalize_address(address)},
+            {"address": 1, "kleo_points": 1, "_id": 0},
         )
 
         if not user:
             return {"error": "User not found"}, 404
 
-        user_kleo_points = user.get("kleo_points", 0)
+        user_kleo_points = user.get("kleo_points") or 0
 
         # Count how many users have more Kleo points
-        higher_ranked_users = await db.users.count_documents(
+        higher_ranked_users = await get_db().users.count_documents(
             {"kleo_points": {"$gt": user_kleo_points}}
         )
 
         # The rank is the number of users with more points, plus one
         rank = higher_ranked_users + 1
 
+        # The dense rank counts distinct scores instead of users
+        higher_scores = await get_db().users.aggregate(
+            [
+                {"$match": {"kleo_points": {"$gt": user_kleo_points}}},
+                {"$group": {"_id": "$kleo_points"}},
+                {"$count": "scores"},
+            ]
+        ).to_list(length=1)
+        dense_rank = (higher_scores[0]["scores"] if higher_scores else 0) + 1
+
         # Get total number of users
-        total_users = await db.users.count_documents({})
+        total_users = await get_db().users.count_documents({})
 
         return {
-            "address": address,
+            "address": user.get("address", address),
             "kleo_points": user_kleo_points,
             "rank": rank,
+            "dense_rank": dense_rank,
+            "percentile": rank_percentile(rank, total_users),
             "total_users": total_users,
+            "snapshot_at": time.time(),
         }
 
     except Exception as e:
@@ -125,63 +231,317 @@ async def calculate_rank(address: str):
         return {"error": "An error occurred while calculating rank"}, 500
 
 
-async def fetch_users_referrals(address: str) -> list:
+async def calculate_ranks(address_keys: list) -> dict:
     """
-    Fetch the user's referrals from MongoDB and include their kleo points.
+    Rank many users with three queries whatever their number: one projected
+    `$in` fetch of their points, one aggregation of the score distribution
+    at or above the lowest of those points, and the user count. Ranks are
+    then read off the distribution. Returns {address_key: rank entry} for
+    the users that exist.
     """
-    try:
-        # Fetch the user's data based on the address
-        user = await db.users.find_one({"address": address})
+    users = await get_db().users.find(
+        {"address_key": {"$in": address_keys}},
+        {"_id": 0, "address": 1, "address_key": 1, "kleo_points": 1},
+    ).to_list(length=None)
+    if not users:
+        return {}
+
+    for user in users:
+        if user.get("kleo_points") is None:
+            user["kleo_points"] = 0  # as $ifNull counts it below
+    lowest = min(user["kleo_points"] for user in users)
+    pipeline = [{"$group": {"_id": {"$ifNull": ["$kleo_points", 0]}, "users": {"$sum": 1}}}]
+    if lowest > 0:
+        pipeline.insert(0, {"$match": {"kleo_points": {"$gte": lowest}}})
+    distribution = await get_db().users.aggregate(pipeline).to_list(length=None)
+    total_users = await get_db().users.count_documents({})
+    snapshot_at = time.time()
+
+    # One pass over the scores, highest first: users strictly above and dense rank
+    standings = {}
+    above = 0
+    for dense_rank, score in enumerate(
+        sorted(distribution, key=lambda group: group["_id"], reverse=True), start=1
+    ):
+        standings[score["_id"]] = (above + 1, dense_rank)
+        above += score["users"]
+
+    ranks = {}
+    for user in users:
+        kleo_points = user["kleo_points"]
+        rank, dense_rank = standings[kleo_points]
+        ranks[user["address_key"]] = {
+            "address": user["address"],
+            "kleo_points": kleo_points,
+            "rank": rank,
+            "dense_rank": dense_rank,
+            "percentile": rank_percentile(rank, total_users),
+            "total_users": total_users,
+            "snapshot_at": snapshot_at,
+        }
+    return ranks
 
-        if not user:
-            return {"error": "User not found"}, 404
 
-        # Get the referrals list from the user's data
-        referrals = user.get("referrals", [])
-        if not referrals:
-            return []
+async def fetch_users_referrals(
+    address: str, limit: int = None, cursor: int = 0, sort_by_points: bool = False
+):
+    """
+    Fetch a page of the user's referrals from MongoDB and include their kleo points.
 
-        # Initialize a list to store referral details
-        referral_details = []
+    Uses two queries whatever the number of referrals: one for the referrer
+    (slicing the page out of `referrals` when possible) and one `$in` lookup
+    for the referred users' points.
 
-        # Iterate through each referral and get their kleo_points
-        for referral in referrals:
-            referred_user = await db.users.find_one(
-                {"address": referral["address"]}, {"kleo_points": 1, "_id": 0}
-            )
+    Returns {"referrals": [...], "next_cursor": int | None}, or None if the
+    user does not exist.
+    """
+    key = normalize_address(address)
 
-            # Extract kleo_points if user is found, otherwise default to 0
-            kleo_points = referred_user.get("kleo_points", 0) if referred_user else 0
+    # Without sorting, the page can be sliced out of the array by Mongo
+    if limit is not None and not sort_by_points:
+        projection = {"_id": 0, "address_key": 1, "referrals": {"$slice": [cursor, limit + 1]}}
+    else:
+        projection = {"_id": 0, "referrals": 1}
 
-            # Append the referral data along with kleo_points
-            referral_details.append(
-                {
-                    "address": referral["address"],
-                    "joining_date": referral["joining_date"],
-                    "kleo_points": kleo_points,
-                }
+    user = await get_db().users.find_one({"address_key": key}, projection)
+    if not user:
+        return None
+
+    referrals = user.get("referrals", [])
+    if not sort_by_points and limit is not None:
+        page = referrals[:limit]
+        has_more = len(referrals) > limit
+    else:
+        page = referrals
+
+    # Fetch kleo_points of every referred user on the page in one query
+    referred_keys = list({normalize_address(referral["address"]) for referral in page})
+    points = {}
+    if referred_keys:
+        referred_users = get_db().users.find(
+            {"address_key": {"$in": referred_keys}},
+            {"_id": 0, "address_key": 1, "kleo_points": 1},
+        )
+        async for referred_user in referred_users:
+            points[referred_user["address_key"]] = referred_user.get("kleo_points") or 0
+
+    referral_details = [
+        {
+            "address": referral["address"],
+            "joining_date": referral["joining_date"],
+            # Default to 0 if the referred user is not found
+            "kleo_points": points.get(normalize_address(referral["address"]), 0),
+        }
+        for referral in page
+    ]
+
+    if sort_by_points:
+        referral_details.sort(key=lambda referral: -referral["kleo_points"])
+        if limit is not None:
+            has_more = len(referral_details) > cursor + limit
+            referral_details = referral_details[cursor : cursor + limit]
+
+    if limit is None:
+        return {"referrals": referral_details, "next_cursor": None}
+    return {
+        "referrals": referral_details,
+        "next_cursor": cursor + limit if has_more else None,
+    }
+
+
+async def increment_history_counters(
+    address: str, category_counts: dict, history_count: int = 0, data_quantity: int = 0
+):
+    """
+    Add newly ingested history to the user's counters with a single `$inc`:
+    the per-category activity counts, history_count and total_data_quantity.
+    The top activities summary stored next to them is then re-materialized.
+
+    history_count and total_data_quantity are only incremented on users that
+    already have a history_count. A user created before it was maintained
+    gets its activity counts incremented and its counters recomputed from
+    the history collection instead, since `$inc` would start them from zero.
+    """
+    activity_increments = {
+        f"activity_json.{category}": count for category, count in category_counts.items()
+    }
+    increments = dict(activity_increments)
+    if history_count:
+        increments["history_count"] = history_count
+    if data_quantity:
+        increments["total_data_quantity"] = data_quantity
+    if not increments:
+        return
+
+    key = normalize_address(address)
+    counters_missing = False
+    try:
+        if len(increments) == len(activity_increments):
+            user = await get_db().users.find_one_and_update(
+                {"address_key": key},
+                {"$inc": increments},
+                projection={"_id": 0, "activity_json": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+        else:
+            user = await get_db().users.find_one_and_update(
+                {"address_key": key, "history_count": {"$exists": True}},
+                {"$inc": increments},
+                projection={"_id": 0, "activity_json": 1},
+                return_document=ReturnDocument.AFTER,
             )
+            if user is None:
+                counters_missing = True
+                if activity_increments:
+                    user = await get_db().users.find_one_and_update(
+                        {"address_key": key},
+                        {"$inc": activity_increments},
+                        projection={"_id": 0, "activity_json": 1},
+                        return_document=ReturnDocument.AFTER,
+                    )
+    except OperationFailure as e:
+        # Legacy users may still hold activity_json as a string until backfilled
+        logger.error(f"Failed to increment history counters for {address}: {e}")
+        return
+
+    if counters_missing:
+        # history_services imports this module
+        from app.services.history_services import reconcile_history_counters
+
+        await reconcile_history_counters(address_key=key)
+
+    if user and category_counts:
+        await get_db().users.update_one(
+            {"address_key": key},
+            {"$set": {"activity_summary": summarize_activities(user["activity_json"])}},
+        )
 
-        return referral_details
 
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
-        return {"error": "An error occurred while fetching referrals."}, 500
+# Background retries of history counter increments, referenced until they finish
+_counter_retries = set()
+COUNTER_RETRY_MAX_BACKOFF_SECONDS = 30
 
 
-async def get_activity_json(address):
-    """Fetch the user's activity JSON from the database."""
+async def increment_history_counters_or_retry(
+    address: str, category_counts: dict, history_count: int = 0, data_quantity: int = 0
+):
+    """
+    increment_history_counters() for rows that are already written. If it
+    fails, it is retried in the background instead of failing the request:
+    a client retrying the request would find its rows stored and count none.
+    """
     try:
-        user = await db.users.find_one(
-            {"address": address},
-            {"_id": 0, "activity_json": 1},  # Exclude _id, include only activity_json
-        )
+        await increment_history_counters(address, category_counts, history_count, data_quantity)
+        return
+    except Exception as e:
+        logger.error(f"Failed to increment history counters for {address}, retrying: {e}")
+
+    async def retry():
+        backoff = settings.INGEST_RETRY_BACKOFF_SECONDS
+        while True:
+            await asyncio.sleep(backoff)
+            try:
+                await increment_history_counters(
+                    address, category_counts, history_count, data_quantity
+                )
+                return
+            except Exception as e:
+                logger.error(f"Retrying history counters for {address} in {backoff}s: {e}")
+                backoff = min(backoff * 2, COUNTER_RETRY_MAX_BACKOFF_SECONDS)
+
+    task = asyncio.create_task(retry())
+    _counter_retries.add(task)
+    task.add_done_callback(_counter_retries.discard)
+
+
+async def get_activity_counts(address: str):
+    """
+    Fetch the user's raw activity counts. Returns None if the user does not exist.
+    """
+    user = await get_db().users.find_one(
+        {"address_key": normalize_address(address)},
+        {"_id": 0, "activity_json": 1},
+    )
+    if user is None:
+        return None
+    activity_json = user.get("activity_json") or {}
+    if isinstance(activity_json, str):
+        activity_json = json.loads(activity_json) if activity_json else {}
+    return activity_json
 
-        if user:
-            return user.get("activity_json", "")  # Return activity_json if it exists
-        else:
-            return {}  # Return empty dict if user not found
 
-    except Exception as e:
-        print(f"An error occurred while retrieving activity json: {e}")
+async def refresh_activity_summary(address: str) -> list:
+    """Recompute and store the activity summary of one user from its counts."""
+    key = normalize_address(address)
+    user = await get_db().users.find_one({"address_key": key}, {"_id": 0, "activity_json": 1})
+    if not user:
+        return []
+
+    activity_json = user.get("activity_json") or {}
+    if isinstance(activity_json, str):
+        activity_json = json.loads(activity_json) if activity_json else {}
+    summary = summarize_activities(activity_json)
+    await get_db().users.update_one(
+        {"address_key": key},
+        {"$set": {"activity_json": activity_json, "activity_summary": summary}},
+    )
+    return summary
+
+
+@cached("graph", key=lambda address: normalize_address(address))
+async def get_activity_summary(address: str):
+    """
+    Fetch the user's materialized top activities with a single projected read.
+    Users written before the summary existed get it computed once here.
+    Returns None if the user does not exist.
+    """
+    user = await get_db().users.find_one(
+        {"address_key": normalize_address(address)},
+        {"_id": 0, "activity_summary": 1},
+    )
+    if user is None:
         return None
+    if "activity_summary" not in user:
+        return await refresh_activity_summary(address)
+    return user["activity_summary"]
+
+
+async def backfill_activity_summaries(batch_size: int = 500):
+    """
+    Materialize activity summaries for users that do not have one yet,
+    converting legacy string activity_json into counts on the way.
+    """
+    cursor = get_db().users.find(
+        {"activity_summary": {"$exists": False}},
+        {"_id": 1, "activity_json": 1},
+    ).batch_size(batch_size)
+
+    updates = []
+    backfilled = 0
+    async for user in cursor:
+        activity_json = user.get("activity_json") or {}
+        try:
+            if isinstance(activity_json, str):
+                activity_json = json.loads(activity_json) if activity_json else {}
+            summary = summarize_activities(activity_json)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Skipping unreadable activity_json of user {user['_id']}: {e}")
+            continue
+
+        updates.append(
+            UpdateOne(
+                {"_id": user["_id"]},
+                {"$set": {"activity_json": activity_json, "activity_summary": summary}},
+            )
+        )
+        if len(updates) >= batch_size:
+            await get_db().users.bulk_write(updates, ordered=False)
+            backfilled += len(updates)
+            updates = []
+
+    if updates:
+        await get_db().users.bulk_write(updates, ordered=False)
+        backfilled += len(updates)
+
+    if backfilled:
+        logger.info(f"Backfilled activity summaries for {backfilled} users")
@@ -10,7 +10,97 @@ class Settings:
     PROJECT_NAME: str = "KLEO Backend"
     DB_URL: str = os.getenv("DB_URL")
     DB_NAME: str = os.getenv("DB_NAME")
+    MONGO_MAX_POOL_SIZE: int = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+    MONGO_MIN_POOL_SIZE: int = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+    MONGO_WARMUP_CONNECTIONS: int = int(os.getenv("MONGO_WARMUP_CONNECTIONS", 5))
+    MONGO_MAX_IDLE_TIME_MS: int = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000))
+    MONGO_CONNECT_TIMEOUT_MS: int = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = int(
+        os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)
+    )
+    MONGO_SOCKET_TIMEOUT_MS: int = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 20000))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000))
+    # Preferred wire compressors, in order; missing optional packages are skipped
+    MONGO_COMPRESSORS: list = [
+        name.strip()
+        for name in os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib").split(",")
+        if name.strip()
+    ]
     IMGBB_API_KEY: str = os.getenv("IMGBB_API_KEY")
+    JWT_SECRET: str = os.getenv("SECRET", "default_secret")
+    JWT_ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
+    # PEM key files, only used with asymmetric algorithms (RS256, ES256, ...)
+    JWT_PRIVATE_KEY_FILE: str = os.getenv("JWT_PRIVATE_KEY_FILE")
+    JWT_PUBLIC_KEY_FILE: str = os.getenv("JWT_PUBLIC_KEY_FILE")
+    JWT_TTL_SECONDS: int = int(os.getenv("JWT_TTL_SECONDS", 7 * 24 * 3600))
+    JWT_LEEWAY_SECONDS: int = int(os.getenv("JWT_LEEWAY_SECONDS", 30))
+    JWT_CACHE_SIZE: int = int(os.getenv("JWT_CACHE_SIZE", 10000))
+    # Reject write requests without a bearer token; tokens sent are always verified
+    AUTH_REQUIRED: bool = os.getenv("AUTH_REQUIRED", "false").lower() in ("1", "true", "yes")
+    HTTP_MAX_CONNECTIONS: int = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 10))
+    HTTP_TIMEOUT_SECONDS: float = float(os.getenv("HTTP_TIMEOUT_SECONDS", 15))
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", 5))
+    IMGBB_MAX_RETRIES: int = int(os.getenv("IMGBB_MAX_RETRIES", 2))
+    IMGBB_RETRY_BACKOFF_SECONDS: float = float(os.getenv("IMGBB_RETRY_BACKOFF_SECONDS", 0.5))
+    MAX_UPLOAD_BYTES: int = int(os.getenv("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+    IMGBB_CACHE_SIZE: int = int(os.getenv("IMGBB_CACHE_SIZE", 1024))
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+    CACHE_TTL_SECONDS: float = float(os.getenv("CACHE_TTL_SECONDS", 60))
+    CACHE_LEADERBOARD_TTL_SECONDS: float = float(
+        os.getenv("CACHE_LEADERBOARD_TTL_SECONDS", 15)
+    )
+    # "memory" applies invalidations made by this worker only; "change_stream"
+    # also tails the users and history collections (needs a replica set).
+    CACHE_INVALIDATION_BACKEND: str = os.getenv("CACHE_INVALIDATION_BACKEND", "memory")
+    CACHE_INVALIDATION_RETRY_SECONDS: float = float(
+        os.getenv("CACHE_INVALIDATION_RETRY_SECONDS", 5)
+    )
+    LEADERBOARD_REFRESH_SECONDS: int = int(os.getenv("LEADERBOARD_REFRESH_SECONDS", 300))
+    RANKS_MAX_ADDRESSES: int = int(os.getenv("RANKS_MAX_ADDRESSES", 5000))
+    GET_USERS_MAX_ADDRESSES: int = int(os.getenv("GET_USERS_MAX_ADDRESSES", 10000))
+    # Addresses per `$in` query of /get-users, and so users held in memory at a time
+    GET_USERS_CHUNK_SIZE: int = int(os.getenv("GET_USERS_CHUNK_SIZE", 500))
+    LEADERBOARD_MATERIALIZE_SECONDS: int = int(os.getenv("LEADERBOARD_MATERIALIZE_SECONDS", 300))
+    # Share one leaderboard snapshot between the workers of a host through shared memory
+    LEADERBOARD_SHARED_MEMORY: bool = os.getenv("LEADERBOARD_SHARED_MEMORY", "false").lower() in ("1", "true", "yes")
+    LEADERBOARD_SHM_NAME: str = os.getenv("LEADERBOARD_SHM_NAME", "kleo_leaderboard")
+    LEADERBOARD_SNAPSHOT_SECONDS: float = float(os.getenv("LEADERBOARD_SNAPSHOT_SECONDS", 5))
+    HISTORY_PAGE_SIZE: int = int(os.getenv("HISTORY_PAGE_SIZE", 50))
+    HISTORY_MAX_PAGE_SIZE: int = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 1000))
+    # Documents fetched per getMore while streaming a user's history
+    HISTORY_STREAM_BATCH_SIZE: int = int(os.getenv("HISTORY_STREAM_BATCH_SIZE", 1000))
+    # "sync" writes /save-history before answering, "async" queues it (202 + job id)
+    HISTORY_INGEST_MODE: str = os.getenv("HISTORY_INGEST_MODE", "sync")
+    # Each worker spools to its own slot next to this path, e.g. spool/history_ingest.0.jsonl
+    INGEST_SPOOL_PATH: str = os.getenv("INGEST_SPOOL_PATH", "spool/history_ingest.jsonl")
+    # A spool larger than this is rewritten with only its unflushed jobs
+    INGEST_SPOOL_COMPACT_BYTES: int = int(os.getenv("INGEST_SPOOL_COMPACT_BYTES", 64 * 1024 * 1024))
+    INGEST_SPOOL_FSYNC: bool = os.getenv("INGEST_SPOOL_FSYNC", "true").lower() in ("1", "true", "yes")
+    INGEST_QUEUE_MAX_ITEMS: int = int(os.getenv("INGEST_QUEUE_MAX_ITEMS", 100000))
+    INGEST_BATCH_MAX_ITEMS: int = int(os.getenv("INGEST_BATCH_MAX_ITEMS", 2000))
+    INGEST_BATCH_MAX_WAIT_SECONDS: float = float(os.getenv("INGEST_BATCH_MAX_WAIT_SECONDS", 0.5))
+    INGEST_RETRY_BACKOFF_SECONDS: float = float(os.getenv("INGEST_RETRY_BACKOFF_SECONDS", 1))
+    INGEST_JOB_STATUS_SIZE: int = int(os.getenv("INGEST_JOB_STATUS_SIZE", 10000))
+    # How long job statuses stay in the shared ingest_jobs collection
+    INGEST_JOB_STATUS_TTL_SECONDS: int = int(os.getenv("INGEST_JOB_STATUS_TTL_SECONDS", 86400))
+    INGEST_SHUTDOWN_TIMEOUT_SECONDS: float = float(
+        os.getenv("INGEST_SHUTDOWN_TIMEOUT_SECONDS", 10)
+    )
+    HISTORY_RECONCILE_BATCH_SIZE: int = int(os.getenv("HISTORY_RECONCILE_BATCH_SIZE", 200))
+    # Full recompute of history_count / total_data_quantity; 0 only backfills at startup
+    HISTORY_RECONCILE_INTERVAL_SECONDS: int = int(
+        os.getenv("HISTORY_RECONCILE_INTERVAL_SECONDS", 86400)
+    )
+    # Per-address Bloom filters of already stored history rows. A false positive
+    # drops a genuinely new row, so keep HISTORY_BLOOM_FP_RATE small.
+    HISTORY_BLOOM_ENABLED: bool = os.getenv("HISTORY_BLOOM_ENABLED", "true").lower() in ("1", "true", "yes")
+    HISTORY_BLOOM_CAPACITY: int = int(os.getenv("HISTORY_BLOOM_CAPACITY", 10000))
+    HISTORY_BLOOM_FP_RATE: float = float(os.getenv("HISTORY_BLOOM_FP_RATE", 0.0001))
+    HISTORY_BLOOM_MAX_BYTES: int = int(os.getenv("HISTORY_BLOOM_MAX_BYTES", 64 * 1024 * 1024))
+    # Serve as soon as possible: skip the startup ping and pool warm-up, build
+    # indexes in the background and open the outbound HTTP client on first use.
+    FAST_STARTUP: bool = os.getenv("FAST_STARTUP", "false").lower() in ("1", "true", "yes")
 
 
 settings = Settings()
@@ -0,0 +1,371 @@
+# benchmarks/bench_endpoints.py
+"""
+Load-test every route of app/api/user_v1.py in-process and report latency.
+
+Requests go through httpx.ASGITransport straight into the FastAPI app, with a
+configurable number of concurrent clients. Mongo is either the in-memory
+FakeDatabase (default) or a real server given with --mongo-url; Imgbb is
+always FakeImgbbTransport. For each endpoint the throughput and p50/p95/p99
+latencies are printed, and can be written to or compared with a JSON baseline.
+
+    python -m benchmarks.bench_endpoints --users 100000 --history 1000000
+    python -m benchmarks.bench_endpoints --write-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_endpoints --baseline benchmarks/baseline.json
+    python -m benchmarks.bench_endpoints --mongo-url mongodb://localhost:27017 \\
+        --db-name kleo_bench --users 100000 --history 10000000
+
+Exits with status 1 when --baseline is given and an endpoint regressed.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+from app import mongodb
+from app.constants import ACTIVITIES
+from app.main import app
+from app.models.history_model import History
+from app.models.user_model import User
+from app.services.activityChart_service import (
+    close_http_client,
+    start_http_client,
+    summarize_activities,
+)
+from app.services.cache_service import response_cache
+from app.services.ingestion_service import start_ingestion_queue, stop_ingestion_queue
+from app.services.leaderboard_service import refresh_leaderboard
+from app.settings import settings
+from benchmarks.fakes import FakeDatabase, FakeImgbbTransport
+
+API_PREFIX = "/api/v1/user"
+PNG_CHART = b"\x89PNG\r\n\x1a\n" + bytes(32 * 1024)
+SEED_CHUNK_SIZE = 5000
+
+
+def address_of(index: int) -> str:
+    return f"0x{index:040x}"
+
+
+def make_user(index: int, rng: random.Random, referrals: int) -> dict:
+    activity_json = {
+        activity: rng.randint(0, 50) for activity in rng.sample(ACTIVITIES, 10)
+    }
+    document = User(
+        address=address_of(index),
+        slug=str(rng.randint(100, 9999999)),
+        kleo_points=rng.randint(0, 100000),
+        activity_json=activity_json,
+        activity_summary=summarize_activities(activity_json),
+        referrals=[
+            {"address": address_of(rng.randrange(index + 1)), "joining_date": 0}
+            for _ in range(referrals)
+        ],
+    ).document
+    return document
+
+
+def make_history(address: str, rng: random.Random, visit_time: float) -> dict:
+    page = rng.randrange(1_000_000)
+    return History(
+        address=address,
+        title=f"Page {page}",
+        category=rng.choice(ACTIVITIES),
+        url=f"https://example.com/{page}",
+        domain="example.com",
+        visitTime=visit_time,
+    ).document
+
+
+def seed_batches(args, rng: random.Random):
+    """Yield ("users" | "history", documents) chunks for the configured seed sizes."""
+    batch = []
+    for index in range(args.users):
+        referrals = args.referrals if index < args.referrers else 0
+        batch.append(make_user(index, rng, referrals))
+        if len(batch) >= SEED_CHUNK_SIZE:
+            yield "users", batch
+            batch = []
+    if batch:
+        yield "users", batch
+
+    batch = []
+    for row in range(args.history):
+        address = address_of(rng.randrange(args.users))
+        batch.append(make_history(address, rng, 1.7e12 + row))
+        if len(batch) >= SEED_CHUNK_SIZE:
+            yield "history", batch
+            batch = []
+    if batch:
+        yield "history", batch
+
+
+async def seed(args, rng: random.Random):
+    database = mongodb.get_db()
+    if args.mongo_url and not args.reseed:
+        if await database.users.estimated_document_count() >= args.users:
+            print("Reusing existing seed data (pass --reseed to rebuild it)")
+            return
+    if args.mongo_url:
+        await database.users.drop()
+        await database.history.drop()
+
+    for name, indexes in mongodb.REQUIRED_INDEXES.items():
+        await database[name].create_indexes(indexes)
+
+    started = time.perf_counter()
+    for name, documents in seed_batches(args, rng):
+        if isinstance(database, FakeDatabase):
+            for document in documents:
+                database[name]._insert(document)
+        else:
+            await database[name].insert_many(documents, ordered=False)
+    print(
+        f"Seeded {args.users} users and {args.history} history rows "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+def scenarios(args, rng: random.Random) -> dict:
+    """Endpoint name -> factory returning the kwargs of one request."""
+
+    def any_address():
+        return address_of(rng.randrange(args.users))
+
+    def new_address():
+        return f"0x{rng.getrandbits(160):040x}"
+
+    def history_items():
+        return [
+            {
+                "title": f"Page {i}",
+                "category": rng.choice(ACTIVITIES),
+                "url": f"https://example.com/{rng.randrange(1_000_000)}",
+                "domain": "example.com",
+                "content": "",
+                "lastVisitTime": time.time() * 1000,
+            }
+            for i in range(args.history_batch)
+        ]
+
+    return {
+        "get_user": lambda: {"method": "GET", "url": f"/get-user/{any_address()}"},
+        "get_user_graph": lambda: {
+            "method": "GET",
+            "url": f"/get-user-graph/{any_address()}",
+        },
+        "rank": lambda: {"method": "GET", "url": f"/rank/{any_address()}"},
+        "ranks": lambda: {
+            "method": "POST",
+            "url": "/ranks",
+            "json": {"addresses": [any_address() for _ in range(args.ranks_batch)]},
+        },
+        "top_users": lambda: {"method": "GET", "url": "/top-users?limit=20"},
+        "top_users_with_address": lambda: {
+            "method": "GET",
+            "url": f"/top-users?limit=20&address={any_address()}",
+        },
+        "referrals": lambda: {
+            "method": "GET",
+            "url": f"/referrals/{address_of(rng.randrange(max(args.referrers, 1)))}?limit=50",
+        },
+        "history": lambda: {
+            "method": "GET",
+            "url": f"/history/{any_address()}?limit=50",
+        },
+        "history_stream": lambda: {
+            "method": "GET",
+            "url": f"/history/{any_address()}?stream=true",
+        },
+        "create_user": lambda: {
+            "method": "POST",
+            "url": "/create-user",
+            "json": {"address": new_address()},
+        },
+        "save_history": lambda: {
+            "method": "POST",
+            "url": "/save-history",
+            "json": {
+                "address": any_address(),
+                "signup": False,
+                "history": history_items(),
+            },
+        },
+        "save_history_async": lambda: {
+            "method": "POST",
+            "url": "/save-history?mode=async",
+            "json": {
+                "address": any_address(),
+                "signup": False,
+                "history": history_items(),
+            },
+        },
+        "upload_activity_chart": lambda: {
+            "method": "POST",
+            "url": "/upload_activity_chart",
+            "content": PNG_CHART,
+            "headers": {"Content-Type": "image/png"},
+        },
+    }
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_endpoint(client: httpx.AsyncClient, make_request, args) -> dict:
+    latencies = []
+    errors = 0
+    remaining = args.requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            request = make_request()
+            request["url"] = API_PREFIX + request["url"]
+            started = time.perf_counter()
+            response = await client.request(**request)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / wall, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return a description of every endpoint slower than the baseline beyond `tolerance`."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {result['p95_ms']}ms vs baseline {previous['p95_ms']}ms"
+            )
+        if result["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {result['throughput']} req/s vs baseline {previous['throughput']} req/s"
+            )
+    return regressions
+
+
+async def main(args) -> int:
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+
+    if args.mongo_url:
+        settings.DB_URL = args.mongo_url
+        settings.DB_NAME = args.db_name
+        await mongodb.connect_to_mongo()
+    else:
+        mongodb.db = FakeDatabase(rtt=args.rtt_ms / 1000)
+    await start_http_client(FakeImgbbTransport())
+    spool_dir = tempfile.TemporaryDirectory()
+    settings.INGEST_SPOOL_PATH = os.path.join(spool_dir.name, "history_ingest.jsonl")
+    await start_ingestion_queue()
+
+    await seed(args, rng)
+    if not args.cold_leaderboard:
+        await refresh_leaderboard()
+    if args.no_cache:
+        response_cache.maxsize = 0
+
+    selected = scenarios(args, rng)
+    if args.endpoints:
+        selected = {name: selected[name] for name in args.endpoints}
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(
+            f"{'endpoint':<24} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+            f"{'p99 ms':>9} {'errors':>7}"
+        )
+        for name, make_request in selected.items():
+            result = await run_endpoint(client, make_request, args)
+            results[name] = result
+            print(
+                f"{name:<24} {result['throughput']:>9} {result['p50_ms']:>9} "
+                f"{result['p95_ms']:>9} {result['p99_ms']:>9} {result['errors']:>7}"
+            )
+
+    await stop_ingestion_queue()
+    spool_dir.cleanup()
+    await close_http_client()
+    if args.mongo_url:
+        await mongodb.close_db_connection()
+
+    report = {
+        "meta": {
+            "users": args.users,
+            "history": args.history,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "backend": "mongo" if args.mongo_url else "fake",
+            "rtt_ms": args.rtt_ms,
+        },
+        "endpoints": results,
+    }
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Baseline written to {args.write_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=100000)
+    parser.add_argument("--referrers", type=int, default=100, help="Users with referrals")
+    parser.add_argument("--referrals", type=int, default=1000, help="Referrals per referrer")
+    parser.add_argument("--history-batch", type=int, default=50, help="Items per /save-history")
+    parser.add_argument("--ranks-batch", type=int, default=1000, help="Addresses per /ranks")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--endpoints", nargs="+", help="Only run these endpoints")
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="Fake Mongo latency")
+    parser.add_argument("--mongo-url", help="Benchmark against a real MongoDB instead")
+    parser.add_argument("--db-name", default="kleo_bench")
+    parser.add_argument("--reseed", action="store_true", help="Drop and reseed --mongo-url data")
+    parser.add_argument("--cold-leaderboard", action="store_true")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", help="Compare with this JSON baseline")
+    parser.add_argument("--write-baseline", help="Write the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,92 @@
+# benchmarks/bench_save_history.py
+"""
+Compare the legacy per-item History.save() path with the batched
+History.save_many() ingestion path, and a repeated extension sync of the same
+items, which the per-address Bloom filters answer without writing.
+
+Mongo is replaced by the in-memory FakeDatabase, which counts round trips and
+sleeps a configurable simulated network latency per call, so the numbers show
+how the write pattern scales rather than how fast a particular cluster is.
+
+    python -m benchmarks.bench_save_history --sizes 100 1000 10000 --rtt-ms 0.5
+"""
+import argparse
+import asyncio
+import time
+
+from app import mongodb
+from app.models.history_model import History
+from app.services.bloom_service import seen_history
+from benchmarks.fakes import FakeDatabase
+
+
+async def install_fakes(rtt: float) -> dict:
+    database = FakeDatabase(rtt=rtt)
+    mongodb.db = database
+    for name, indexes in mongodb.REQUIRED_INDEXES.items():
+        await database[name].create_indexes(indexes)
+    database.reset_stats()
+    return database.stats
+
+
+def make_items(count: int) -> list:
+    return [
+        {
+            "title": f"Page {i}",
+            "category": "Coding",
+            "url": f"https://example.com/{i}",
+            "domain": "example.com",
+            "content": "",
+            "lastVisitTime": 1700000000000.0 + i,
+        }
+        for i in range(count)
+    ]
+
+
+async def run_legacy(address: str, items: list):
+    for item in items:
+        await History.from_extension_item(address, item).save()
+
+
+async def run_batched(address: str, items: list):
+    await History.save_many(address, items)
+
+
+async def measure(runner, size: int, rtt: float, prepare=None) -> dict:
+    stats = await install_fakes(rtt)
+    seen_history.clear()
+    items = make_items(size)
+    if prepare is not None:
+        await prepare("0xbenchmark", items)
+        stats["round_trips"] = 0
+    started = time.perf_counter()
+    await runner("0xbenchmark", items)
+    elapsed = time.perf_counter() - started
+    return {"round_trips": stats["round_trips"], "seconds": elapsed}
+
+
+async def main(sizes: list, rtt_ms: float):
+    rtt = rtt_ms / 1000
+    print(f"{'items':>8} {'path':>8} {'round trips':>12} {'wall (s)':>10}")
+    for size in sizes:
+        for name, runner, prepare in (
+            ("legacy", run_legacy, None),
+            ("batched", run_batched, None),
+            # the same items again, after a first sync stored them
+            ("resend", run_batched, run_batched),
+        ):
+            result = await measure(runner, size, rtt, prepare)
+            print(
+                f"{size:>8} {name:>8} {result['round_trips']:>12} "
+                f"{result['seconds']:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument(
+        "--rtt-ms", type=float, default=0.5, help="Simulated Mongo round-trip time"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.rtt_ms))
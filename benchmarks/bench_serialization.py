@@ -0,0 +1,124 @@
+# benchmarks/bench_serialization.py
+"""
+Serialization cost of the /get-user and /top-users?limit=1000 payloads,
+and of the /save-history mint payload.
+
+Compares FastAPI's default path (jsonable_encoder + stdlib json, as used by
+JSONResponse) with the orjson path used for user documents and the
+pydantic-core TypeAdapter path used for the leaderboard. The mint payload is
+built with and without the full contract ABI.
+
+    python -m benchmarks.bench_serialization --referrals 1000 --number 200
+"""
+import argparse
+import json
+import random
+import timeit
+from datetime import datetime
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.constants import ACTIVITIES
+from app.models.user_model import LeaderboardEntry, User
+from app.responses import dumps
+from app.services.chain_service import build_mint_payload
+
+
+def make_user(referrals: int) -> dict:
+    rng = random.Random(1)
+    document = User(
+        address="0x" + "ab" * 20,
+        slug="123456",
+        kleo_points=4242,
+        activity_json={activity: rng.randint(0, 500) for activity in ACTIVITIES},
+        referrals=[
+            {"address": f"0x{i:040x}", "joining_date": 1700000000 + i}
+            for i in range(referrals)
+        ],
+    ).document
+    document["_id"] = ObjectId()
+    document["updated_at"] = datetime.now()
+    return document
+
+
+def make_leaderboard(size: int) -> list:
+    return [
+        {
+            "rank": rank,
+            "dense_rank": rank,
+            "percentile": round(100 * (size - rank + 1) / size, 2),
+            "address": f"0x{rank:040x}",
+            "kleo_points": 1_000_000 - rank,
+        }
+        for rank in range(1, size + 1)
+    ]
+
+
+def stdlib_json(content) -> bytes:
+    # What JSONResponse(content=jsonable_encoder(...)) does
+    return json.dumps(
+        jsonable_encoder(content, custom_encoder={ObjectId: str}),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def report(name: str, candidates: dict, number: int):
+    print(name)
+    baseline = None
+    for label, func in candidates.items():
+        seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+        baseline = baseline or seconds
+        print(f"  {label:<28} {seconds * 1e6:>10.1f} us  {baseline / seconds:>6.1f}x")
+
+
+def main(referrals: int, limit: int, number: int):
+    user = make_user(referrals)
+    leaderboard = make_leaderboard(limit)
+    leaderboard_adapter = TypeAdapter(List[LeaderboardEntry])
+
+    report(
+        f"/get-user ({referrals} referrals)",
+        {
+            "jsonable_encoder + json": lambda: stdlib_json(user),
+            "orjson": lambda: dumps(user),
+        },
+        number,
+    )
+    report(
+        f"/top-users?limit={limit}",
+        {
+            "jsonable_encoder + json": lambda: stdlib_json(leaderboard),
+            "orjson": lambda: dumps(leaderboard),
+            "TypeAdapter.dump_json": lambda: leaderboard_adapter.dump_json(leaderboard),
+        },
+        number,
+    )
+
+    address = "0x" + "ab" * 20
+    compact = dumps(build_mint_payload(address, "default_hash"))
+    full = dumps(build_mint_payload(address, "default_hash", include_abi=True))
+    report(
+        f"/save-history mint payload ({len(full)} B with ABI, {len(compact)} B without)",
+        {
+            "with ABI": lambda: dumps(
+                build_mint_payload(address, "default_hash", include_abi=True)
+            ),
+            "transaction only": lambda: dumps(build_mint_payload(address, "default_hash")),
+        },
+        number,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--referrals", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+    main(args.referrals, args.limit, args.number)
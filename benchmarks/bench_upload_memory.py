@@ -0,0 +1,80 @@
+# benchmarks/bench_upload_memory.py
+"""
+Peak memory of /upload_activity_chart for base64-in-JSON versus streamed raw uploads.
+
+The app is driven in-process through httpx.ASGITransport and Imgbb is replaced
+by FakeImgbbTransport, which drains the upload without keeping it, so the
+tracemalloc peak reflects what the service itself holds per upload.
+
+    python -m benchmarks.bench_upload_memory --sizes-mb 1 4 16
+"""
+import argparse
+import asyncio
+import base64
+import logging
+import tracemalloc
+
+import httpx
+
+from app import mongodb
+from app.main import app
+from app.services import activityChart_service
+from app.settings import settings
+from benchmarks.fakes import FakeDatabase, FakeImgbbTransport
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+CHUNK_SIZE = 64 * 1024
+UPLOAD_PATH = "/api/v1/user/upload_activity_chart"
+
+
+async def raw_body(size: int):
+    yield PNG_HEADER
+    remaining = size - len(PNG_HEADER)
+    while remaining > 0:
+        chunk = min(CHUNK_SIZE, remaining)
+        yield b"\0" * chunk
+        remaining -= chunk
+
+
+async def upload(client: httpx.AsyncClient, mode: str, size: int) -> int:
+    tracemalloc.start()
+    if mode == "json":
+        image = PNG_HEADER + b"\0" * (size - len(PNG_HEADER))
+        payload = {"image": base64.b64encode(image).decode()}
+        del image
+        response = await client.post(UPLOAD_PATH, json=payload)
+    else:
+        response = await client.post(
+            UPLOAD_PATH,
+            content=raw_body(size),
+            headers={"Content-Type": "image/png"},
+        )
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    response.raise_for_status()
+    return peak
+
+
+async def main(sizes_mb: list):
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    settings.MAX_UPLOAD_BYTES = max(sizes_mb) * 1024 * 1024 + 1
+    mongodb.db = FakeDatabase()
+    await activityChart_service.start_http_client(FakeImgbbTransport())
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'size (MB)':>10} {'mode':>6} {'peak (MB)':>10}")
+        for size_mb in sizes_mb:
+            for mode in ("json", "raw"):
+                activityChart_service._upload_url_cache.clear()
+                peak = await upload(client, mode, size_mb * 1024 * 1024)
+                print(f"{size_mb:>10} {mode:>6} {peak / 1024 / 1024:>10.2f}")
+
+    await activityChart_service.close_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes_mb))
@@ -0,0 +1,105 @@
+# benchmarks/check_import_time.py
+"""
+Import-time budget for app.main.
+
+Imports the app in a fresh interpreter with `-X importtime`, prints the
+slowest modules and exits with status 1 when the cumulative import time of
+app.main is over the budget. A second interpreter imports the app with
+sockets disabled, failing if anything reaches for the network at import.
+
+    python -m benchmarks.check_import_time --budget-ms 750
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BUDGET_MS = 750
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NO_NETWORK = """
+import socket
+
+def refuse(*args, **kwargs):
+    raise RuntimeError("network access at import time")
+
+socket.socket.connect = refuse
+socket.socket.connect_ex = refuse
+socket.getaddrinfo = refuse
+socket.create_connection = refuse
+import app.main
+"""
+
+
+def app_env() -> dict:
+    env = dict(os.environ)
+    # Settings read these at import; any value will do since nothing connects
+    env.setdefault("DB_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "kleo")
+    # Importable from any working directory, e.g. pytest run from elsewhere
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def measure_imports() -> list:
+    """(self us, cumulative us, module) for every module app.main imports."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True,
+        text=True,
+        env=app_env(),
+    )
+    if result.returncode != 0:
+        sys.exit(f"import app.main failed:\n{result.stderr}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        timings.append((int(self_us), int(cumulative_us), module.strip()))
+    return timings
+
+
+def check_no_network():
+    result = subprocess.run(
+        [sys.executable, "-c", NO_NETWORK], capture_output=True, text=True, env=app_env()
+    )
+    if result.returncode != 0:
+        sys.exit(f"import app.main touched the network:\n{result.stderr}")
+
+
+def app_main_ms(timings: list) -> float:
+    """Cumulative import time of app.main in one measure_imports() run."""
+    return next(c for _, c, m in timings if m == "app.main") / 1000
+
+
+def main(budget_ms: float, top: int, repeat: int):
+    # The best of a few runs, so a cold file cache does not fail the check
+    runs = [measure_imports() for _ in range(repeat)]
+    totals = [app_main_ms(timings) for timings in runs]
+    best = min(range(repeat), key=lambda i: totals[i])
+    total_ms = totals[best]
+
+    print(f"Slowest top-level imports of app.main (best of {repeat}):")
+    top_level = [t for t in runs[best] if "." not in t[2] or t[2].startswith("app.")]
+    for _, cumulative_us, module in sorted(top_level, reverse=True, key=lambda t: t[1])[:top]:
+        print(f"  {cumulative_us / 1000:>8.1f} ms  {module}")
+
+    check_no_network()
+    print("No network access at import")
+
+    print(f"import app.main: {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+    if total_ms > budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.budget_ms, args.top, args.repeat)
@@ -0,0 +1,683 @@
+# benchmarks/fakes.py
+"""
+In-process stand-ins for the services the app talks to, for benchmarks.
+
+FakeDatabase implements the subset of the Motor database/collection API the
+app uses, with hash indexes on `_id` and on the full key of every created
+index (compound ones also on their leading field), unique indexes enforced,
+an optional simulated round-trip time, and per-operation round-trip
+counters. Aggregations support simple $match/$group/$count pipelines only. FakeImgbbTransport answers Imgbb uploads after draining the body.
+"""
+import asyncio
+import copy
+import itertools
+import re
+from collections import defaultdict
+from types import SimpleNamespace
+
+import httpx
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+_MISSING = object()
+
+
+def get_path(document, path: str, default=None):
+    """Read a dotted path from a document."""
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return default
+    return value
+
+
+def set_path(document, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def unset_path(document, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def _compare(value, operator: str, operand) -> bool:
+    if operator == "$eq":
+        return value == operand or (isinstance(value, list) and operand in value)
+    if operator == "$ne":
+        return not _compare(value, "$eq", operand)
+    if operator == "$in":
+        if isinstance(value, list):
+            return any(item in operand for item in value)
+        return value in operand
+    if operator == "$nin":
+        return not _compare(value, "$in", operand)
+    if operator == "$exists":
+        return (value is not _MISSING) == bool(operand)
+    if operator == "$regex":
+        return isinstance(value, str) and re.search(operand, value) is not None
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if operator == "$gt":
+            return value > operand
+        if operator == "$gte":
+            return value >= operand
+        if operator == "$lt":
+            return value < operand
+        if operator == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+    raise NotImplementedError(f"Query operator {operator} is not supported")
+
+
+def matches(document: dict, query: dict) -> bool:
+    """Evaluate a MongoDB query filter against a document."""
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(document, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches(document, sub) for sub in condition):
+                return False
+            continue
+
+        value = get_path(document, key, _MISSING)
+        if isinstance(condition, dict) and condition and all(
+            operator.startswith("$") for operator in condition
+        ):
+            if not all(
+                _compare(value, operator, operand)
+                for operator, operand in condition.items()
+            ):
+                return False
+        elif isinstance(condition, re.Pattern):
+            if not (isinstance(value, str) and condition.search(value)):
+                return False
+        elif not _compare(None if value is _MISSING else value, "$eq", condition):
+            return False
+    return True
+
+
+def project(document: dict, projection) -> dict:
+    """Apply an inclusion or exclusion projection (with $slice) to a copy of a document."""
+    if not projection:
+        return copy.deepcopy(document)
+
+    slices = {}
+    fields = {}
+    for key, value in projection.items():
+        if isinstance(value, dict) and "$slice" in value:
+            slices[key] = value["$slice"]
+        else:
+            fields[key] = bool(value)
+
+    include_id = fields.pop("_id", True)
+    inclusion = any(fields.values())
+    if inclusion:
+        result = {}
+        for key in list(fields) + list(slices):
+            value = get_path(document, key, _MISSING)
+            if value is not _MISSING:
+                set_path(result, key, copy.deepcopy(value))
+    else:
+        result = copy.deepcopy(document)
+        for key in fields:
+            unset_path(result, key)
+
+    if include_id and "_id" in document:
+        result["_id"] = document["_id"]
+    else:
+        result.pop("_id", None)
+
+    for key, slice_ in slices.items():
+        value = get_path(result, key)
+        if isinstance(value, list):
+            if isinstance(slice_, list):
+                skip, limit = slice_
+                set_path(result, key, value[skip : skip + limit])
+            elif slice_ >= 0:
+                set_path(result, key, value[:slice_])
+            else:
+                set_path(result, key, value[slice_:])
+    return result
+
+
+def apply_update(document: dict, update: dict, inserting: bool = False):
+    for operator, changes in update.items():
+        for path, value in changes.items():
+            if operator == "$set":
+                set_path(document, path, copy.deepcopy(value))
+            elif operator == "$setOnInsert":
+                if inserting:
+                    set_path(document, path, copy.deepcopy(value))
+            elif operator == "$inc":
+                set_path(document, path, get_path(document, path, 0) + value)
+            elif operator == "$unset":
+                unset_path(document, path)
+            elif operator == "$push":
+                items = value["$each"] if isinstance(value, dict) else [value]
+                set_path(document, path, get_path(document, path, []) + list(items))
+            elif operator == "$addToSet":
+                items = value["$each"] if isinstance(value, dict) else [value]
+                current = get_path(document, path, [])
+                set_path(document, path, current + [i for i in items if i not in current])
+            else:
+                raise NotImplementedError(f"Update operator {operator} is not supported")
+
+
+def _sort_key(value):
+    # MongoDB orders missing/null before numbers before strings
+    if value is None or value is _MISSING:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, str(value))
+
+
+def sort_documents(documents: list, sort: list) -> list:
+    for field, direction in reversed(sort):
+        documents.sort(
+            key=lambda document: _sort_key(get_path(document, field, None)),
+            reverse=direction < 0,
+        )
+    return documents
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _results(self) -> list:
+        documents = self._collection._find(self._query)
+        if self._sort:
+            documents = sort_documents(documents, self._sort)
+        documents = documents[self._skip :]
+        if self._limit:
+            documents = documents[: self._limit]
+        return [project(document, self._projection) for document in documents]
+
+    async def to_list(self, length=None):
+        await self._collection._round_trip("find")
+        results = self._results()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await self._collection._round_trip("find")
+        for document in self._results():
+            yield document
+
+
+def _evaluate(document: dict, expression):
+    """
+    Value of a "$field" path, an $ifNull, $add or $strLenBytes expression or
+    a document of expressions; anything else is a literal.
+    """
+    if isinstance(expression, str) and expression.startswith("$"):
+        return get_path(document, expression[1:])
+    if isinstance(expression, dict) and "$ifNull" in expression:
+        for candidate in expression["$ifNull"]:
+            value = _evaluate(document, candidate)
+            if value is not None:
+                return value
+        return None
+    if isinstance(expression, dict) and "$add" in expression:
+        return sum(_evaluate(document, operand) for operand in expression["$add"])
+    if isinstance(expression, dict) and "$strLenBytes" in expression:
+        return len(_evaluate(document, expression["$strLenBytes"]).encode("utf-8"))
+    if isinstance(expression, dict) and not any(key.startswith("$") for key in expression):
+        return {key: _evaluate(document, value) for key, value in expression.items()}
+    return expression
+
+
+def run_pipeline(documents: list, pipeline: list) -> list:
+    """The $match, $group ($sum and $push), $sort, $limit and $count stages of an aggregation."""
+    for stage in pipeline:
+        (operator, argument), = stage.items()
+        if operator == "$match":
+            documents = [document for document in documents if matches(document, argument)]
+        elif operator == "$group":
+            groups = {}
+            for document in documents:
+                key = _evaluate(document, argument["_id"])
+                group = groups.setdefault(
+                    repr(key),
+                    {
+                        "_id": key,
+                        **{
+                            name: [] if "$push" in accumulator else 0
+                            for name, accumulator in argument.items()
+                            if name != "_id"
+                        },
+                    },
+                )
+                for name, accumulator in argument.items():
+                    if name == "_id":
+                        continue
+                    if "$push" in accumulator:
+                        group[name].append(_evaluate(document, accumulator["$push"]))
+                    else:
+                        group[name] += _evaluate(document, accumulator["$sum"]) or 0
+            documents = list(groups.values())
+        elif operator == "$sort":
+            documents = sort_documents(documents, list(argument.items()))
+        elif operator == "$limit":
+            documents = documents[:argument]
+        elif operator == "$count":
+            documents = [{argument: len(documents)}] if documents else []
+        else:
+            raise NotImplementedError(f"FakeCollection.aggregate does not support {operator}")
+    return documents
+
+
+class FakeAggregateCursor:
+    def __init__(self, collection, pipeline: list):
+        self._collection = collection
+        self._pipeline = pipeline
+
+    def _results(self) -> list:
+        return run_pipeline(self._collection._find({}), self._pipeline)
+
+    async def to_list(self, length=None):
+        await self._collection._round_trip("aggregate")
+        results = self._results()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await self._collection._round_trip("aggregate")
+        for document in self._results():
+            yield document
+
+
+class FakeCollection:
+    def __init__(self, database, name: str):
+        self.database = database
+        self.name = name
+        self._documents = {}  # _id -> document
+        self._indexes = {("_id",): defaultdict(set)}  # fields -> key values -> ids
+        self._unique = set()  # fields of unique indexes
+
+    # --- internals -------------------------------------------------------
+
+    async def _round_trip(self, operation: str):
+        self.database.stats["round_trips"] += 1
+        self.database.stats[f"{self.name}.{operation}"] += 1
+        if self.database.rtt:
+            await asyncio.sleep(self.database.rtt)
+
+    @staticmethod
+    def _key(document: dict, fields: tuple):
+        """Index key of `document`, or None if it has none of the fields."""
+        values = tuple(get_path(document, field) for field in fields)
+        if all(value is None for value in values):
+            return None
+        try:
+            hash(values)
+        except TypeError:
+            return None  # arrays and embedded documents are not indexed
+        return values
+
+    def _index(self, document: dict):
+        for fields, index in self._indexes.items():
+            key = self._key(document, fields)
+            if key is not None:
+                index[key].add(document["_id"])
+
+    def _unindex(self, document: dict):
+        for fields, index in self._indexes.items():
+            key = self._key(document, fields)
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(document["_id"])
+                if not ids:
+                    del index[key]
+
+    @staticmethod
+    def _lookup_values(query: dict, field: str):
+        """Values an indexed equality or $in condition on `field` allows, or None."""
+        if field not in query:
+            return None
+        condition = query[field]
+        if isinstance(condition, dict):
+            if set(condition) != {"$in"}:
+                return None
+            return condition["$in"]
+        return [condition]
+
+    def _candidates(self, query: dict):
+        """
+        Narrow the documents to scan with the index whose fields the query
+        constrains most, by equality or $in.
+        """
+        query = query or {}
+        best = None
+        for fields, index in self._indexes.items():
+            values = [self._lookup_values(query, field) for field in fields]
+            if any(value is None for value in values):
+                continue
+            if best is None or len(fields) > len(best[0]):
+                best = (fields, index, values)
+        if best is None:
+            return self._documents.values()
+
+        _, index, values = best
+        ids = set()
+        for key in itertools.product(*values):
+            try:
+                ids |= index.get(key, set())
+            except TypeError:
+                return self._documents.values()
+        return [self._documents[_id] for _id in ids]
+
+    def _find(self, query: dict) -> list:
+        return [doc for doc in self._candidates(query) if matches(doc, query)]
+
+    def _check_unique(self, document: dict):
+        for fields in self._unique:
+            key = self._key(document, fields)
+            if key is not None and self._indexes[fields].get(key, set()) - {document["_id"]}:
+                raise DuplicateKeyError(f"E11000 duplicate key {fields}: {key!r}")
+
+    def _insert(self, document: dict):
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._documents:
+            raise DuplicateKeyError(f"E11000 duplicate key _id: {document['_id']!r}")
+        self._check_unique(document)
+        stored = copy.deepcopy(document)
+        self._documents[stored["_id"]] = stored
+        self._index(stored)
+        return stored["_id"]
+
+    def _update(self, document: dict, update, inserting: bool = False):
+        if isinstance(update, list):
+            raise NotImplementedError("Pipeline updates are not supported")
+        self._unindex(document)
+        try:
+            apply_update(document, update, inserting)
+            self._check_unique(document)
+        finally:
+            self._index(document)
+
+    def _upsert(self, query: dict, update: dict):
+        document = {
+            key: value
+            for key, value in query.items()
+            if not key.startswith("$") and not isinstance(value, dict)
+        }
+        document.setdefault("_id", ObjectId())
+        apply_update(document, update, inserting=True)
+        return self._insert(document)
+
+    # --- public API ------------------------------------------------------
+
+    async def create_indexes(self, indexes: list):
+        await self._round_trip("createIndexes")
+        names = []
+        for index in indexes:
+            spec = index.document
+            fields = tuple(spec["key"])
+            self.create_index_on(fields, unique=spec.get("unique", False))
+            if len(fields) > 1:
+                # Serves queries on the leading field alone, as a prefix of the index would
+                self.create_index_on(fields[:1])
+            names.append(spec["name"])
+        return names
+
+    def create_index_on(self, fields, unique: bool = False):
+        """
+        Index `fields` (a field name or a tuple of them). A unique index over
+        documents that already repeat a key fails like MongoDB's.
+        """
+        if isinstance(fields, str):
+            fields = (fields,)
+        index = self._indexes.get(fields)
+        if index is None:
+            index = defaultdict(set)
+            for document in self._documents.values():
+                key = self._key(document, fields)
+                if key is not None:
+                    index[key].add(document["_id"])
+        if unique and any(len(ids) > 1 for ids in index.values()):
+            raise OperationFailure(
+                f"E11000 duplicate key error building unique index on {fields}", code=11000
+            )
+        self._indexes[fields] = index
+        if unique:
+            self._unique.add(fields)
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        await self._round_trip("find")
+        for document in self._candidates(query or {}):
+            if matches(document, query or {}):
+                return project(document, projection)
+        return None
+
+    def find(self, query=None, projection=None, **kwargs):
+        return FakeCursor(self, query or {}, projection)
+
+    def aggregate(self, pipeline: list, **kwargs):
+        return FakeAggregateCursor(self, pipeline)
+
+    async def count_documents(self, query, **kwargs):
+        await self._round_trip("count")
+        return len(self._find(query))
+
+    async def estimated_document_count(self, **kwargs):
+        await self._round_trip("count")
+        return len(self._documents)
+
+    async def insert_one(self, document: dict):
+        await self._round_trip("insert")
+        return SimpleNamespace(inserted_id=self._insert(document))
+
+    async def insert_many(self, documents: list, ordered: bool = True):
+        await self._round_trip("insert")
+        inserted_ids = []
+        write_errors = []
+        for position, document in enumerate(documents):
+            try:
+                inserted_ids.append(self._insert(document))
+            except DuplicateKeyError as e:
+                write_errors.append({"index": position, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError(
+                {"nInserted": len(inserted_ids), "writeErrors": write_errors}
+            )
+        return SimpleNamespace(inserted_ids=inserted_ids)
+
+    async def update_one(self, query: dict, update, upsert: bool = False):
+        await self._round_trip("update")
+        for document in self._candidates(query):
+            if matches(document, query):
+                self._update(document, update)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            _id = self._upsert(query, update)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=_id)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query: dict, update, upsert: bool = False):
+        await self._round_trip("update")
+        documents = self._find(query)
+        for document in documents:
+            self._update(document, update)
+        return SimpleNamespace(
+            matched_count=len(documents), modified_count=len(documents), upserted_id=None
+        )
+
+    async def find_one_and_update(
+        self,
+        query: dict,
+        update,
+        projection=None,
+        return_document=ReturnDocument.BEFORE,
+        upsert: bool = False,
+        **kwargs,
+    ):
+        await self._round_trip("findAndModify")
+        for document in self._candidates(query):
+            if matches(document, query):
+                before = project(document, projection)
+                self._update(document, update)
+                if return_document == ReturnDocument.AFTER:
+                    return project(document, projection)
+                return before
+        if upsert:
+            _id = self._upsert(query, update)
+            if return_document == ReturnDocument.AFTER:
+                return project(self._documents[_id], projection)
+        return None
+
+    async def delete_one(self, query: dict):
+        await self._round_trip("delete")
+        for document in self._candidates(query):
+            if matches(document, query):
+                self._unindex(document)
+                del self._documents[document["_id"]]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query: dict):
+        await self._round_trip("delete")
+        documents = self._find(query)
+        for document in documents:
+            self._unindex(document)
+            del self._documents[document["_id"]]
+        return SimpleNamespace(deleted_count=len(documents))
+
+    async def bulk_write(self, requests: list, ordered: bool = True):
+        await self._round_trip("bulkWrite")
+        counts = {"inserted": 0, "matched": 0, "modified": 0, "upserted": 0}
+        upserted_ids = {}
+        write_errors = []
+        for position, request in enumerate(requests):
+            kind = type(request).__name__
+            try:
+                if kind == "InsertOne":
+                    self._insert(copy.deepcopy(request._doc))
+                    counts["inserted"] += 1
+                elif kind in ("UpdateOne", "ReplaceOne"):
+                    update = request._doc
+                    if kind == "ReplaceOne":
+                        update = {"$set": update}
+                    for document in self._candidates(request._filter):
+                        if matches(document, request._filter):
+                            self._update(document, update)
+                            counts["matched"] += 1
+                            counts["modified"] += 1
+                            break
+                    else:
+                        if request._upsert:
+                            upserted_ids[position] = self._upsert(request._filter, update)
+                            counts["upserted"] += 1
+                else:
+                    raise NotImplementedError(f"{kind} is not supported")
+            except DuplicateKeyError as e:
+                write_errors.append({"index": position, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        details = {
+            "nInserted": counts["inserted"],
+            "nMatched": counts["matched"],
+            "nModified": counts["modified"],
+            "nUpserted": counts["upserted"],
+            "upserted": [{"index": i, "_id": _id} for i, _id in upserted_ids.items()],
+            "writeErrors": write_errors,
+        }
+        if write_errors:
+            raise BulkWriteError(details)
+        return SimpleNamespace(
+            inserted_count=counts["inserted"],
+            matched_count=counts["matched"],
+            modified_count=counts["modified"],
+            upserted_count=counts["upserted"],
+            upserted_ids=upserted_ids,
+            bulk_api_result=details,
+        )
+
+
+class FakeDatabase:
+    """Motor-compatible in-memory database; collections are created on first access."""
+
+    def __init__(self, rtt: float = 0.0):
+        self.rtt = rtt
+        self.stats = defaultdict(int)
+        self._collections = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def reset_stats(self):
+        self.stats.clear()
+
+
+class FakeImgbbTransport(httpx.AsyncBaseTransport):
+    """
+    Answers Imgbb uploads with a fixed URL after draining the request body.
+    Unlike httpx.MockTransport it does not buffer the body first.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.uploads = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async for _ in request.stream:
+            pass
+        self.uploads += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return httpx.Response(
+            200, json={"success": True, "data": {"url_viewer": "https://ibb.co/fake"}}
+        )
@@ -0,0 +1,17 @@
+# tests/test_import_time.py
+from benchmarks.check_import_time import (
+    BUDGET_MS,
+    app_main_ms,
+    check_no_network,
+    measure_imports,
+)
+
+
+def test_app_main_import_time_within_budget():
+    """Same measurement as benchmarks/check_import_time.py, best of three runs."""
+    best_ms = min(app_main_ms(measure_imports()) for _ in range(3))
+    assert best_ms <= BUDGET_MS, f"import app.main took {best_ms:.1f} ms (budget {BUDGET_MS} ms)"
+
+
+def test_app_main_import_does_not_touch_network():
+    check_no_network()
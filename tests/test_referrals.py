@@ -0,0 +1,50 @@
+# tests/test_referrals.py
+import asyncio
+import pytest
+from app import mongodb
+from app.services.user_service import fetch_users_referrals
+from benchmarks.fakes import FakeDatabase
+
+
+async def seed_referrer(database: FakeDatabase, referral_count: int):
+    referred = [
+        {"address": f"0xReferred{i}", "address_key": f"0xreferred{i}", "kleo_points": i}
+        for i in range(referral_count)
+    ]
+    referrer = {
+        "address": "0xReferrer",
+        "address_key": "0xreferrer",
+        "referrals": [
+            {"address": user["address"], "joining_date": 1700000000 + i}
+            for i, user in enumerate(referred)
+        ],
+    }
+    await database.users.create_indexes(mongodb.REQUIRED_INDEXES["users"])
+    await database.users.insert_many(referred + [referrer])
+
+
+@pytest.mark.parametrize("referral_count", [10, 1000, 10000])
+@pytest.mark.parametrize(
+    "page", [{}, {"limit": 50, "cursor": 5}, {"limit": 50, "sort_by_points": True}]
+)
+def test_fetch_users_referrals_round_trips(referral_count, page):
+    """Two queries whatever the number of referrals: the referrer and one $in lookup."""
+    database = FakeDatabase()
+    mongodb.db = database
+
+    async def run():
+        await seed_referrer(database, referral_count)
+        database.stats.clear()
+        return await fetch_users_referrals("0xREFERRER", **page)
+
+    try:
+        result = asyncio.run(run())
+    finally:
+        mongodb.db = None
+
+    assert database.stats["round_trips"] == 2
+    referrals = result["referrals"]
+    remaining = referral_count - page.get("cursor", 0)
+    assert len(referrals) == min(remaining, page.get("limit", remaining))
+    for referral in referrals:
+        assert referral["kleo_points"] == int(referral["address"][len("0xReferred") :])